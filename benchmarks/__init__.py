@@ -0,0 +1 @@
+"""ローカルの偽 IMAP サーバーを使ったベンチマーク群。"""
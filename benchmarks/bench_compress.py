@@ -0,0 +1,76 @@
+"""
+COMPRESS=DEFLATE の有無で、広告カテゴリの取得にかかる通信量と時間を比べるベンチマーク。
+
+    python benchmarks/bench_compress.py --num 10 50 --kind html
+    python benchmarks/bench_compress.py --bandwidth 2   # 2 Mbit/s 程度の回線を模擬して時間も比べる
+
+wire は回線上のバイト数、plain は展開後（IMAP のやり取りそのもの）のバイト数。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import KINDS, factory  # noqa: E402
+from benchmarks.fake_imap import FakeMailbox, start_server  # noqa: E402
+from mailreader.compress import CompressingIMAP4  # noqa: E402
+from mailreader.fetch import fetch_raw_messages, search_latest_uids, select_mailbox  # noqa: E402
+
+
+def _fetch(port, num, compress, bandwidth):
+    conn = CompressingIMAP4("127.0.0.1", port)
+    try:
+        conn.login("bench", "bench")
+        active = conn.start_compression() if compress else False
+        before = conn.wire_in + conn.wire_out
+        start = time.perf_counter()
+        box = select_mailbox(conn, "inbox")
+        uids = search_latest_uids(conn, "広告", num, uidnext=box["uidnext"])
+        raws = fetch_raw_messages(conn, uids)
+        elapsed = time.perf_counter() - start
+        counts = conn.byte_counts()
+    finally:
+        conn.logout()
+    wire = counts["wire_in"] + counts["wire_out"] - before
+    if bandwidth:
+        # ローカルでは回線が速すぎるので、回線上のバイト数から転送時間を足して見積もる
+        elapsed += wire * 8 / (bandwidth * 1_000_000)
+    return {"messages": len(raws), "compressed": active, "wire_bytes": wire,
+            "plain_in_bytes": counts["plain_in"], "seconds": round(elapsed, 4)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--num", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--kind", default="html", choices=("mixed",) + tuple(KINDS))
+    parser.add_argument("--size", type=int, default=300, help="メールボックスの通数")
+    parser.add_argument("--latency", type=float, default=0.0, help="コマンドごとの遅延（秒）")
+    parser.add_argument("--bandwidth", type=float, default=0.0,
+                        help="模擬する回線速度（Mbit/s、0 なら見積もらない）")
+    args = parser.parse_args(argv)
+
+    server, port = start_server(FakeMailbox(size=args.size, factory=factory(args.kind)),
+                                latency=args.latency, compress=True)
+    results = []
+    try:
+        for num in args.num:
+            plain = _fetch(port, num, False, args.bandwidth)
+            deflate = _fetch(port, num, True, args.bandwidth)
+            results.append({
+                "num": num,
+                "kind": args.kind,
+                "plain": plain,
+                "deflate": deflate,
+                "wire_ratio": round(deflate["wire_bytes"] / plain["wire_bytes"], 3),
+            })
+    finally:
+        server.shutdown()
+        server.server_close()
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+1 通ずつの FETCH と、まとめて 1 回の UID FETCH の比較ベンチマーク。
+
+    python benchmarks/bench_fetch.py --latency 0.02 --num 10 100 300
+"""
+import argparse
+import imaplib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_imap import FakeMailbox, start_server  # noqa: E402
+from mailreader.fetch import fetch_raw_messages, search_uids  # noqa: E402
+
+
+def _serial(conn, num):
+    # 変更前の fetch_mails と同じ取得方法
+    result, data = conn.search(None, "ALL")
+    ids = data[0].split()[-num:]
+    raws = []
+    for mail_id in reversed(ids):
+        result, msg_data = conn.fetch(mail_id, "(RFC822)")
+        raws.append(msg_data[0][1])
+    return raws
+
+
+def _batched(conn, num):
+    uids = search_uids(conn, "すべて")[-num:]
+    fetched = fetch_raw_messages(conn, uids)
+    return [fetched[u] for u in reversed(uids)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.02, help="コマンドごとの遅延（秒）")
+    parser.add_argument("--size", type=int, default=1000, help="メールボックスの通数")
+    parser.add_argument("--num", type=int, nargs="+", default=[10, 100, 300])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    server, port = start_server(FakeMailbox(size=args.size), latency=args.latency)
+    results = []
+    try:
+        conn = imaplib.IMAP4("127.0.0.1", port)
+        conn.login("bench", "bench")
+        conn.select("inbox")
+        for num in args.num:
+            row = {"num": num, "latency": args.latency}
+            for name, func in (("serial", _serial), ("batched", _batched)):
+                best = None
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    raws = func(conn, num)
+                    elapsed = time.perf_counter() - start
+                    assert len(raws) == min(num, args.size)
+                    best = elapsed if best is None else min(best, elapsed)
+                row[name + "_s"] = round(best, 4)
+            row["speedup"] = round(row["serial_s"] / row["batched_s"], 1)
+            results.append(row)
+        conn.logout()
+    finally:
+        server.shutdown()
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
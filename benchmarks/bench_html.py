@@ -0,0 +1,155 @@
+"""
+HTML メールの読み上げテキスト化ベンチマーク（従来の正規表現版と html.parser 版の比較）。
+
+    python benchmarks/bench_html.py --sizes 100 500 2000
+    python benchmarks/bench_html.py --corpus ~/mail-samples   # .html / .eml を置いたディレクトリ
+
+--corpus を指定しない場合は、style ブロック・テーブル・計測用 URL の多い
+大きな広告メールを模した HTML を生成して使う。加えて、閉じタグが "</style >" の
+ように崩れた HTML（従来の正規表現がほぼ三乗時間になる）も --unbalanced の件数分だけ測る。
+"""
+import argparse
+import email
+import json
+import os
+import re
+import sys
+import time
+from email import policy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mailreader.bodystructure import SPEECH_CHAR_BUDGET  # noqa: E402
+from mailreader.html_text import html_to_text  # noqa: E402
+
+
+def _legacy(html):
+    # 変更前の _html_to_text + remove_unreadable と同じ処理
+    text = re.sub(r"(?is)<(script|style).*?>.*?</\1>", "", html)
+    text = re.sub(r"(?is)<br\s*/?>", "\n", text)
+    text = re.sub(r"(?is)</p\s*>", "\n\n", text)
+    text = re.sub(r"(?is)<.*?>", "", text)
+    text = re.sub(r"[ \t]+", " ", text)
+    text = re.sub(r"\n\s*\n\s*\n+", "\n\n", text)
+    text = text.strip()
+    text = re.sub(r'https?://\S+|www\.\S+', '', text)
+    return re.sub(r'[^0-9A-Za-z぀-ヿ一-鿿。、．，・！？\s\n\r]', '', text)
+
+
+def _streaming(html):
+    return html_to_text(html, speech=True)
+
+
+def _streaming_budget(html):
+    return html_to_text(html, budget=SPEECH_CHAR_BUDGET, speech=True)
+
+
+def promo_html(kilobytes, seed=0):
+    """広告メール風の HTML をおよそ kilobytes KB 生成する。"""
+    head = ["<!DOCTYPE html><html><head><meta charset='utf-8'><title>期間限定セール</title>"]
+    # メール配信サービスが出力するような、メディアクエリごとの style ブロック
+    for i in range(40):
+        head.append(
+            f"<style type='text/css'>@media (max-width:{300 + i * 10}px) {{"
+            f" .col-{i} {{ width:100% !important; padding:{i}px; }}"
+            f" .btn-{i} a {{ color:#{i:06x}; }} }}</style>"
+        )
+    head.append("<script>window.dataLayer=[];</script></head><body>")
+    parts = ["".join(head)]
+    size = len(parts[0])
+    n = seed
+    while size < kilobytes * 1024:
+        n += 1
+        block = (
+            f"<table role='presentation' width='100%' cellpadding='0' cellspacing='0'"
+            f" style='border-collapse:collapse;mso-table-lspace:0pt;'><tr>"
+            f"<td class='col-{n % 40}' style='font-family:Helvetica,Arial;font-size:14px;'>"
+            f"<p>【商品{n}】本日限定&nbsp;{n % 9 + 1}0%OFF&amp;送料無料！</p>"
+            f"<p>詳しくはこちら<br>"
+            f"<a href='https://click.example.com/track?u={n:08d}&amp;c=promo'>"
+            f"https://click.example.com/track?u={n:08d}</a></p>"
+            f"<img src='https://pixel.example.com/open/{n:08d}.gif' width='1' height='1' alt=''>"
+            f"<style>.hide-{n} {{ display:none; }}</style>"
+            f"</td></tr></table>\n"
+        )
+        parts.append(block)
+        size += len(block)
+    parts.append("<p>配信停止はこちら https://example.com/unsubscribe</p></body></html>")
+    return "".join(parts)
+
+
+def unbalanced_html(blocks):
+    """閉じタグの崩れた style ブロックと本文中の "<" を含む HTML を生成する。"""
+    return "".join(
+        f"<style>.a{i} {{ color:red; }}</style ><p>商品{i} 価格 < 1000円</p>\n"
+        for i in range(blocks)
+    )
+
+
+def _html_from_eml(path):
+    with open(path, "rb") as f:
+        msg = email.message_from_binary_file(f, policy=policy.default)
+    part = msg.get_body(preferencelist=("html",))
+    return part.get_content() if part is not None else None
+
+
+def load_corpus(directory):
+    """ディレクトリ内の .html / .htm / .eml から HTML 本文を読み込む。"""
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        lower = name.lower()
+        if lower.endswith((".html", ".htm")):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                html = f.read()
+        elif lower.endswith(".eml"):
+            html = _html_from_eml(path)
+        else:
+            continue
+        if html:
+            corpus.append((name, html))
+    return corpus
+
+
+def _best(func, html, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = func(html)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 2000],
+                        help="生成する HTML の大きさ（KB）")
+    parser.add_argument("--corpus", help="実メール（.html / .eml）を置いたディレクトリ")
+    parser.add_argument("--unbalanced", type=int, nargs="*", default=[50, 100],
+                        help="崩れた HTML のブロック数（従来版が遅いので小さめに）")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.corpus:
+        corpus = load_corpus(os.path.expanduser(args.corpus))
+    else:
+        corpus = [(f"promo-{kb}KB", promo_html(kb)) for kb in args.sizes]
+        corpus += [(f"unbalanced-{n}", unbalanced_html(n)) for n in args.unbalanced]
+
+    funcs = (("legacy", _legacy), ("streaming", _streaming), ("streaming_budget", _streaming_budget))
+    results = []
+    for name, html in corpus:
+        row = {"mail": name, "html_kb": round(len(html) / 1024, 1)}
+        for label, func in funcs:
+            elapsed, out = _best(func, html, args.repeat)
+            row[label + "_s"] = round(elapsed, 4)
+            row[label + "_chars"] = len(out)
+        row["speedup"] = round(row["legacy_s"] / row["streaming_s"], 1)
+        row["speedup_budget"] = round(row["legacy_s"] / row["streaming_budget_s"], 1)
+        results.append(row)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
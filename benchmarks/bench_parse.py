@@ -0,0 +1,66 @@
+"""
+MIME 解析のスループット（通/秒）をワーカー数ごとに測るベンチマーク。
+
+    python benchmarks/bench_parse.py --count 400 --workers 1 2 4
+
+ワーカー数 1 はプロセスプールを使わずその場で解析する。
+メールは短い text/plain と、大きな HTML パートを含む multipart を半々で生成する。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import html_message  # noqa: E402
+from benchmarks.fake_imap import simple_message  # noqa: E402
+from mailreader.parse import parse_many  # noqa: E402
+
+
+def corpus(count, kilobytes):
+    return [
+        (str(uid).encode("ascii"),
+         html_message(uid, kilobytes) if uid % 2 else simple_message(uid))
+        for uid in range(1, count + 1)
+    ]
+
+
+def main(argv=None):
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=400, help="解析する通数")
+    parser.add_argument("--html-kb", type=int, default=60, help="HTML パートの大きさ（KB）")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, cpus} | {n for n in (4, 8) if n <= cpus}))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    items = corpus(args.count, args.html_kb)
+    results = []
+    for workers in args.workers:
+        # 1 回目はワーカープロセスの起動を含むので、起動時間として別に記録する
+        start = time.perf_counter()
+        parsed = parse_many(items, max_workers=workers, min_batch=0, min_bytes=0)
+        cold = time.perf_counter() - start
+        assert len(parsed) == len(items)
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            parse_many(items, max_workers=workers, min_batch=0, min_bytes=0)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append({
+            "workers": workers,
+            "cpus": cpus,
+            "messages": len(items),
+            "first_run_s": round(cold, 3),
+            "best_s": round(best, 3),
+            "msgs_per_s": round(len(items) / best, 1),
+        })
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+ベンチマーク用の合成メール（RFC822 の bytes）。
+
+実際の受信箱に近い取り合わせで測れるよう、次の種類を用意する。
+- plain: 短い UTF-8 の text/plain
+- multipart: text/plain と text/html の multipart/alternative
+- html: 大きな広告メール風 HTML だけのメール
+- iso2022jp: ISO-2022-JP（件名は B エンコード、本文は 7bit）の text/plain
+- attachment: 本文に PDF・画像の添付が付いた multipart/mixed
+
+    python -m benchmarks.corpus --out ~/mail-corpus --count 200   # .eml として書き出す
+"""
+import argparse
+import os
+import random
+import sys
+from email.mime.application import MIMEApplication
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.header import Header
+from email.utils import format_datetime, make_msgid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_html import promo_html  # noqa: E402
+from benchmarks.fake_imap import simple_message  # noqa: E402
+
+_SENTENCES = (
+    "いつもご利用いただきありがとうございます。",
+    "来週の打ち合わせの日程についてご連絡します。",
+    "添付の資料をご確認のうえ、ご意見をお聞かせください。",
+    "ご不明な点がございましたら、お気軽にお問い合わせください。",
+    "本日のお届け予定は午後三時から五時の間です。",
+)
+
+
+def _as_bytes(msg):
+    # IMAP サーバーが返すのと同じ CRLF 改行にする
+    return msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+
+
+def _headers(msg, uid, subject):
+    sent = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=uid)
+    msg["Subject"] = subject
+    msg["From"] = f"Sender{uid % 11} <sender{uid % 11}@example.com>"
+    msg["To"] = "user@example.com"
+    msg["Date"] = format_datetime(sent)
+    msg["Message-ID"] = make_msgid(str(uid))
+    return _as_bytes(msg)
+
+
+def _prose(uid, sentences):
+    rng = random.Random(uid)
+    return "\n".join(rng.choice(_SENTENCES) for _ in range(sentences))
+
+
+def plain_message(uid):
+    return simple_message(uid)
+
+
+def multipart_message(uid, html_kb=20):
+    msg = MIMEMultipart("alternative")
+    msg.attach(MIMEText(_prose(uid, 30), "plain", "utf-8"))
+    msg.attach(MIMEText(promo_html(html_kb, seed=uid), "html", "utf-8"))
+    return _headers(msg, uid, f"お知らせ {uid}")
+
+
+def html_message(uid, kilobytes=60):
+    msg = MIMEMultipart("alternative")
+    msg.attach(MIMEText(promo_html(kilobytes, seed=uid), "html", "utf-8"))
+    return _headers(msg, uid, f"期間限定セール {uid}")
+
+
+def iso2022jp_message(uid):
+    msg = MIMEText(_prose(uid, 40), "plain", "iso-2022-jp")
+    subject = Header(f"会議のご案内 {uid}", "iso-2022-jp").encode()
+    return _headers(msg, uid, subject)
+
+
+def attachment_message(uid, attachment_kb=256):
+    rng = random.Random(uid)
+    msg = MIMEMultipart("mixed")
+    msg.attach(MIMEText(_prose(uid, 20), "plain", "utf-8"))
+    pdf = b"%PDF-1.4\n" + rng.randbytes(attachment_kb * 1024)
+    part = MIMEApplication(pdf, "pdf")
+    part.add_header("Content-Disposition", "attachment", filename=f"資料{uid}.pdf")
+    msg.attach(part)
+    png = b"\x89PNG\r\n\x1a\n" + rng.randbytes(attachment_kb * 256)
+    image = MIMEImage(png, "png")
+    image.add_header("Content-Disposition", "attachment", filename=f"photo{uid}.png")
+    msg.attach(image)
+    return _headers(msg, uid, f"資料送付 {uid}")
+
+
+KINDS = {
+    "plain": plain_message,
+    "multipart": multipart_message,
+    "html": html_message,
+    "iso2022jp": iso2022jp_message,
+    "attachment": attachment_message,
+}
+
+
+def mixed_message(uid):
+    """uid ごとに種類を順番に切り替える（FakeMailbox の factory 用）。"""
+    kinds = tuple(KINDS.values())
+    return kinds[uid % len(kinds)](uid)
+
+
+def factory(kind):
+    """種類名（"mixed" または KINDS のキー）からメッセージ生成関数を返す。"""
+    if kind == "mixed":
+        return mixed_message
+    return KINDS[kind]
+
+
+def build(count, kind="mixed", start=1):
+    """[(uid(bytes), RFC822 の bytes), ...] を count 通作る。"""
+    make = factory(kind)
+    return [(str(uid).encode("ascii"), make(uid)) for uid in range(start, start + count)]
+
+
+def write_eml(directory, count, kind="mixed"):
+    """count 通を <uid>-<種類>.eml として書き出し、書き出したパスのリストを返す。"""
+    os.makedirs(directory, exist_ok=True)
+    names = tuple(KINDS)
+    paths = []
+    for uid, raw in build(count, kind):
+        label = kind if kind != "mixed" else names[int(uid) % len(names)]
+        path = os.path.join(directory, f"{int(uid):05d}-{label}.eml")
+        with open(path, "wb") as f:
+            f.write(raw)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ベンチマーク用の合成メールを .eml で書き出す")
+    parser.add_argument("--out", required=True, help="書き出し先のディレクトリ")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--kind", default="mixed", choices=("mixed",) + tuple(KINDS))
+    args = parser.parse_args(argv)
+    paths = write_eml(os.path.expanduser(args.out), args.count, args.kind)
+    print(f"{len(paths)} 通を {args.out} に書き出しました")
+
+
+if __name__ == "__main__":
+    main()
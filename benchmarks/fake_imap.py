@@ -0,0 +1,561 @@
+"""
+ベンチマーク用のローカル IMAP サーバー（平文、IMAP4rev1 のごく一部のみ）。
+
+実際の Gmail アカウントなしで取得処理の速度を測るためのもの。
+- コマンドごとに latency 秒の遅延を入れてネットワークの往復時間を模擬する
+- メッセージ本体は factory(uid) で必要になった時に生成する（大きなメールボックス用）
+- UID はシーケンス番号と一致しないようにずらしてある
+
+使い方:
+    server, port = start_server(FakeMailbox(size=500), latency=0.02)
+    conn = imaplib.IMAP4("127.0.0.1", port)
+
+単体のサーバーとして起動することもできる（benchmarks/corpus.py の合成メールを返す）:
+    python -m benchmarks.fake_imap --port 1143 --size 500 --latency 0.02 --kind mixed
+"""
+import argparse
+import base64
+import email
+import re
+import select
+import socketserver
+import threading
+import time
+import zlib
+from email.utils import format_datetime, make_msgid
+from datetime import datetime, timedelta, timezone
+
+CATEGORIES = ("primary", "promotions", "social")
+
+
+def simple_message(uid):
+    """既定のメッセージ生成関数（短い日本語の text/plain メール）。"""
+    sent = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=uid)
+    body = f"こんにちは。これはベンチマーク用のメール {uid} 通目です。\n" * 20
+    return (
+        f"From: Bench <bench{uid % 7}@example.com>\r\n"
+        f"To: user@example.com\r\n"
+        f"Subject: =?UTF-8?B?{_b64('ベンチマーク ' + str(uid))}?=\r\n"
+        f"Date: {format_datetime(sent)}\r\n"
+        f"Message-ID: {make_msgid(str(uid))}\r\n"
+        "MIME-Version: 1.0\r\n"
+        "Content-Type: text/plain; charset=utf-8\r\n"
+        "Content-Transfer-Encoding: 8bit\r\n"
+        "\r\n"
+    ).encode("ascii") + body.replace("\n", "\r\n").encode("utf-8")
+
+
+def _b64(text):
+    return base64.b64encode(text.encode("utf-8")).decode("ascii")
+
+
+class FakeMailbox:
+    """
+    size 通のメッセージを持つ INBOX。
+    - factory(uid) -> bytes でメッセージ本体を生成する（結果はキャッシュする）
+    - category(uid) -> "primary" / "promotions" / ... で Gmail のカテゴリを決める
+    """
+
+    def __init__(self, size=100, factory=simple_message, category=None,
+                 uid_offset=1000, uidvalidity=1):
+        self.size = size
+        self.factory = factory
+        self.category = category or (lambda uid: CATEGORIES[uid % len(CATEGORIES)])
+        self.uid_offset = uid_offset
+        self.uidvalidity = uidvalidity
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def uids(self):
+        return range(self.uid_offset + 1, self.uid_offset + self.size + 1)
+
+    def uid_of(self, seq):
+        return self.uid_offset + seq
+
+    def seq_of(self, uid):
+        return uid - self.uid_offset
+
+    def uidnext(self):
+        return self.uid_offset + self.size + 1
+
+    def raw(self, uid):
+        with self._lock:
+            data = self._cache.get(uid)
+        if data is None:
+            data = self.factory(uid)
+            with self._lock:
+                self._cache[uid] = data
+        return data
+
+    def append(self, count=1):
+        """新着メールを count 通追加する（IDLE や差分同期の検証用）。"""
+        with self._lock:
+            self.size += count
+
+
+def _parse_args(text):
+    """コマンド引数を素朴に分解する（括弧はそのまま 1 トークンにまとめる）。"""
+    out = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == " ":
+            i += 1
+        elif c == '"':
+            j = i + 1
+            buf = []
+            while j < len(text) and text[j] != '"':
+                if text[j] == "\\":
+                    j += 1
+                buf.append(text[j])
+                j += 1
+            out.append("".join(buf))
+            i = j + 1
+        elif c == "(":
+            depth = 0
+            j = i
+            while j < len(text):
+                if text[j] == "(":
+                    depth += 1
+                elif text[j] == ")":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                j += 1
+            out.append(text[i:j + 1])
+            i = j + 1
+        else:
+            j = i
+            depth = 0
+            while j < len(text) and (text[j] != " " or depth):
+                if text[j] == "[":
+                    depth += 1
+                elif text[j] == "]":
+                    depth -= 1
+                j += 1
+            out.append(text[i:j])
+            i = j
+    return out
+
+
+def _parse_set(spec, maximum):
+    """"1:3,7,9:*" 形式を数値の集合にする。"""
+    result = set()
+    for part in spec.split(","):
+        if ":" in part:
+            a, b = part.split(":", 1)
+            a = maximum if a == "*" else int(a)
+            b = maximum if b == "*" else int(b)
+            lo, hi = min(a, b), max(a, b)
+            result.update(range(lo, hi + 1))
+        else:
+            result.add(maximum if part == "*" else int(part))
+    return result
+
+
+class _InflateReader:
+    """COMPRESS DEFLATE 後の受信側（readline / read だけ）。"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._inflate = zlib.decompressobj(-15)
+        self._buf = bytearray()
+
+    def _fill(self):
+        data = self.raw.read1(65536)
+        if not data:
+            return False
+        self._buf += self._inflate.decompress(data)
+        return True
+
+    def readline(self):
+        while b"\n" not in self._buf:
+            if not self._fill():
+                break
+        end = self._buf.find(b"\n") + 1 or len(self._buf)
+        line = bytes(self._buf[:end])
+        del self._buf[:end]
+        return line
+
+    def read(self, size):
+        while len(self._buf) < size and self._fill():
+            pass
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+    def close(self):
+        self.raw.close()
+
+
+class _DeflateWriter:
+    """COMPRESS DEFLATE 後の送信側。flush のたびに Z_SYNC_FLUSH する。"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._deflate = zlib.compressobj(6, zlib.DEFLATED, -15)
+
+    def write(self, data):
+        self.raw.write(self._deflate.compress(data))
+
+    def flush(self):
+        self.raw.write(self._deflate.flush(zlib.Z_SYNC_FLUSH))
+        self.raw.flush()
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+    def close(self):
+        self.raw.close()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # 応答をまとめて書き出す（小さな send の連続で Nagle 遅延が乗らないように）
+    wbufsize = 1 << 16
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.wfile.write(data)
+
+    def handle(self):
+        self.send("* OK [CAPABILITY IMAP4rev1] fake imap ready\r\n")
+        self.wfile.flush()
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode("utf-8", "replace").rstrip("\r\n")
+            # LOGIN などのリテラル引数（{n}）を読み込む
+            while True:
+                m = re.search(r"\{(\d+)\}$", line)
+                if not m:
+                    break
+                self.send("+ go ahead\r\n")
+                self.wfile.flush()
+                literal = self.rfile.read(int(m.group(1))).decode("utf-8", "replace")
+                rest = self.rfile.readline().decode("utf-8", "replace").rstrip("\r\n")
+                line = line[:m.start()] + '"' + literal.replace('"', '\\"') + '"' + rest
+            tag, _, rest = line.partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            uid_mode = False
+            if command == "UID":
+                uid_mode = True
+                command, _, args = args.partition(" ")
+                command = command.upper()
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            handler = getattr(self, "cmd_" + command.replace("-", "_"), None)
+            if handler is None:
+                self.send(f"{tag} BAD unknown command\r\n")
+                self.wfile.flush()
+                continue
+            try:
+                keep_going = handler(tag, args, uid_mode)
+            except Exception as e:  # ベンチ用なので内部エラーは BAD で返す
+                self.send(f"{tag} BAD {e}\r\n")
+                self.wfile.flush()
+                continue
+            self.wfile.flush()
+            if keep_going is False:
+                return
+
+    # --- コマンド -------------------------------------------------------
+
+    def cmd_CAPABILITY(self, tag, args, uid_mode):
+        self.send(f"* CAPABILITY {' '.join(self.server.capabilities)}\r\n")
+        self.send(f"{tag} OK CAPABILITY completed\r\n")
+
+    def cmd_LOGIN(self, tag, args, uid_mode):
+        user, password = (_parse_args(args) + ["", ""])[:2]
+        expected = self.server.password
+        if expected is not None and password != expected:
+            self.send(f"{tag} NO [AUTHENTICATIONFAILED] Invalid credentials (Failure)\r\n")
+            return
+        self.send(f"{tag} OK {user} authenticated\r\n")
+
+    def cmd_LOGOUT(self, tag, args, uid_mode):
+        self.send("* BYE logging out\r\n")
+        self.send(f"{tag} OK LOGOUT completed\r\n")
+        self.wfile.flush()
+        return False
+
+    def cmd_COMPRESS(self, tag, args, uid_mode):
+        if "COMPRESS=DEFLATE" not in self.server.capabilities or args.strip().upper() != "DEFLATE":
+            self.send(f"{tag} BAD COMPRESS not supported\r\n")
+            return
+        self.send(f"{tag} OK DEFLATE active\r\n")
+        self.wfile.flush()
+        self.rfile = _InflateReader(self.rfile)
+        self.wfile = _DeflateWriter(self.wfile)
+
+    def cmd_NOOP(self, tag, args, uid_mode):
+        self.send(f"{tag} OK NOOP completed\r\n")
+
+    def cmd_IDLE(self, tag, args, uid_mode):
+        box = self.server.mailbox
+        known = box.size
+        self.send("+ idling\r\n")
+        self.wfile.flush()
+        while True:
+            ready, _, _ = select.select([self.connection], [], [], 0.05)
+            if box.size != known:
+                known = box.size
+                self.send(f"* {known} EXISTS\r\n")
+                self.wfile.flush()
+            if ready:
+                line = self.rfile.readline()
+                if not line:
+                    return False
+                if line.strip().upper() == b"DONE":
+                    break
+        self.send(f"{tag} OK IDLE terminated\r\n")
+
+    def cmd_SELECT(self, tag, args, uid_mode):
+        box = self.server.mailbox
+        self.send(f"* {box.size} EXISTS\r\n")
+        self.send("* 0 RECENT\r\n")
+        self.send(f"* OK [UIDVALIDITY {box.uidvalidity}] UIDs valid\r\n")
+        self.send(f"* OK [UIDNEXT {box.uidnext()}] Predicted next UID\r\n")
+        self.send(f"{tag} OK [READ-WRITE] SELECT completed\r\n")
+
+    cmd_EXAMINE = cmd_SELECT
+
+    def cmd_STATUS(self, tag, args, uid_mode):
+        box = self.server.mailbox
+        self.send(f"* STATUS INBOX (MESSAGES {box.size} UIDNEXT {box.uidnext()} "
+                  f"UIDVALIDITY {box.uidvalidity})\r\n")
+        self.send(f"{tag} OK STATUS completed\r\n")
+
+    def cmd_SEARCH(self, tag, args, uid_mode):
+        box = self.server.mailbox
+        tokens = _parse_args(args)
+        if tokens and tokens[0].upper() == "CHARSET":
+            tokens = tokens[2:]
+        matches = self._search(tokens)
+        nums = matches if uid_mode else [box.seq_of(u) for u in matches]
+        self.send("* SEARCH" + "".join(f" {n}" for n in nums) + "\r\n")
+        self.send(f"{tag} OK SEARCH completed\r\n")
+
+    def _search(self, tokens):
+        box = self.server.mailbox
+        uids = list(box.uids())
+        i = 0
+        while i < len(tokens):
+            key = tokens[i].upper()
+            if key == "ALL":
+                i += 1
+            elif key == "UID":
+                allowed = _parse_set(tokens[i + 1], box.uidnext() - 1)
+                uids = [u for u in uids if u in allowed]
+                i += 2
+            elif key == "X-GM-RAW":
+                query = tokens[i + 1]
+                m = re.search(r"category:(\w+)", query)
+                if m:
+                    uids = [u for u in uids if box.category(u) == m.group(1)]
+                i += 2
+            elif re.match(r"^[\d:*,]+$", key):
+                allowed = {box.uid_of(s) for s in _parse_set(key, box.size)}
+                uids = [u for u in uids if u in allowed]
+                i += 1
+            else:
+                raise ValueError(f"unsupported search key {key}")
+        return uids
+
+    def cmd_FETCH(self, tag, args, uid_mode):
+        box = self.server.mailbox
+        spec, _, items = args.partition(" ")
+        if uid_mode:
+            uids = sorted(u for u in _parse_set(spec, box.uidnext() - 1) if u in box.uids())
+        else:
+            uids = sorted(box.uid_of(s) for s in _parse_set(spec, box.size) if 1 <= s <= box.size)
+        items = items.strip()
+        if items.startswith("("):
+            items = items[1:-1]
+        wanted = _parse_args(items)
+        if uid_mode and not any(w.upper() == "UID" for w in wanted):
+            wanted.insert(0, "UID")
+        for uid in uids:
+            parts = []
+            for item in wanted:
+                parts.append(self._fetch_item(uid, item))
+            self.send(f"* {box.seq_of(uid)} FETCH (".encode("ascii") + b" ".join(parts) + b")\r\n")
+        self.send(f"{tag} OK FETCH completed\r\n")
+
+    def _fetch_item(self, uid, item):
+        box = self.server.mailbox
+        name = item.upper()
+        if name == "UID":
+            return f"UID {uid}".encode("ascii")
+        if name == "FLAGS":
+            return b"FLAGS ()"
+        if name == "RFC822.SIZE":
+            return f"RFC822.SIZE {len(box.raw(uid))}".encode("ascii")
+        if name == "INTERNALDATE":
+            return b'INTERNALDATE "01-Jan-2024 00:00:00 +0000"'
+        if name == "X-GM-MSGID":
+            return f"X-GM-MSGID {10 ** 15 + uid}".encode("ascii")
+        if name == "X-GM-LABELS":
+            return b'X-GM-LABELS ("\\\\Inbox")'
+        if name == "RFC822":
+            return _literal(b"RFC822", box.raw(uid))
+        if name == "BODYSTRUCTURE":
+            msg = email.message_from_bytes(box.raw(uid))
+            return b"BODYSTRUCTURE " + _bodystructure(msg).encode("utf-8")
+        m = re.match(r"^BODY(?:\.PEEK)?\[(.*)\](?:<(\d+)\.(\d+)>)?$", item, re.I)
+        if m:
+            section, origin, length = m.group(1), m.group(2), m.group(3)
+            data = self._section(uid, section)
+            label = f"BODY[{section}]"
+            if origin is not None:
+                data = data[int(origin):int(origin) + int(length)]
+                label += f"<{origin}>"
+            return _literal(label.encode("ascii"), data)
+        raise ValueError(f"unsupported fetch item {item}")
+
+    def _section(self, uid, section):
+        raw = self.server.mailbox.raw(uid)
+        upper = section.upper()
+        if upper == "":
+            return raw
+        head, _, _ = raw.partition(b"\r\n\r\n")
+        if upper == "HEADER":
+            return head + b"\r\n\r\n"
+        if upper == "TEXT":
+            return raw.partition(b"\r\n\r\n")[2]
+        if re.match(r"^[\d.]+$", upper):
+            return _part_body(email.message_from_bytes(raw), upper)
+        m = re.match(r"^HEADER\.FIELDS \((.*)\)$", upper)
+        if m:
+            fields = set(m.group(1).split())
+            # 添付の大きなメールでも本文まで解析しないよう、ヘッダー部分だけを読む
+            msg = email.message_from_bytes(head + b"\r\n\r\n")
+            lines = []
+            for key, value in msg.items():
+                if key.upper() in fields:
+                    lines.append(f"{key}: {value}\r\n")
+            return "".join(lines).encode("utf-8") + b"\r\n"
+        raise ValueError(f"unsupported section {section}")
+
+
+def _quote(value):
+    if value is None:
+        return "NIL"
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _params(pairs):
+    if not pairs:
+        return "NIL"
+    return "(" + " ".join(f"{_quote(k.upper())} {_quote(v)}" for k, v in pairs) + ")"
+
+
+def _raw_body(part):
+    # ヘッダーを除いた、転送エンコーディングされたままの本文
+    data = part.as_bytes()
+    for sep in (b"\r\n\r\n", b"\n\n"):
+        if sep in data:
+            return data.split(sep, 1)[1]
+    return b""
+
+
+def _bodystructure(part):
+    """email.message.Message から BODYSTRUCTURE 応答を組み立てる（主要フィールドのみ）。"""
+    if part.is_multipart() and part.get_content_maintype() == "multipart":
+        children = "".join(_bodystructure(p) for p in part.get_payload())
+        return f"({children} {_quote(part.get_content_subtype().upper())})"
+    maintype = part.get_content_maintype().upper()
+    subtype = part.get_content_subtype().upper()
+    params = [(k, v) for k, v in part.get_params()[1:]] if part.get_params() else []
+    encoding = (part.get("Content-Transfer-Encoding") or "7bit").upper()
+    body = _raw_body(part)
+    fields = [_quote(maintype), _quote(subtype), _params(params), "NIL", "NIL",
+              _quote(encoding), str(len(body))]
+    if maintype == "TEXT":
+        fields.append(str(body.count(b"\n")))
+    elif maintype == "MESSAGE" and subtype == "RFC822":
+        fields += ["NIL", _bodystructure(part.get_payload(0)), str(body.count(b"\n"))]
+    disposition = part.get("Content-Disposition")
+    if disposition:
+        kind, _, _ = disposition.partition(";")
+        filename = part.get_filename()
+        disp = f"({_quote(kind.strip().upper())} " + (
+            _params([("filename", filename)]) if filename else "NIL") + ")"
+    else:
+        disp = "NIL"
+    fields += ["NIL", disp, "NIL", "NIL"]
+    return "(" + " ".join(fields) + ")"
+
+
+def _part_body(msg, section):
+    """BODY[1.2] のようなパート番号で指定された本文（エンコードされたまま）を返す。"""
+    part = msg
+    for index in section.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(index) - 1]
+        elif index != "1":
+            raise ValueError(f"no such section {section}")
+    return _raw_body(part)
+
+
+def _literal(label, data):
+    return label + b" {" + str(len(data)).encode("ascii") + b"}\r\n" + data
+
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailbox, latency=0.0, password=None,
+                 capabilities=("IMAP4rev1", "IDLE", "X-GM-EXT-1", "UIDPLUS"), port=0,
+                 compress=False):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.mailbox = mailbox
+        self.latency = latency
+        self.password = password
+        self.capabilities = tuple(capabilities) + (("COMPRESS=DEFLATE",) if compress else ())
+
+
+def start_server(mailbox, latency=0.0, **kwargs):
+    """バックグラウンドスレッドでサーバーを起動し (server, port) を返す。"""
+    server = FakeIMAPServer(mailbox, latency=latency, **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, server.server_address[1]
+
+
+def main(argv=None):
+    from benchmarks.corpus import KINDS, factory
+
+    parser = argparse.ArgumentParser(description="ベンチマーク用のローカル IMAP サーバー")
+    parser.add_argument("--port", type=int, default=1143)
+    parser.add_argument("--size", type=int, default=500, help="メールボックスの通数")
+    parser.add_argument("--latency", type=float, default=0.02, help="コマンドごとの遅延（秒）")
+    parser.add_argument("--kind", default="mixed", choices=("mixed",) + tuple(KINDS),
+                        help="メールの種類")
+    parser.add_argument("--password", help="指定すると LOGIN でパスワードを確認する")
+    parser.add_argument("--compress", action="store_true", help="COMPRESS=DEFLATE に対応する")
+    args = parser.parse_args(argv)
+
+    server = FakeIMAPServer(FakeMailbox(size=args.size, factory=factory(args.kind)),
+                            latency=args.latency, password=args.password, port=args.port,
+                            compress=args.compress)
+    print(f"fake IMAP: 127.0.0.1:{server.server_address[1]} "
+          f"({args.size} 通, {args.kind}, 遅延 {args.latency} 秒)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
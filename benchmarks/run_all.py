@@ -0,0 +1,208 @@
+"""
+ベンチマークをまとめて実行し、バージョン間で比べられる JSON を出力する。
+
+    python benchmarks/run_all.py --out bench.json
+    python benchmarks/run_all.py --compare bench.json      # 前回の結果との比（change = 今回/前回）
+    python benchmarks/run_all.py --quick                   # 件数を減らして短時間で回す
+
+測るもの:
+- fetch: ローカルの偽 IMAP サーバーに対して、アプリ・バッチと同じ mailreader.core.fetch_window で
+  最新 num 通を取得する。cold は接続から（キャッシュも空）、warm はプール済みの接続を使い
+  （キャッシュは空）、cached はキャッシュ済みの状態で取得する。段階ごとの平均所要時間も
+  phases_avg_s に入れる。ローカルキャッシュは一時ファイル（MAIL_CACHE_PATH）を使う
+- get_best_body / html_to_text / remove_unreadable / parse_message: 合成メールの種類ごとの処理速度
+
+アプリ本体のスクリプトは読み込むと Streamlit の画面を組み立て始めるため直接は呼ばず、
+アプリが使っている mailreader.core の関数を呼ぶ。
+"""
+import argparse
+import email
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import KINDS, build, factory  # noqa: E402
+from benchmarks.fake_imap import FakeMailbox, start_server  # noqa: E402
+from mailreader.bodystructure import SPEECH_CHAR_BUDGET  # noqa: E402
+from mailreader.cache import get_cache  # noqa: E402
+from mailreader.core import Account, fetch_window, pool_for  # noqa: E402
+from mailreader.html_text import html_to_text, strip_unreadable  # noqa: E402
+from mailreader.metrics import get_registry  # noqa: E402
+from mailreader.parse import get_best_body, parse_message  # noqa: E402
+
+HOST = "127.0.0.1"
+
+
+def _measure(func, repeat):
+    """func() を repeat 回実行し、(最速, 中央値, 最後の戻り値) を返す。"""
+    times = []
+    out = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = func()
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times), out
+
+
+def _row(bench_id, items, best, median, **params):
+    row = {"id": bench_id, "items": items, "best_s": round(best, 6), "median_s": round(median, 6)}
+    if items:
+        row["per_item_ms"] = round(best * 1000 / items, 4)
+        row["items_per_s"] = round(items / best, 1) if best else None
+    row.update(params)
+    return row
+
+
+def bench_fetch(args):
+    mailbox = FakeMailbox(size=args.mailbox_size, factory=factory(args.kind))
+    # サーバー側でのメール生成が計測に入らないよう、取得される範囲を先に作っておく
+    for uid in list(mailbox.uids())[-max(args.num):]:
+        mailbox.raw(uid)
+    server, port = start_server(mailbox, latency=args.latency)
+    account = Account("bench@example.com", "bench", host=HOST, port=port, tls=False)
+    pool = pool_for(account)
+    cache = get_cache()
+    registry = get_registry()
+    results = []
+    try:
+        for num in args.num:
+            for headers_only in (True, False):
+                mode = "headers" if headers_only else "full"
+                for variant in ("cold", "warm", "cached"):
+                    cache.clear()
+                    pool.close_all()
+                    if variant != "cold":
+                        fetch_window(account, "すべて", num, headers_only)
+                    registry.reset()
+
+                    def run():
+                        if variant != "cached":
+                            cache.clear()
+                        if variant == "cold":
+                            pool.close_all()
+                        return fetch_window(account, "すべて", num, headers_only)
+
+                    best, median, mails = _measure(run, args.repeat)
+                    assert len(mails) == min(num, args.mailbox_size)
+                    phases = {
+                        r["phase"]: round(r["avg"], 6) for r in registry.snapshot()
+                    }
+                    results.append(_row(
+                        f"fetch/{mode}/{variant}/{num}", len(mails), best, median,
+                        latency=args.latency, kind=args.kind, phases_avg_s=phases,
+                    ))
+    finally:
+        pool.close_all()
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def bench_components(args):
+    results = []
+    for kind in KINDS:
+        items = build(args.count, kind)
+        messages = [email.message_from_bytes(raw) for _, raw in items]
+
+        best, median, bodies = _measure(lambda: [get_best_body(m) for m in messages], args.repeat)
+        results.append(_row(f"get_best_body/{kind}", len(messages), best, median))
+
+        htmls = []
+        for msg in messages:
+            for part in msg.walk():
+                if part.get_content_type() == "text/html":
+                    payload = part.get_payload(decode=True) or b""
+                    htmls.append(payload.decode(part.get_content_charset() or "utf-8", "replace"))
+        if htmls:
+            best, median, _ = _measure(
+                lambda: [html_to_text(h, budget=SPEECH_CHAR_BUDGET) for h in htmls], args.repeat)
+            results.append(_row(f"html_to_text/{kind}", len(htmls), best, median,
+                                avg_html_kb=round(sum(map(len, htmls)) / len(htmls) / 1024, 1)))
+
+        best, median, _ = _measure(lambda: [strip_unreadable(b) for b in bodies], args.repeat)
+        results.append(_row(f"remove_unreadable/{kind}", len(bodies), best, median))
+
+        best, median, _ = _measure(lambda: [parse_message(uid, raw) for uid, raw in items],
+                                   args.repeat)
+        results.append(_row(f"parse_message/{kind}", len(items), best, median,
+                            avg_message_kb=round(sum(len(r) for _, r in items) / len(items) / 1024, 1)))
+    return results
+
+
+def _git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, timeout=5, cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def compare(results, baseline_path):
+    """前回の JSON と id が一致する結果に baseline_best_s と change（今回/前回）を付ける。"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["id"]: r for r in json.load(f)["results"]}
+    for row in results:
+        old = baseline.get(row["id"])
+        if old and old.get("best_s"):
+            row["baseline_best_s"] = old["best_s"]
+            row["change"] = round(row["best_s"] / old["best_s"], 3)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--num", type=int, nargs="+", default=[10, 100, 300],
+                        help="fetch で取得する通数")
+    parser.add_argument("--mailbox-size", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.02, help="偽サーバーのコマンドごとの遅延（秒）")
+    parser.add_argument("--kind", default="mixed", choices=("mixed",) + tuple(KINDS),
+                        help="fetch で使うメールの種類")
+    parser.add_argument("--count", type=int, default=50, help="種類ごとの解析ベンチの通数")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", choices=("fetch", "components"), help="片方だけ実行する")
+    parser.add_argument("--quick", action="store_true", help="件数と回数を減らす")
+    parser.add_argument("--compare", help="比較する前回の結果（JSON）")
+    parser.add_argument("--out", help="結果を書き出すファイル（省略時は標準出力のみ）")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.num, args.count, args.repeat = [10, 50], 10, 1
+
+    results = []
+    if args.only in (None, "fetch"):
+        # 普段使っているキャッシュを消さないよう、取得結果は一時ファイルに入れる
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ["MAIL_CACHE_PATH"] = os.path.join(tmp, "bench.sqlite3")
+            results += bench_fetch(args)
+    if args.only in (None, "components"):
+        results += bench_components(args)
+    if args.compare:
+        compare(results, args.compare)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+"""
+メール自動読み上げアプリのバックエンド（Streamlit に依存しない部分）。
+
+Streamlit はスクリプト本体を再実行のたびに評価し直すが、import された
+モジュールはプロセス内で保持されるため、接続やキャッシュなど
+再実行をまたいで生かしたい状態はこのパッケージ側に置く。
+"""
@@ -0,0 +1,102 @@
+"""
+背景画像などの静的ファイルの配信準備。
+
+再実行のたびに画像を base64 にして <style> に埋め込むと、画像全体（＋約33%）が
+毎回 WebSocket で送られ、ブラウザのキャッシュも効かない。ここでは最初の 1 回だけ
+画像を Streamlit の静的ファイル置き場（static/）へ内容ハッシュ付きの名前で書き出し、
+以降は URL だけを返す。ファイル名が内容で変わるので、ブラウザは安心してキャッシュできる。
+- Pillow があれば横幅を max_width までに縮小し、WebP 版も作る（無ければ元画像をそのまま使う）
+- 静的ファイル配信が無効な環境向けに、data URI も一度だけ作って使い回せるようにする
+"""
+import base64
+import hashlib
+import os
+import shutil
+import threading
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow は任意
+    Image = None
+
+# Streamlit が static/ 以下を配信する URL の接頭辞（server.enableStaticServing）
+STATIC_URL_PREFIX = "app/static/"
+DEFAULT_MAX_WIDTH = 1920
+WEBP_QUALITY = 80
+
+_MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+}
+
+_published = {}
+_data_uris = {}
+_lock = threading.Lock()
+
+
+def image_mime(path):
+    return _MIME_TYPES.get(os.path.splitext(path)[1].lower(), "image/jpeg")
+
+
+def _source_key(path):
+    # 画像が差し替えられたら作り直すよう、更新時刻とサイズもキーに含める
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def _write_variants(src, static_dir, stem, max_width, webp):
+    with open(src, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    ext = os.path.splitext(src)[1].lower() or ".jpg"
+    name = f"{stem}-{digest}{ext}"
+    webp_name = f"{stem}-{digest}.webp"
+    os.makedirs(static_dir, exist_ok=True)
+    out = {"url": STATIC_URL_PREFIX + name, "mime": image_mime(src), "webp_url": None}
+
+    target = os.path.join(static_dir, name)
+    if Image is None:
+        if not os.path.exists(target):
+            shutil.copyfile(src, target)
+        return out
+
+    with Image.open(src) as img:
+        if img.width > max_width:
+            img = img.resize((max_width, round(img.height * max_width / img.width)))
+        if not os.path.exists(target):
+            save = img.convert("RGB") if out["mime"] == "image/jpeg" else img
+            save.save(target, optimize=True)
+        if webp:
+            webp_target = os.path.join(static_dir, webp_name)
+            if not os.path.exists(webp_target):
+                img.save(webp_target, "WEBP", quality=WEBP_QUALITY)
+            out["webp_url"] = STATIC_URL_PREFIX + webp_name
+    return out
+
+
+def publish_image(src, static_dir, stem="bg", max_width=DEFAULT_MAX_WIDTH, webp=True):
+    """
+    src を static_dir に内容ハッシュ付きの名前で書き出し、
+    {"url": 配信 URL, "mime": MIME タイプ, "webp_url": WebP 版の URL または None} を返す。
+    同じ画像について 2 回目以降は書き出さずに前回の結果を返す。
+    """
+    key = _source_key(src) + (os.path.abspath(static_dir), stem, max_width, webp)
+    with _lock:
+        if key not in _published:
+            _published[key] = _write_variants(src, static_dir, stem, max_width, webp)
+        return _published[key]
+
+
+def data_uri(src):
+    """静的ファイル配信が使えないとき用。src の data URI を一度だけ作って使い回す。"""
+    key = _source_key(src)
+    with _lock:
+        uri = _data_uris.get(key)
+        if uri is None:
+            with open(src, "rb") as f:
+                encoded = base64.b64encode(f.read()).decode("ascii")
+            uri = f"data:{image_mime(src)};base64,{encoded}"
+            _data_uris[key] = uri
+        return uri
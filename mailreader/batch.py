@@ -0,0 +1,355 @@
+"""
+読み上げ用のまとめを先に作っておくバッチ（Streamlit 非依存、cron などから実行する）。
+
+    MAIL_APP_PASSWORD=... python -m mailreader.batch --user me@gmail.com --category 広告 --num 50
+    python -m mailreader.batch --accounts accounts.txt --category 広告 --category メイン
+
+accounts.txt はアプリの「追加のアカウント」欄と同じく 1 行に「メールアドレス アプリパスワード」。
+次の段階をワーカー数を絞ったスレッドプールで流れ作業で進め、段階ごとの処理量を出力する。
+- sync: 一覧（ヘッダー）を取得する（Gmail はアプリと同じく全カテゴリを 1 回の接続で調べる）
+- body: キャッシュに無い本文を取得する（アカウントごとの同時接続数は --connections まで）
+- digest: 読み上げる文章と文ごとの区切りを JSON に書き出す
+- audio: 合成エンジン（espeak-ng）があれば音声を合成する
+
+本文はアプリと同じローカルキャッシュ（MAIL_CACHE_PATH）に、音声は同じ音声キャッシュ
+（MAIL_AUDIO_CACHE_DIR）に入るので、同じ設定でアプリを動かせば選んだメールは通信・合成せずに
+すぐ読み上げられる。まとめの JSON は --out（既定は MAIL_DIGEST_DIR か
+~/.cache/mail-reader/digests）の下に アカウント/UIDVALIDITY-UID.json として書く。
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from .core import Account, build_digest, fetch_gmail_window, fetch_mail_bodies, fetch_window
+from .gmail import is_gmail_host
+from .metrics import get_registry
+from .parse import PROCESS_MIN_BATCH
+from .tts import get_renderer
+
+DEFAULT_CATEGORY = "広告"
+DEFAULT_NUM = 50
+DEFAULT_WORKERS = 4
+# Gmail は同時接続数が多いと LOGIN を拒否するので、アカウントごとの接続は少なめにする
+DEFAULT_CONNECTIONS = 2
+# 本文の取得 1 回（1 本の接続・SELECT 1 回）でまとめて取得する通数
+# （テキスト化をプロセスプールでまとめて行えるよう、プールを使う最小件数に合わせる）
+BODY_CHUNK = PROCESS_MIN_BATCH
+STAGES = ("sync", "body", "digest", "audio")
+
+logger = logging.getLogger("mailreader.batch")
+
+
+def default_digest_dir():
+    """環境変数 MAIL_DIGEST_DIR が無ければ ~/.cache/mail-reader/digests を使う。"""
+    path = os.environ.get("MAIL_DIGEST_DIR")
+    if path:
+        return path
+    return os.path.join(os.path.expanduser("~"), ".cache", "mail-reader", "digests")
+
+
+class StageStats:
+    """
+    段階ごとの処理量。busy_s はワーカーが処理に使った時間の合計、wall_s は最初の開始から
+    最後の終了までの時間（並列に動いた分だけ busy_s より短くなる）。
+    """
+
+    def __init__(self):
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage):
+        """with stats.measure("body") as done: ... done(件数) の形で使う。例外は失敗として数える。"""
+        items = [0]
+        start = time.perf_counter()
+        try:
+            yield lambda n=1: items.__setitem__(0, items[0] + n)
+        except Exception:
+            self._add(stage, 0, start, time.perf_counter(), error=True)
+            raise
+        self._add(stage, items[0], start, time.perf_counter())
+
+    def _add(self, stage, items, start, end, error=False):
+        with self._lock:
+            row = self._rows.setdefault(stage, {"tasks": 0, "items": 0, "errors": 0, "busy": 0.0,
+                                                "first": start, "last": end})
+            row["tasks"] += 1
+            row["items"] += items
+            row["errors"] += int(error)
+            row["busy"] += end - start
+            row["first"] = min(row["first"], start)
+            row["last"] = max(row["last"], end)
+
+    def report(self):
+        out = []
+        with self._lock:
+            for stage in sorted(self._rows, key=lambda s: STAGES.index(s) if s in STAGES else 99):
+                row = self._rows[stage]
+                wall = row["last"] - row["first"]
+                out.append({
+                    "stage": stage,
+                    "tasks": row["tasks"],
+                    "items": row["items"],
+                    "errors": row["errors"],
+                    "busy_s": round(row["busy"], 4),
+                    "wall_s": round(wall, 4),
+                    "items_per_s": round(row["items"] / wall, 1) if wall > 0 else None,
+                })
+        return out
+
+
+def _slug(text):
+    # ファイル名に使えない文字を置き換える（日本語のカテゴリ名はそのまま残す）
+    return re.sub(r'[\\/:*?"<>|\s]+', "_", text).strip("_") or "_"
+
+
+def _write_json(path, data):
+    # 書きかけのファイルを読まれないよう、一時ファイルに書いてから置き換える
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class BatchRun:
+    """
+    1 回分のバッチ。run() は段階ごとの処理量を含む結果の dict を返す。
+    ネットワーク待ちの sync / body と、CPU を使う audio は別のスレッドプールで進める。
+    """
+
+    def __init__(self, accounts, categories=(DEFAULT_CATEGORY,), num=DEFAULT_NUM, out_dir=None,
+                 workers=DEFAULT_WORKERS, connections=DEFAULT_CONNECTIONS, renderer=None,
+                 audio_workers=None, chunk=BODY_CHUNK):
+        self.accounts = list(accounts)
+        self.categories = list(categories)
+        self.num = num
+        self.out_dir = out_dir or default_digest_dir()
+        self.workers = workers
+        self.renderer = renderer
+        self.audio_workers = audio_workers or min(workers, os.cpu_count() or 1)
+        self.chunk = chunk
+        self.stats = StageStats()
+        self.errors = []
+        self._limits = {a.cache_account: threading.BoundedSemaphore(connections)
+                        for a in self.accounts}
+        self._mails = {}     # (アカウント, uidvalidity, uid) -> 一覧のメール dict
+        self._indexes = {}   # アカウント -> {カテゴリ: [まとめの概要, ...]}
+        self._summaries = {}  # (アカウント, uidvalidity, uid) -> まとめの概要（index.json 用）
+        self._pending = {}   # Future -> 完了時に呼ぶ関数
+
+    # --- 各段階（ワーカースレッドで実行する） ---
+
+    def _sync(self, account, category):
+        with self._limits[account.cache_account], self.stats.measure("sync") as done:
+            mails = fetch_window(account, category, self.num, headers_only=True)
+            done(len(mails))
+        return mails
+
+    def _sync_gmail(self, account):
+        with self._limits[account.cache_account], self.stats.measure("sync") as done:
+            by_category = fetch_gmail_window(account, self.num, self.categories)
+            done(sum(len(mails) for mails in by_category.values()))
+        return by_category
+
+    def _bodies(self, account, uidvalidity, uids):
+        with self._limits[account.cache_account], self.stats.measure("body") as done:
+            bodies = fetch_mail_bodies(account, uids, uidvalidity)
+            done(len(uids))
+        return bodies
+
+    def _audio(self, text):
+        with self.stats.measure("audio") as done:
+            self.renderer.render(text)
+            done()
+
+    # --- 段階のつなぎ（メインスレッドで実行する） ---
+
+    def _submit(self, executor, then, fn, *args):
+        self._pending[executor.submit(fn, *args)] = then
+
+    def _on_synced(self, account, category, mails):
+        key = account.cache_account
+        index = self._indexes.setdefault(key, {})
+        index[category] = []
+        missing = {}
+        for mail in mails:
+            mail_key = (key, mail["uidvalidity"], str(mail["uid"]))
+            index[category].append(mail_key)
+            if mail_key in self._mails:
+                # 別のカテゴリで取得済み・取得中のメール
+                continue
+            self._mails[mail_key] = mail
+            if mail["body"] is not None:
+                self._on_body(mail_key, mail["body"], mail["readable"])
+            else:
+                missing.setdefault(mail["uidvalidity"], []).append(str(mail["uid"]))
+        for uidvalidity, uids in missing.items():
+            for i in range(0, len(uids), self.chunk):
+                batch = uids[i:i + self.chunk]
+                self._submit(self._net, lambda bodies, uv=uidvalidity: [
+                    self._on_body((key, uv, uid), *body) for uid, body in bodies.items()
+                ], self._bodies, account, uidvalidity, batch)
+
+    def _on_body(self, mail_key, body, readable):
+        mail = self._mails[mail_key]
+        with self.stats.measure("digest") as done:
+            digest = build_digest(mail, body, readable)
+            if self.renderer is not None:
+                digest["audio_key"] = self.renderer.key(digest["text"])
+            account_dir = os.path.join(self.out_dir, _slug(mail_key[0]))
+            os.makedirs(account_dir, exist_ok=True)
+            name = f"{mail_key[1]}-{mail_key[2]}.json"
+            _write_json(os.path.join(account_dir, name), digest)
+            done()
+        self._summaries[mail_key] = {
+            "uid": digest["uid"], "uidvalidity": digest["uidvalidity"],
+            "subject": digest["subject"], "from": digest["from"], "date": digest["date"],
+            "digest": name, "audio": False,
+        }
+        if self.renderer is not None:
+            self._submit(self._tts, lambda _: self._summaries[mail_key].update(audio=True),
+                         self._audio, digest["text"])
+
+    def _write_indexes(self):
+        for key, index in self._indexes.items():
+            account_dir = os.path.join(self.out_dir, _slug(key))
+            os.makedirs(account_dir, exist_ok=True)
+            _write_json(os.path.join(account_dir, "index.json"), {
+                "account": key,
+                "updated": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "categories": {
+                    category: [self._summaries[k] for k in keys if k in self._summaries]
+                    for category, keys in index.items()
+                },
+            })
+
+    def run(self):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="batch") as self._net, \
+                ThreadPoolExecutor(self.audio_workers, thread_name_prefix="batch-tts") as self._tts:
+            for account in self.accounts:
+                if is_gmail_host(account.imap_host):
+                    self._submit(self._net, lambda by_category, a=account: [
+                        self._on_synced(a, c, mails) for c, mails in by_category.items()
+                    ], self._sync_gmail, account)
+                    continue
+                for category in self.categories:
+                    self._submit(self._net, lambda mails, a=account, c=category: self._on_synced(a, c, mails),
+                                 self._sync, account, category)
+            while self._pending:
+                done, _ = wait(list(self._pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    then = self._pending.pop(future)
+                    try:
+                        then(future.result())
+                    except Exception as e:
+                        # 1 件の失敗で全体を止めず、記録して残りを続ける
+                        logger.warning("batch task failed: %s", e)
+                        self.errors.append(str(e))
+        self._write_indexes()
+        return {
+            "out": self.out_dir,
+            "accounts": len(self.accounts),
+            "categories": self.categories,
+            "mails": len(self._summaries),
+            "audio": self.renderer is not None,
+            "elapsed_s": round(time.perf_counter() - start, 4),
+            "stages": self.stats.report(),
+            "errors": self.errors,
+        }
+
+
+def read_accounts(path):
+    """1 行に「メールアドレス アプリパスワード」のファイルを読む（# で始まる行は無視する）。"""
+    accounts = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and not parts[0].startswith("#"):
+                # アプリパスワードは空白区切りで表示されるのでそのまま連結する
+                accounts.append((parts[0], " ".join(parts[1:])))
+    return accounts
+
+
+def _format_table(stages):
+    lines = [f"{'stage':<8}{'tasks':>7}{'items':>7}{'errors':>7}{'busy_s':>10}{'wall_s':>10}{'items/s':>10}"]
+    for row in stages:
+        rate = "-" if row["items_per_s"] is None else f"{row['items_per_s']:.1f}"
+        lines.append(f"{row['stage']:<8}{row['tasks']:>7}{row['items']:>7}{row['errors']:>7}"
+                     f"{row['busy_s']:>10.3f}{row['wall_s']:>10.3f}{rate:>10}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--user", action="append", default=[],
+                        help="取得するアドレス（パスワードは環境変数 MAIL_APP_PASSWORD）")
+    parser.add_argument("--accounts", help="1 行に「メールアドレス アプリパスワード」のファイル")
+    parser.add_argument("--category", action="append", choices=("すべて", "メイン", "広告"),
+                        help=f"取得するカテゴリ（複数指定可、既定は {DEFAULT_CATEGORY}）")
+    parser.add_argument("--num", type=int, default=DEFAULT_NUM, help="カテゴリごとの通数")
+    parser.add_argument("--out", help="まとめを書き出すディレクトリ")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="取得のワーカー数")
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS,
+                        help="アカウントごとの同時接続数の上限")
+    parser.add_argument("--audio", choices=("auto", "on", "off"), default="auto",
+                        help="音声を合成するか（auto は合成エンジンがあれば合成する）")
+    parser.add_argument("--imap-host", help="接続先を HOST[:PORT] で指定する（検証用サーバーなど）")
+    parser.add_argument("--no-tls", action="store_true", help="TLS を使わずに接続する（検証用）")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    credentials = read_accounts(args.accounts) if args.accounts else []
+    if args.user:
+        password = os.environ.get("MAIL_APP_PASSWORD")
+        if not password:
+            parser.error("--user を使うときは環境変数 MAIL_APP_PASSWORD にパスワードを設定してください")
+        credentials += [(user, password) for user in args.user]
+    if not credentials:
+        parser.error("--user か --accounts で取得するアカウントを指定してください")
+
+    host, port = None, None
+    if args.imap_host:
+        host, _, port = args.imap_host.partition(":")
+        port = int(port) if port else None
+    accounts = [Account(user, password, host=host, port=port, tls=not args.no_tls)
+                for user, password in credentials]
+
+    renderer = None
+    if args.audio != "off":
+        renderer = get_renderer()
+        if renderer is None and args.audio == "on":
+            parser.error("音声の合成エンジン（espeak-ng）が見つかりません")
+
+    result = BatchRun(accounts, args.category or [DEFAULT_CATEGORY], num=args.num, out_dir=args.out,
+                      workers=args.workers, connections=args.connections, renderer=renderer).run()
+    if args.json:
+        result["phases"] = get_registry().snapshot()
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print(_format_table(result["stages"]))
+        print(f"{result['mails']} mails in {result['elapsed_s']:.2f}s -> {result['out']}"
+              + ("" if result["audio"] else " (audio: off)"))
+        for error in result["errors"]:
+            print(f"error: {error}", file=sys.stderr)
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+BODYSTRUCTURE を使った本文の部分取得。
+
+RFC822 全体を落としてから添付を読み飛ばすと、20 MB の PDF 付きメールでも
+20 MB 転送することになる。先に BODYSTRUCTURE で構造だけを取得し、
+text/plain（無ければ text/html）のパートだけを BODY.PEEK[n]<0.上限> で取得する。
+"""
+import base64
+import binascii
+import codecs
+import quopri
+import re
+
+from .fetch import fetch_items, uid_bytes
+from .response import find_item
+
+# 読み上げに使う本文の文字数の目安（これより先は読み上げ前に切り捨てて構わない）
+SPEECH_CHAR_BUDGET = 5000
+
+# 1 文字あたりの転送バイト数の見積もり（UTF-8 の日本語は 3 バイト）
+_BYTES_PER_CHAR = {"base64": 4, "quoted-printable": 9}
+# HTML はタグやインライン CSS の分だけ本文より大きくなる
+_HTML_OVERHEAD = 8
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode("ascii", "replace")
+    return ""
+
+
+def _params(value):
+    params = {}
+    if isinstance(value, list):
+        for i in range(0, len(value) - 1, 2):
+            params[_text(value[i]).lower()] = _text(value[i + 1])
+    return params
+
+
+def parse_bodystructure(node, section=""):
+    """
+    BODYSTRUCTURE の入れ子リストをパートのリストへ平坦化する。
+    各パートは {"section", "type", "charset", "encoding", "size", "disposition"} の dict。
+    """
+    if not isinstance(node, list) or not node:
+        return []
+    if isinstance(node[0], list):
+        # マルチパート: 子パートの並びの後にサブタイプが続く
+        parts = []
+        index = 0
+        for child in node:
+            if not isinstance(child, list):
+                break
+            index += 1
+            child_section = f"{section}.{index}" if section else str(index)
+            parts.extend(parse_bodystructure(child, child_section))
+        return parts
+
+    maintype = _text(node[0]).lower()
+    subtype = _text(node[1]).lower() if len(node) > 1 else ""
+    params = _params(node[2]) if len(node) > 2 else {}
+    encoding = _text(node[5]).lower() if len(node) > 5 else "7bit"
+    try:
+        size = int(node[6]) if len(node) > 6 and node[6] is not None else 0
+    except ValueError:
+        size = 0
+    # 拡張フィールド: text は lines の後、message/rfc822 は envelope/body/lines の後
+    if maintype == "text":
+        ext = 8
+    elif maintype == "message" and subtype == "rfc822":
+        ext = 10
+    else:
+        ext = 7
+    disposition = ""
+    if len(node) > ext + 1 and isinstance(node[ext + 1], list) and node[ext + 1]:
+        disposition = _text(node[ext + 1][0]).lower()
+    return [{
+        # 非マルチパートのメッセージ本体はパート番号 1 として扱う
+        "section": section or "1",
+        "type": f"{maintype}/{subtype}",
+        "charset": params.get("charset") or "utf-8",
+        "encoding": encoding,
+        "size": size,
+        "disposition": disposition,
+    }]
+
+
+def choose_text_parts(parts):
+    """添付でない最初の text/plain と text/html を返す（無ければ None）。"""
+    plain = html = None
+    for part in parts:
+        if part["disposition"] == "attachment":
+            continue
+        if part["type"] == "text/plain" and plain is None:
+            plain = part
+        elif part["type"] == "text/html" and html is None:
+            html = part
+    return plain, html
+
+
+def byte_cap(part, char_budget=SPEECH_CHAR_BUDGET):
+    """読み上げに使える文字数から、パートを何バイトまで取得すれば足りるかを見積もる。"""
+    if char_budget is None:
+        return None
+    cap = char_budget * _BYTES_PER_CHAR.get(part["encoding"], 3)
+    if part["type"] == "text/html":
+        cap *= _HTML_OVERHEAD
+    return cap
+
+
+def decode_part(data, encoding, charset):
+    """
+    転送エンコーディングと文字コードを解いて文字列にする。
+    途中で切り詰めたデータでも壊れた末尾だけを捨てて読めるところまで復元する。
+    """
+    encoding = (encoding or "").lower()
+    if encoding == "base64":
+        compact = re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+        compact = compact[:len(compact) - len(compact) % 4]
+        try:
+            payload = base64.b64decode(compact)
+        except (binascii.Error, ValueError):
+            payload = b""
+    elif encoding == "quoted-printable":
+        # 末尾で切れた "=" や "=X" を落としてからデコードする
+        payload = quopri.decodestring(re.sub(rb"=[0-9A-Fa-f]?$", b"", data))
+    else:
+        payload = data
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = "utf-8"
+    return payload.decode(charset, errors="ignore")
+
+
+def fetch_text_body(conn, uid, char_budget=SPEECH_CHAR_BUDGET):
+    """
+    SELECT 済みの接続で uid の本文パートだけを取得する。
+    (content-type, デコード済み文字列) を返し、テキストパートが無ければ None を返す。
+    BODYSTRUCTURE が取得・解析できなかった場合は ValueError を送出する。
+    """
+    key = uid_bytes(uid)
+    msg = fetch_items(conn, [key], "BODYSTRUCTURE").get(key)
+    structure = find_item(msg, "BODYSTRUCTURE") if msg else None
+    if not isinstance(structure, list):
+        raise ValueError(f"BODYSTRUCTURE unavailable for UID {uid}")
+    plain, html = choose_text_parts(parse_bodystructure(structure))
+    for part in (plain, html):
+        if part is None:
+            continue
+        cap = byte_cap(part, char_budget)
+        partial = f"<0.{cap}>" if cap is not None and cap < part["size"] else ""
+        section = part["section"]
+        fetched = fetch_items(conn, [key], f"BODY.PEEK[{section}]{partial}").get(key)
+        data = find_item(fetched, f"BODY[{section}]") if fetched else None
+        if not isinstance(data, bytes):
+            continue
+        text = decode_part(data, part["encoding"], part["charset"])
+        # text/plain が空なら text/html を使う（_get_best_body と同じ優先順位）
+        if text.strip():
+            return part["type"], text
+    return None
@@ -0,0 +1,206 @@
+"""
+取得済みメールの SQLite キャッシュ。
+
+(アカウント, メールボックス, UIDVALIDITY, UID) をキーに、デコード済みの
+件名・差出人・日付・本文と remove_unreadable 済みの本文を保存する。
+- UIDVALIDITY が変わったメールボックスのキャッシュは丸ごと破棄する
+- 合計サイズが max_bytes を超えたら最後に参照された時刻が古いものから削除する
+"""
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mailboxes (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    PRIMARY KEY (account, mailbox)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    subject TEXT,
+    sender TEXT,
+    date TEXT,
+    body TEXT,
+    readable TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (account, mailbox, uidvalidity, uid)
+);
+CREATE INDEX IF NOT EXISTS messages_last_access ON messages (last_access);
+"""
+
+
+def default_cache_path():
+    """環境変数 MAIL_CACHE_PATH が無ければ ~/.cache/mail-reader/mails.sqlite3 を使う。"""
+    path = os.environ.get("MAIL_CACHE_PATH")
+    if path:
+        return path
+    return os.path.join(os.path.expanduser("~"), ".cache", "mail-reader", "mails.sqlite3")
+
+
+def _row_size(*values):
+    return sum(len(v) for v in values if v)
+
+
+class MailCache:
+    """
+    スレッドセーフな SQLite キャッシュ（接続は 1 本をロックで共有する）。
+    path に ":memory:" を渡すとプロセス内だけのキャッシュになる。
+    """
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path or default_cache_path()
+        self.max_bytes = max_bytes
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            if self.path != ":memory:":
+                self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+
+    def sync_uidvalidity(self, account, mailbox, uidvalidity):
+        """
+        SELECT で得た UIDVALIDITY を記録する。
+        以前と値が変わっていればそのメールボックスのキャッシュを破棄して True を返す。
+        """
+        uidvalidity = int(uidvalidity)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT uidvalidity FROM mailboxes WHERE account = ? AND mailbox = ?",
+                (account, mailbox)).fetchone()
+            if row is not None and row[0] == uidvalidity:
+                return False
+            self._db.execute("BEGIN")
+            self._db.execute(
+                "DELETE FROM messages WHERE account = ? AND mailbox = ?", (account, mailbox))
+            self._db.execute(
+                "INSERT OR REPLACE INTO mailboxes (account, mailbox, uidvalidity) VALUES (?, ?, ?)",
+                (account, mailbox, uidvalidity))
+            self._db.execute("COMMIT")
+            return row is not None
+
+    def get_many(self, account, mailbox, uidvalidity, uids):
+        """
+        キャッシュ済みのメールを {uid(int): dict} で返す。
+        dict のキーは uid / subject / from / date / body / readable（本文未取得なら None）。
+        """
+        uids = [int(u) for u in uids]
+        if not uids:
+            return {}
+        out = {}
+        now = time.time()
+        with self._lock:
+            # SQLite の変数上限を超えないよう分割して問い合わせる
+            for i in range(0, len(uids), 500):
+                chunk = uids[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                params = (account, mailbox, int(uidvalidity), *chunk)
+                rows = self._db.execute(
+                    "SELECT uid, subject, sender, date, body, readable FROM messages "
+                    f"WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid IN ({marks})",
+                    params).fetchall()
+                for uid, subject, sender, date, body, readable in rows:
+                    out[uid] = {
+                        "uid": str(uid),
+                        "subject": subject,
+                        "from": sender,
+                        "date": date,
+                        "body": body,
+                        "readable": readable,
+                    }
+                self._db.execute(
+                    "UPDATE messages SET last_access = ? "
+                    f"WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid IN ({marks})",
+                    (now, *params))
+        return out
+
+    def put_headers(self, account, mailbox, uidvalidity, mails):
+        """一覧用のヘッダー（uid / subject / from / date）を保存する。既存の本文は残す。"""
+        now = time.time()
+        rows = [
+            (account, mailbox, int(uidvalidity), int(m["uid"]), m.get("subject"), m.get("from"),
+             m.get("date"), _row_size(m.get("subject"), m.get("from"), m.get("date")), now)
+            for m in mails
+        ]
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT INTO messages (account, mailbox, uidvalidity, uid, subject, sender, date, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (account, mailbox, uidvalidity, uid) DO UPDATE SET "
+                "subject = excluded.subject, sender = excluded.sender, date = excluded.date, "
+                "size = excluded.size + length(coalesce(body, '')) + length(coalesce(readable, '')), "
+                "last_access = excluded.last_access",
+                rows)
+            self._db.execute("COMMIT")
+        self._evict()
+
+    def put_body(self, account, mailbox, uidvalidity, uid, body, readable):
+        """本文と remove_unreadable 済みの本文を保存する。"""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO messages (account, mailbox, uidvalidity, uid, body, readable, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (account, mailbox, uidvalidity, uid) DO UPDATE SET "
+                "body = excluded.body, readable = excluded.readable, "
+                "size = excluded.size + length(coalesce(subject, '')) + length(coalesce(sender, '')) "
+                "+ length(coalesce(date, '')), "
+                "last_access = excluded.last_access",
+                (account, mailbox, int(uidvalidity), int(uid), body, readable,
+                 _row_size(body, readable), time.time()))
+        self._evict()
+
+    def total_bytes(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM messages")
+            self._db.execute("DELETE FROM mailboxes")
+
+    def _evict(self):
+        with self._lock:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            # 古い順に削り、上限の 9 割まで下げる（毎回の書き込みで削除が走らないように）
+            target = total - int(self.max_bytes * 0.9)
+            victims = []
+            freed = 0
+            for rowid, size in self._db.execute(
+                    "SELECT rowid, size FROM messages ORDER BY last_access"):
+                victims.append((rowid,))
+                freed += size
+                if freed >= target:
+                    break
+            self._db.execute("BEGIN")
+            self._db.executemany("DELETE FROM messages WHERE rowid = ?", victims)
+            self._db.execute("COMMIT")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """プロセス全体で共有するキャッシュを返す。"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = MailCache()
+            except (OSError, sqlite3.Error):
+                # 書き込めない環境ではプロセス内のキャッシュで代用する
+                _cache = MailCache(":memory:")
+        return _cache
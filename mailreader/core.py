@@ -0,0 +1,352 @@
+"""
+メールの取得から読み上げ文の組み立てまで（Streamlit 非依存）。
+
+アプリのスクリプト本体にあった一覧の取得・本文の取得・読み上げ文の組み立てをここに置き、
+アプリ（メール自動読み上げ.py）とバッチ（python -m mailreader.batch）の両方から使う。
+どちらも同じローカルキャッシュ（MAIL_CACHE_PATH）に書くので、バッチで先に取得した本文は
+アプリでは通信せずに表示できる。
+"""
+import imaplib
+import os
+import re
+import ssl
+import threading
+from dataclasses import dataclass, field
+
+from .bodystructure import fetch_text_body
+from .cache import get_cache
+from .compress import CompressingIMAP4, CompressingIMAP4_SSL, compression_enabled
+from .fetch import (
+    conn_host, fetch_headers, fetch_raw_messages, filter_uids, select_mailbox, uid_bytes,
+)
+from .gmail import CATEGORIES, fetch_category_uids
+from .html_text import strip_unreadable
+from .metrics import timed
+from .pagination import search_page
+from .parse import body_text, parse_bodies, parse_many, parse_message
+from .pool import IMAPConnectionPool, get_pool
+from .speech import split_sentences
+
+MAILBOX = "inbox"
+
+
+def imap_host(user_email):
+    """
+    user_email のドメインに応じてIMAPホストを返す。
+    - ドメインが 'gmail.com' を末尾に含む場合は Gmail の公式ホストを使う（test.6765884.gmail.com 等に対応）
+    - それ以外は簡易的に 'imap.<domain>' を返す
+    """
+    try:
+        domain = user_email.split('@')[-1].lower()
+    except Exception:
+        domain = ""
+    if domain.endswith("gmail.com"):
+        return "imap.gmail.com"
+    if domain:
+        return f"imap.{domain}"
+    return "imap.gmail.com"
+
+
+def cache_account(user, host=None, port=None):
+    # キャッシュ上のアカウント識別子（ホスト + 小文字化したアドレス）
+    host = host or imap_host(user)
+    if port is not None:
+        host = f"{host}:{port}"
+    return f"{host}/{user.lower()}"
+
+
+@dataclass(frozen=True)
+class Account:
+    """
+    取得するアカウント。host を省略するとアドレスから決める。
+    port / tls はローカルの検証用サーバーなど、既定（993 番の TLS）以外に繋ぐときだけ指定する。
+    """
+    user: str
+    password: str = field(repr=False)
+    host: str = None
+    port: int = None
+    tls: bool = True
+
+    @property
+    def imap_host(self):
+        return self.host or imap_host(self.user)
+
+    @property
+    def cache_account(self):
+        return cache_account(self.user, self.imap_host, self.port)
+
+
+def default_timeout():
+    # Streamlit Cloud ではネットワークの遅延に合わせて長めにする
+    return 20 if "streamlit.app" in os.environ.get("STREAMLIT_SERVER_HEADLESS", "") else 15
+
+
+_pools = {}  # (port, tls) -> 既定以外の接続先用のプール
+_pools_lock = threading.Lock()
+
+
+def pool_for(account):
+    """account の接続先に使う接続プール（既定の接続先ならプロセス共有のプール）。"""
+    if account.port is None and account.tls:
+        return get_pool()
+    key = (account.port, account.tls)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            def connect(host, timeout, ssl_context, port=account.port, tls=account.tls):
+                if tls:
+                    cls = CompressingIMAP4_SSL if compression_enabled() else imaplib.IMAP4_SSL
+                    return cls(host, port or imaplib.IMAP4_SSL_PORT, timeout=timeout,
+                               ssl_context=ssl_context)
+                cls = CompressingIMAP4 if compression_enabled() else imaplib.IMAP4
+                return cls(host, port or imaplib.IMAP4_PORT, timeout=timeout)
+            pool = _pools[key] = IMAPConnectionPool(connect=connect)
+        return pool
+
+
+def imap_connection(account, timeout=None):
+    """
+    プールから接続を借りる（with 文で使う）。
+    例外時は接続が破棄され、正常終了時はプールへ返却される
+    """
+    context = ssl.create_default_context()
+    context.check_hostname = True
+    context.verify_mode = ssl.CERT_REQUIRED
+    return pool_for(account).connection(
+        account.imap_host, account.user, account.password,
+        timeout=timeout or default_timeout(), ssl_context=context)
+
+
+def fetch_window(account, category, num, headers_only, before=None):
+    """
+    カテゴリの最新 num 件を新しい順に取得する（失敗時は例外をそのまま送出する）。
+    取得済みのメールはローカルキャッシュから返し、キャッシュに無い UID だけを取得する。
+    before を指定すると、UID がそれより小さいメールのうち最新 num 件を取得する。
+    """
+    return [entry for _, _, entry in iter_window(account, category, num, headers_only,
+                                                 before=before)]
+
+
+def iter_window(account, category, num, headers_only, first_body=False, before=None):
+    """
+    fetch_window の逐次版。(番号, 件数, メール) を新しい順に返すジェネレーター。
+    キャッシュ済みのメールはすぐ返し、キャッシュに無いものは最新の1通を先に取得してから
+    残りを 1 回でまとめて取得するので、最初の1通が届くまでの時間は num によらない。
+    """
+    cache = get_cache()
+    key = account.cache_account
+    with imap_connection(account) as mail:
+        box = select_mailbox(mail, MAILBOX)
+        uidvalidity = box["uidvalidity"]
+        if uidvalidity is not None:
+            # UIDVALIDITY が変わっていたら古いキャッシュは使えないので破棄される
+            cache.sync_uidvalidity(key, MAILBOX, uidvalidity)
+        # 受信箱全件ではなく UIDNEXT（ページ送りなら before）から区切った範囲だけを検索する
+        latest_uids = search_page(mail, category, num, before=before, uidnext=box["uidnext"])
+        total = len(latest_uids)
+
+        cached = {}
+        if uidvalidity is not None:
+            cached = cache.get_many(key, MAILBOX, uidvalidity, latest_uids)
+
+        def is_missing(u):
+            if int(u) not in cached:
+                return True
+            entry = cached[int(u)]
+            # None は取得中に削除されたメール
+            return entry is not None and not headers_only and entry["body"] is None
+
+        def fetch_batch(batch):
+            if headers_only:
+                raw_by_uid = fetch_headers(mail, batch)
+            else:
+                raw_by_uid = fetch_raw_messages(mail, batch)
+            # 件数が多いときはプロセスプールで並列に解析する
+            fetched = parse_many(raw_by_uid.items(), headers_only, host=conn_host(mail))
+            for parsed in fetched:
+                cached[int(parsed["uid"])] = parsed
+            if uidvalidity is not None and fetched:
+                cache.put_headers(key, MAILBOX, uidvalidity, fetched)
+                for parsed in fetched:
+                    if parsed["body"] is not None:
+                        cache.put_body(key, MAILBOX, uidvalidity, parsed["uid"],
+                                       parsed["body"], parsed["readable"])
+            for mail_uid in batch:
+                if uid_bytes(mail_uid) not in raw_by_uid:
+                    # 取得中に削除されたメールは飛ばす
+                    cached[int(mail_uid)] = None
+
+        missing = [u for u in latest_uids if is_missing(u)]
+        # 最新の1通だけを先に取得し、残りのキャッシュに無いものは 1 回の UID FETCH でまとめて取得する
+        # （ページ送りはページ単位で表示するので、1 通目を急がず全部まとめて取得する）
+        batches = [missing] if before is not None else [missing[:1], missing[1:]]
+        for index, mail_uid in enumerate(latest_uids):
+            if is_missing(mail_uid) and batches:
+                fetch_batch(batches.pop(0))
+            entry = cached.get(int(mail_uid))
+            if entry is None:
+                continue
+            entry = dict(entry, uidvalidity=uidvalidity)
+            if first_body and entry["body"] is None:
+                # 最新の1通は本文もこの接続で取得し、すぐ読み上げられるようにする
+                entry["body"], entry["readable"] = fetch_body_on(mail, entry["uid"])
+                if uidvalidity is not None:
+                    cache.put_body(key, MAILBOX, uidvalidity, entry["uid"],
+                                   entry["body"], entry["readable"])
+            first_body = False
+            yield index, total, entry
+
+
+def fetch_gmail_window(account, num, categories=CATEGORIES):
+    """
+    Gmail 用: 1回の接続で各カテゴリの最新 num 件を {カテゴリ: [メール, ...]}（新しい順）で返す。
+    各カテゴリの UID 検索は範囲を区切って同じ接続内で行い、ヘッダーは
+    キャッシュに無い分だけ1回で取得する。
+    """
+    cache = get_cache()
+    key = account.cache_account
+    with imap_connection(account) as mail:
+        box = select_mailbox(mail, MAILBOX)
+        uidvalidity = box["uidvalidity"]
+        if uidvalidity is not None:
+            cache.sync_uidvalidity(key, MAILBOX, uidvalidity)
+        uids_by_category = fetch_category_uids(mail, num, box["uidnext"], categories)
+        all_uids = sorted({u for uids in uids_by_category.values() for u in uids}, key=int)
+        cached = {}
+        if uidvalidity is not None:
+            cached = cache.get_many(key, MAILBOX, uidvalidity, all_uids)
+        missing = [u for u in all_uids if int(u) not in cached]
+        raw_by_uid = fetch_headers(mail, missing)
+
+    fetched = parse_many(raw_by_uid.items(), headers_only=True, host=account.imap_host)
+    for entry in fetched:
+        cached[int(entry["uid"])] = entry
+    if uidvalidity is not None and fetched:
+        cache.put_headers(key, MAILBOX, uidvalidity, fetched)
+
+    return {
+        category: [dict(cached[int(u)], uidvalidity=uidvalidity)
+                   for u in reversed(uids) if int(u) in cached]
+        for category, uids in uids_by_category.items()
+    }
+
+
+def fetch_new_mails(account, category, uids):
+    """
+    IDLE で通知された新着 UID のうちカテゴリに一致するものだけを本文付きで取得する（新しい順）。
+    ヘッダーも本文も同じ接続（SELECT は 1 回）で取得する。
+    """
+    cache = get_cache()
+    key = account.cache_account
+    with imap_connection(account) as mail:
+        box = select_mailbox(mail, MAILBOX)
+        matched = filter_uids(mail, category, uids)
+        raw_by_uid = fetch_headers(mail, matched)
+        # 取得中に削除されたメールは除く
+        matched = [u for u in reversed(matched) if uid_bytes(u) in raw_by_uid]
+        bodies = fetch_bodies_on(mail, matched)
+    uidvalidity = box["uidvalidity"]
+    mails = []
+    for mail_uid, (body, readable) in zip(matched, bodies):
+        entry = parse_message(mail_uid, raw_by_uid[uid_bytes(mail_uid)], headers_only=True,
+                              host=account.imap_host)
+        if uidvalidity is not None:
+            cache.put_headers(key, MAILBOX, uidvalidity, [entry])
+            cache.put_body(key, MAILBOX, uidvalidity, entry["uid"], body, readable)
+        entry.update(body=body, readable=readable, uidvalidity=uidvalidity)
+        mails.append(entry)
+    return mails
+
+
+def fetch_mail_body(account, uid, uidvalidity=None):
+    """
+    UID を指定して1通分の本文を取得する（一覧で選ばれたメールだけ取得するため）。
+    (本文, remove_unreadable 済みの本文) を返す。キャッシュにあれば通信しない。
+    取得に失敗した場合は例外をそのまま送出する。
+    """
+    return fetch_mail_bodies(account, [uid], uidvalidity)[str(uid)]
+
+
+def fetch_mail_bodies(account, uids, uidvalidity=None):
+    """
+    fetch_mail_body の複数通版。{uid(str): (本文, remove_unreadable 済みの本文)} を返す。
+    キャッシュに無いものだけを 1 本の接続（SELECT は 1 回）で順に取得する。
+    """
+    cache = get_cache()
+    key = account.cache_account
+    out = {}
+    if uidvalidity is not None:
+        for uid, hit in cache.get_many(key, MAILBOX, uidvalidity, uids).items():
+            if hit["body"] is not None:
+                out[str(uid)] = (hit["body"], hit["readable"])
+    missing = [str(uid) for uid in uids if str(uid) not in out]
+    if not missing:
+        return out
+
+    with imap_connection(account) as mail:
+        box = select_mailbox(mail, MAILBOX)
+        bodies = fetch_bodies_on(mail, missing)
+    for uid, body in zip(missing, bodies):
+        out[uid] = body
+        if box["uidvalidity"] is not None:
+            cache.put_body(key, MAILBOX, box["uidvalidity"], uid, *body)
+    return out
+
+
+def fetch_body_on(mail, uid):
+    """SELECT 済みの接続で1通分の本文を取得し、(本文, remove_unreadable 済みの本文) を返す。"""
+    with timed("body", conn_host(mail)):
+        return body_text(_fetch_text_part(mail, uid))
+
+
+def fetch_bodies_on(mail, uids):
+    """
+    fetch_body_on の複数通版（uids と同じ順のリストを返す）。
+    本文パートを順に取得してから、テキスト化は parse_bodies でまとめて行う
+    （通数と大きさが十分ならプロセスプールで並列に処理される）。
+    """
+    host = conn_host(mail)
+    parts = []
+    for uid in uids:
+        with timed("body", host):
+            parts.append(_fetch_text_part(mail, uid))
+    return parse_bodies(parts, host=host)
+
+
+def _fetch_text_part(mail, uid):
+    # body_text に渡す本文パート（(content-type, 文字列)・RFC822 全体の bytes・None）を取得する
+    try:
+        # BODYSTRUCTURE で本文パートだけを特定し、添付を落とさずに取得する
+        # （読み上げに使う文字数分だけ取得するので長文は途中で切れる）
+        return fetch_text_body(mail, uid)
+    except ValueError:
+        # BODYSTRUCTURE を返さないサーバーでは従来どおり全体を取得する
+        return fetch_raw_messages(mail, [uid]).get(uid_bytes(uid))
+
+
+def speech_text(mail, body, readable_body):
+    """一覧のメール dict と本文から読み上げる文章を作る（詳細表示・先読み・バッチで共通）。"""
+    from_masked = re.sub(r'<.*?>', '<***>', mail["from"] or "(差出人不明)")
+    return read_text(from_masked, mail["subject"] or "(件名なし)", body, readable_body)
+
+
+def read_text(from_masked, subject, body, readable_body):
+    # 本文はキャッシュ済みの remove_unreadable 結果をそのまま使う
+    to_read = strip_unreadable(f"差出人: {from_masked}。件名: {subject}。")
+    if body:
+        to_read += strip_unreadable("本文: ") + readable_body
+    return to_read
+
+
+def build_digest(mail, body, readable_body):
+    """読み上げ用のまとめ（読み上げる文章と、その文ごとの区切り）を dict で返す。"""
+    text = speech_text(mail, body, readable_body)
+    return {
+        "uid": str(mail["uid"]),
+        "uidvalidity": mail.get("uidvalidity"),
+        "subject": mail["subject"],
+        "from": mail["from"],
+        "date": mail.get("date"),
+        "text": text,
+        "chunks": split_sentences(text),
+    }
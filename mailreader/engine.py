@@ -0,0 +1,130 @@
+"""
+複数アカウント・複数カテゴリの並列取得エンジン。
+
+imaplib はブロッキング API なので、スレッドプールで各 (アカウント, カテゴリ) を
+同時に取得し、結果を日付順の 1 本のフィードにまとめる。
+- 同じ IMAP ホストへの同時接続数はプロセス全体で per_host_limit までに抑える
+  （Gmail は同時ログインが多いと制限をかけてくる）
+- リトライの待機はワーカースレッド内で行うので、描画スレッドは止まらない
+- 全体の所要時間はアカウント数の合計ではなく、最も遅いアカウント程度になる
+"""
+import imaplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+DEFAULT_PER_HOST_LIMIT = 3
+DEFAULT_MAX_WORKERS = 8
+
+_EPOCH = datetime.min.replace(tzinfo=timezone.utc)
+
+
+@dataclass(frozen=True)
+class FetchJob:
+    """取得 1 件分の指定。パスワードは repr に出さない。"""
+    host: str
+    user: str
+    password: str = field(repr=False)
+    category: str = "すべて"
+    num: int = 10
+
+
+def is_auth_error(exc):
+    """認証エラー（リトライしても直らない）かどうか。"""
+    message = str(exc)
+    return "AUTHENTICATIONFAILED" in message or "Invalid credentials" in message
+
+
+def is_transient_error(exc):
+    """
+    接続・タイムアウト・ソケットのエラー（時間を置けば直りうる）かどうか。
+    サーバーが BAD / NO で応答したコマンドのエラーは含めない（再試行しても同じ結果になる）。
+    """
+    return isinstance(exc, (OSError, imaplib.IMAP4.abort))
+
+
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+
+def host_semaphore(host, limit=DEFAULT_PER_HOST_LIMIT):
+    """ホストごとの同時接続数を制限するセマフォ（プロセス全体で共有）。"""
+    with _host_limits_lock:
+        sem = _host_limits.get(host)
+        if sem is None:
+            sem = threading.BoundedSemaphore(limit)
+            _host_limits[host] = sem
+        return sem
+
+
+def mail_datetime(mail):
+    """Date ヘッダーを比較可能な datetime にする（解釈できなければ最古扱い）。"""
+    try:
+        value = parsedate_to_datetime(mail.get("date") or "")
+    except (TypeError, ValueError, IndexError):
+        return _EPOCH
+    if value is None:
+        return _EPOCH
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _run_job(job, fetch, per_host_limit, retries, backoff):
+    for attempt in range(retries):
+        try:
+            with host_semaphore(job.host, per_host_limit):
+                return fetch(job)
+        except Exception as e:
+            # 認証エラーや再試行しても意味のないエラー（retryable = False）はすぐ諦める
+            if is_auth_error(e) or not getattr(e, "retryable", True) or attempt == retries - 1:
+                raise
+        # セマフォを手放してから待つ（待機中に他のアカウントの取得を妨げない）
+        time.sleep(backoff * (2 ** attempt))
+    return []
+
+
+def fetch_feed(jobs, fetch, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+               max_workers=DEFAULT_MAX_WORKERS, retries=3, backoff=1.0, on_progress=None):
+    """
+    jobs を並列に fetch(job) -> [mail dict, ...] し、1 本のフィードにまとめる。
+    (日付の新しい順のメール一覧, {job: 例外}) を返す。
+    各メールには取得元の "account"（アドレス）と "category" を付ける。
+    同じアカウントの同じメールが複数カテゴリに現れた場合は最初の 1 件だけ残す。
+    on_progress を渡すと、ジョブが 1 つ終わるたびに呼び出し元のスレッドで
+    on_progress(完了数, ジョブ数, job) を呼ぶ（進捗表示用）。
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return [], {}
+    feed = []
+    errors = {}
+    seen = set()
+    workers = max(1, min(max_workers, len(jobs)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mail-fetch") as executor:
+        futures = [
+            (job, executor.submit(_run_job, job, fetch, per_host_limit, retries, backoff))
+            for job in jobs
+        ]
+        if on_progress is not None:
+            job_of = {future: job for job, future in futures}
+            for done, future in enumerate(as_completed(job_of), 1):
+                on_progress(done, len(futures), job_of[future])
+        # 投入順に結果を集めるので、重複時にどのカテゴリが残るかは jobs の順で決まる
+        for job, future in futures:
+            try:
+                mails = future.result()
+            except Exception as e:
+                errors[job] = e
+                continue
+            for mail in mails:
+                key = (job.host, job.user.lower(), mail.get("uidvalidity"), mail.get("uid"))
+                if key in seen:
+                    continue
+                seen.add(key)
+                feed.append(dict(mail, account=job.user, category=job.category))
+    feed.sort(key=mail_datetime, reverse=True)
+    return feed, errors
@@ -0,0 +1,167 @@
+"""
+IMAP の検索・取得ヘルパー（Streamlit 非依存）。
+
+メッセージごとに FETCH を投げると件数分のラウンドトリップが直列に発生するため、
+取得したい UID をまとめて 1 回の UID FETCH で取得し、応答を UID ごとに振り分ける。
+"""
+from .metrics import timed
+from .response import find_item, parse_fetch_response
+
+# 一覧表示に必要なヘッダーだけを既読フラグを立てずに取得する
+HEADER_ITEMS = "BODY.PEEK[HEADER.FIELDS (SUBJECT FROM DATE)]"
+
+
+def category_criteria(category):
+    """アプリのカテゴリ名を IMAP SEARCH の条件に変換する。"""
+    if category == "すべて":
+        return ("ALL",)
+    if category == "メイン":
+        return ("X-GM-RAW", "category:primary")
+    return ("X-GM-RAW", "category:promotions")
+
+
+def conn_host(conn):
+    """計測のラベルに使う接続先ホスト名（imaplib の接続は host 属性を持つ）。"""
+    return getattr(conn, "host", "") or ""
+
+
+def select_mailbox(conn, mailbox="inbox"):
+    """
+    メールボックスを SELECT し、応答に含まれる状態を dict で返す。
+    {"exists": 件数, "uidvalidity": int または None, "uidnext": int または None}
+    """
+    with timed("select", conn_host(conn)):
+        result, data = conn.select(mailbox)
+    if result != "OK":
+        raise conn.error(f"SELECT {mailbox} failed: {data!r}")
+    info = {"exists": int(data[0]) if data and data[0] else 0}
+    for key in ("UIDVALIDITY", "UIDNEXT"):
+        _, values = conn.response(key)
+        value = values[-1] if values and values[-1] is not None else None
+        info[key.lower()] = int(value) if value is not None else None
+    return info
+
+
+def search_uids(conn, category):
+    """カテゴリに一致するメッセージの UID を昇順（古い順）で返す。"""
+    with timed("search", conn_host(conn)):
+        result, data = conn.uid("SEARCH", *category_criteria(category))
+    if result != "OK" or not data or not data[0]:
+        return []
+    return sorted(data[0].split(), key=int)
+
+
+def search_latest_uids(conn, category, num, uidnext=None, initial_window=None):
+    """
+    カテゴリに一致する最新 num 件の UID を昇順で返す。
+    SEARCH ALL は受信箱全件の番号を返すため、大きな受信箱では応答だけで数 MB になる。
+    そこで UIDNEXT から下向きに UID の範囲を区切って検索し、足りなければ範囲を広げる。
+    UIDNEXT が分からない場合は従来どおり全件検索にフォールバックする。
+    """
+    if num <= 0:
+        return []
+    if uidnext is None:
+        return search_uids(conn, category)[-num:]
+    top = uidnext - 1
+    if top < 1:
+        return []
+    criteria = tuple(c for c in category_criteria(category) if c != "ALL")
+    window = initial_window or max(num * 2, 32)
+    while True:
+        low = max(1, top - window + 1)
+        with timed("search", conn_host(conn)):
+            result, data = conn.uid("SEARCH", "UID", f"{low}:{top}", *criteria)
+        if result != "OK":
+            return []
+        found = sorted(data[0].split(), key=int) if data and data[0] else []
+        if len(found) >= num or low == 1:
+            return found[-num:]
+        # 削除済みの UID やカテゴリ外のメールで足りなかった分だけ範囲を広げる
+        window *= 4
+
+
+def filter_uids(conn, category, uids):
+    """uids のうちカテゴリに一致するものだけを昇順で返す（新着の振り分け用）。"""
+    if not uids:
+        return []
+    criteria = tuple(c for c in category_criteria(category) if c != "ALL")
+    with timed("search", conn_host(conn)):
+        result, data = conn.uid("SEARCH", "UID", sequence_set(uids), *criteria)
+    if result != "OK" or not data or not data[0]:
+        return []
+    wanted = {uid_bytes(u) for u in uids}
+    return sorted((u for u in data[0].split() if u in wanted), key=int)
+
+
+def uid_bytes(uid):
+    """UID を bytes 表記にそろえる（int / str / bytes を受け付ける）。"""
+    if isinstance(uid, int):
+        return str(uid).encode("ascii")
+    if isinstance(uid, str):
+        return uid.encode("ascii")
+    return bytes(uid)
+
+
+def sequence_set(uids):
+    """
+    UID のリストを IMAP のシーケンスセット表記にまとめる。
+    例: [1, 2, 3, 7, 9, 10] -> b"1:3,7,9:10"
+    """
+    nums = sorted({int(u) for u in uids})
+    parts = []
+    i = 0
+    while i < len(nums):
+        start = end = nums[i]
+        while i + 1 < len(nums) and nums[i + 1] == end + 1:
+            i += 1
+            end = nums[i]
+        parts.append(f"{start}:{end}" if end != start else str(start))
+        i += 1
+    return ",".join(parts).encode("ascii")
+
+
+def fetch_items(conn, uids, items):
+    """
+    uids をまとめて 1 回の UID FETCH で取得し、{uid(bytes): 応答dict} を返す。
+    items は "(RFC822)" のような FETCH 項目（UID は自動で付け加える）。
+    """
+    if not uids:
+        return {}
+    items = items.strip()
+    if items.startswith("(") and items.endswith(")"):
+        items = items[1:-1]
+    with timed("fetch", conn_host(conn), messages=len(uids)):
+        result, data = conn.uid("FETCH", sequence_set(uids), f"(UID {items})")
+    if result != "OK":
+        return {}
+    wanted = {uid_bytes(u) for u in uids}
+    out = {}
+    for msg in parse_fetch_response(data):
+        uid = msg.get("UID")
+        # 未要求のフラグ更新などの非同期 FETCH 応答は捨てる
+        if uid is None or bytes(uid) not in wanted:
+            continue
+        out.setdefault(bytes(uid), {}).update(msg)
+    return out
+
+
+def fetch_raw_messages(conn, uids):
+    """uids の RFC822 ソースをまとめて取得し {uid: bytes} を返す。"""
+    fetched = fetch_items(conn, uids, "RFC822")
+    out = {}
+    for uid, msg in fetched.items():
+        raw = msg.get("RFC822")
+        if isinstance(raw, bytes):
+            out[uid] = raw
+    return out
+
+
+def fetch_headers(conn, uids):
+    """uids の件名・差出人・日付ヘッダーだけをまとめて取得し {uid: bytes} を返す。"""
+    fetched = fetch_items(conn, uids, HEADER_ITEMS)
+    out = {}
+    for uid, msg in fetched.items():
+        header = find_item(msg, "BODY[HEADER")
+        if isinstance(header, bytes):
+            out[uid] = header
+    return out
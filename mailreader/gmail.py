@@ -0,0 +1,28 @@
+"""
+Gmail 向けの高速経路。
+
+カテゴリを切り替えるたびにログインと X-GM-RAW 検索をやり直すのではなく、
+1 回の接続で全カテゴリの最新ウィンドウを調べ、ヘッダーをまとめて取得しておく。
+以降のカテゴリ切り替えは手元の分類結果を引くだけになる。
+
+Gmail はカテゴリ（メイン・プロモーション等）を X-GM-LABELS に含めないため、
+カテゴリの判定は同じ接続内で UID 範囲を区切った X-GM-RAW 検索で行う
+（ラベルは使い道が無いので取得しない）。
+"""
+from .fetch import search_latest_uids
+
+GMAIL_HOST = "imap.gmail.com"
+CATEGORIES = ("すべて", "メイン", "広告")
+
+
+def is_gmail_host(host):
+    return host == GMAIL_HOST
+
+
+def fetch_category_uids(conn, num, uidnext, categories=CATEGORIES):
+    """SELECT 済みの接続で、各カテゴリの最新 num 件の UID を {カテゴリ: [uid, ...]}（昇順）で返す。"""
+    return {
+        category: search_latest_uids(conn, category, num, uidnext=uidnext)
+        for category in categories
+    }
+
@@ -0,0 +1,155 @@
+"""
+HTML メールから読み上げ用テキストを取り出す逐次抽出器。
+
+正規表現で HTML 全体を何度も置換すると、そのたびに全体のコピーが作られ、
+閉じタグが崩れた style ブロックがあると非貪欲マッチのバックトラックで極端に遅くなる。
+ここでは標準ライブラリの html.parser で 1 回だけ走査し、
+- script / style の中身は捨てる
+- <br> は改行、</p> は空行にする
+- 連続する空白・空行をまとめる
+を行いながらテキストを少しずつ出力する。文字数の上限に達したら解析を打ち切る。
+"""
+import re
+from html.parser import HTMLParser
+
+# 一度に解析器へ渡す文字数（上限到達時に残りを読まずに済むよう分割する）
+FEED_CHUNK = 64 * 1024
+
+_SKIP_TAGS = frozenset(("script", "style"))
+_SPACES_RE = re.compile(r"[ \t]+")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n\s*\n+")
+_TRAILING_WS_RE = re.compile(r"\s+$")
+
+# 読み上げに向かない文字の除去（アプリの remove_unreadable と同じ規則）
+URL_RE = re.compile(r"https?://\S+|www\.\S+")
+UNREADABLE_RE = re.compile(r"[^0-9A-Za-z぀-ヿ一-鿿。、．，・！？\s\n\r]")
+
+
+def strip_unreadable(text):
+    """URL と記号を除き、日本語・英数字・句読点・空白だけを残す。"""
+    return UNREADABLE_RE.sub("", URL_RE.sub("", text))
+
+
+class _BudgetReached(Exception):
+    pass
+
+
+class SpeechTextExtractor(HTMLParser):
+    """
+    feed(chunk) で HTML を少しずつ受け取り、新しく確定したテキストを返す。
+    - budget: 出力する最大文字数（None なら無制限）。達したら以降の入力は無視する
+    - speech: True なら URL・記号の除去（アプリの remove_unreadable 相当）も同時に行う
+    空白の正規化が途中で変わらないよう、末尾の空白は次の出力まで保留する。
+    """
+
+    def __init__(self, budget=None, speech=False):
+        super().__init__(convert_charrefs=True)
+        self.budget = budget
+        self.speech = speech
+        self.done = False
+        self._skip_depth = 0
+        self._pending_ws = ""
+        self._started = False
+        self._emitted = 0
+        self._out = []
+
+    # --- 公開 API -------------------------------------------------------
+
+    def feed(self, data):
+        if self.done:
+            return ""
+        try:
+            super().feed(data)
+        except _BudgetReached:
+            self.done = True
+        return self._take()
+
+    def close(self):
+        if not self.done:
+            try:
+                super().close()
+            except _BudgetReached:
+                pass
+        self.done = True
+        # 末尾の空白は strip 相当で捨てる
+        self._pending_ws = ""
+        return self._take()
+
+    # --- HTMLParser のハンドラ -----------------------------------------
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag == "br" and not self._skip_depth:
+            self._emit("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == "br" and not self._skip_depth:
+            self._emit("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag == "p" and not self._skip_depth:
+            self._emit("\n\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._emit(data.replace("\xa0", " "))
+
+    # --- 内部処理 -------------------------------------------------------
+
+    def _emit(self, text):
+        text = self._pending_ws + text
+        m = _TRAILING_WS_RE.search(text)
+        if m:
+            self._pending_ws = text[m.start():]
+            text = text[:m.start()]
+        else:
+            self._pending_ws = ""
+        if not text:
+            return
+        if not self._started:
+            # 先頭の空白は strip 相当で捨てる
+            text = text.lstrip()
+            if not text:
+                return
+            self._started = True
+        text = _BLANK_LINES_RE.sub("\n\n", _SPACES_RE.sub(" ", text))
+        if self.speech:
+            text = strip_unreadable(text)
+        if self.budget is not None and self._emitted + len(text) >= self.budget:
+            text = text[:self.budget - self._emitted]
+            self._out.append(text)
+            self._emitted += len(text)
+            raise _BudgetReached()
+        self._out.append(text)
+        self._emitted += len(text)
+
+    def _take(self):
+        out = "".join(self._out)
+        self._out = []
+        return out
+
+
+def iter_html_text(chunks, budget=None, speech=False):
+    """
+    HTML 文字列の断片を順に受け取り、読み上げ用テキストを少しずつ返すジェネレーター。
+    上限に達した時点で残りの断片は読まずに終わる。
+    """
+    extractor = SpeechTextExtractor(budget=budget, speech=speech)
+    for chunk in chunks:
+        for start in range(0, len(chunk), FEED_CHUNK):
+            text = extractor.feed(chunk[start:start + FEED_CHUNK])
+            if text:
+                yield text
+            if extractor.done:
+                return
+    text = extractor.close()
+    if text:
+        yield text
+
+
+def html_to_text(html, budget=None, speech=False):
+    """HTML 全体をテキストにする（iter_html_text の結果を連結したもの）。"""
+    return "".join(iter_html_text([html], budget=budget, speech=speech)).strip()
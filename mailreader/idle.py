@@ -0,0 +1,270 @@
+"""
+IMAP IDLE による新着メールの監視（RFC 2177）。
+
+アカウントごとに 1 本の専用接続を IDLE 状態で保持し、EXISTS 通知を受けたら
+前回以降の新しい UID を調べて、購読中の各セッションのキューに積む。
+- サーバーのタイムアウト（RFC では 30 分、実際はもっと短いサーバーもある）より前に IDLE を張り直す
+- 購読しているセッションがすべて終了したら接続を閉じてスレッドを終える
+"""
+import imaplib
+import re
+import select
+import ssl
+import threading
+import time
+
+from .pool import account_key, safe_logout
+
+# IDLE を張り直す間隔（秒）。10 分程度で切るサーバーもあるので短めにする
+REIDLE_INTERVAL = 9 * 60
+# 購読中のセッションがまだ生きているかを確認する間隔（秒）
+SESSION_CHECK_INTERVAL = 30
+
+_EXISTS_RE = re.compile(rb"^\* \d+ EXISTS", re.I)
+
+
+class _LineReader:
+    """
+    IDLE 中はソケットを直接 select して読む。
+    imaplib の readline はタイムアウト付きで待てない（タイムアウトするとファイルが使えなくなる）ため。
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buf = b""
+
+    def readline(self, timeout):
+        deadline = time.monotonic() + timeout
+        while b"\r\n" not in self.buf:
+            pending = getattr(self.sock, "pending", None)
+            if not (pending and pending()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                ready, _, _ = select.select([self.sock], [], [], remaining)
+                if not ready:
+                    return None
+            data = self.sock.recv(65536)
+            if not data:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+            self.buf += data
+        line, self.buf = self.buf.split(b"\r\n", 1)
+        return line
+
+    def finish(self, timeout=10):
+        # 読みかけの行が残っていると imaplib の次の応答解析が壊れるので行末まで読み切る
+        while self.buf and not self.buf.endswith(b"\r\n"):
+            if self.readline(timeout) is None:
+                raise imaplib.IMAP4.abort("incomplete line after IDLE")
+
+
+def _default_connect(host, timeout, ssl_context):
+    return imaplib.IMAP4_SSL(host, timeout=timeout, ssl_context=ssl_context)
+
+
+class IdleWatcher(threading.Thread):
+    """
+    1 アカウント分の IDLE 監視スレッド。
+    subscribe(session_id, alive) で購読し、drain(session_id) で新着 UID を受け取る
+    （取得に失敗したら requeue(session_id, uids) で戻す）。
+    alive() が False を返すようになったセッションは自動で購読解除される。
+    """
+
+    def __init__(self, host, user, password, mailbox="inbox", timeout=30, ssl_context=None,
+                 connect=_default_connect, reidle_interval=REIDLE_INTERVAL, on_stop=None):
+        super().__init__(name=f"imap-idle-{user}", daemon=True)
+        self.host = host
+        self.user = user
+        self.password = password
+        self.mailbox = mailbox
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.reidle_interval = reidle_interval
+        self.last_uid = None
+        self.last_error = None
+        self._connect = connect
+        self._on_stop = on_stop
+        self._subscribers = {}  # session_id -> [alive, [uid, ...]]
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._tag_seq = 0
+
+    # --- 購読 -----------------------------------------------------------
+
+    def subscribe(self, session_id, alive=None):
+        with self._lock:
+            entry = self._subscribers.get(session_id)
+            if entry is None:
+                self._subscribers[session_id] = [alive, []]
+            else:
+                entry[0] = alive
+
+    def unsubscribe(self, session_id):
+        with self._lock:
+            self._subscribers.pop(session_id, None)
+            empty = not self._subscribers
+        if empty:
+            self.stop()
+
+    def drain(self, session_id):
+        """このセッション宛てに届いた新着 UID（bytes、昇順）を取り出す。"""
+        with self._lock:
+            entry = self._subscribers.get(session_id)
+            if entry is None:
+                return []
+            uids, entry[1] = entry[1], []
+        return uids
+
+    def requeue(self, session_id, uids):
+        """drain で取り出した UID を戻す（新着の取得に失敗したとき、次の確認で取り直すため）。"""
+        with self._lock:
+            entry = self._subscribers.get(session_id)
+            if entry is None:
+                return
+            entry[1] = sorted(set(uids) | set(entry[1]), key=int)
+
+    def stop(self):
+        self._stop_event.set()
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    # --- スレッド本体 ---------------------------------------------------
+
+    def run(self):
+        backoff = 1.0
+        try:
+            while not self._stop_event.is_set() and self._prune_sessions():
+                conn = None
+                try:
+                    conn = self._open()
+                    backoff = 1.0
+                    while not self._stop_event.is_set() and self._prune_sessions():
+                        self._idle_once(conn)
+                        # EXISTS が来なかった場合も、張り直しの合間に取りこぼしが無いか確認する
+                        self._collect_new(conn)
+                except Exception as e:
+                    self.last_error = e
+                    if "AUTHENTICATIONFAILED" in str(e) or "Invalid credentials" in str(e):
+                        # 認証エラーは再試行しても直らないので監視をやめる
+                        break
+                    # 切断されたら指数バックオフで再接続（停止要求には即応する）
+                    self._stop_event.wait(backoff)
+                    backoff = min(backoff * 2, 60.0)
+                finally:
+                    if conn is not None:
+                        safe_logout(conn)
+        finally:
+            self._stop_event.set()
+            if self._on_stop is not None:
+                self._on_stop(self)
+
+    def _open(self):
+        context = self.ssl_context or ssl.create_default_context()
+        conn = self._connect(self.host, self.timeout, context)
+        try:
+            conn.login(self.user, self.password)
+            result, data = conn.select(self.mailbox)
+            if result != "OK":
+                raise conn.error(f"SELECT {self.mailbox} failed: {data!r}")
+            _, values = conn.response("UIDNEXT")
+            if self.last_uid is None:
+                uidnext = values[-1] if values and values[-1] is not None else None
+                self.last_uid = int(uidnext) - 1 if uidnext is not None else self._max_uid(conn)
+        except Exception:
+            safe_logout(conn)
+            raise
+        return conn
+
+    def _max_uid(self, conn):
+        result, data = conn.uid("SEARCH", "UID", "*")
+        uids = data[0].split() if result == "OK" and data and data[0] else []
+        return max((int(u) for u in uids), default=0)
+
+    def _idle_once(self, conn):
+        """IDLE を 1 回行い、EXISTS を受け取ったら True を返す。"""
+        self._tag_seq += 1
+        tag = f"IDLE{self._tag_seq}".encode("ascii")
+        reader = _LineReader(conn.sock)
+        conn.send(tag + b" IDLE\r\n")
+        line = reader.readline(self.timeout)
+        if line is None or not line.startswith(b"+"):
+            raise imaplib.IMAP4.abort(f"IDLE rejected: {line!r}")
+        deadline = time.monotonic() + self.reidle_interval
+        next_prune = time.monotonic() + SESSION_CHECK_INTERVAL
+        got_exists = False
+        while not got_exists and not self._stop_event.is_set() and time.monotonic() < deadline:
+            # 1 秒ごとに目を覚まして停止要求と張り直し時刻を確認する
+            line = reader.readline(1.0)
+            if line is not None and _EXISTS_RE.match(line):
+                got_exists = True
+            if time.monotonic() >= next_prune:
+                next_prune = time.monotonic() + SESSION_CHECK_INTERVAL
+                if not self._prune_sessions():
+                    break
+        conn.send(b"DONE\r\n")
+        while True:
+            line = reader.readline(self.timeout)
+            if line is None:
+                raise imaplib.IMAP4.abort("no response to DONE")
+            if line.startswith(tag + b" "):
+                break
+        reader.finish()
+        return got_exists
+
+    def _collect_new(self, conn):
+        if self._stop_event.is_set():
+            return
+        result, data = conn.uid("SEARCH", "UID", f"{self.last_uid + 1}:*")
+        if result != "OK" or not data or not data[0]:
+            return
+        # "n:*" は該当が無くても最後のメールを返すので last_uid 以下は除く
+        new = sorted((u for u in data[0].split() if int(u) > self.last_uid), key=int)
+        if not new:
+            return
+        self.last_uid = int(new[-1])
+        with self._lock:
+            for entry in self._subscribers.values():
+                entry[1].extend(new)
+
+    def _prune_sessions(self):
+        """終了したセッションを購読から外し、購読者が残っていれば True を返す。"""
+        with self._lock:
+            for session_id, (alive, _) in list(self._subscribers.items()):
+                try:
+                    gone = alive is not None and not alive()
+                except Exception:
+                    gone = True
+                if gone:
+                    del self._subscribers[session_id]
+            return bool(self._subscribers)
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def _forget(watcher):
+    with _watchers_lock:
+        for key, value in list(_watchers.items()):
+            if value is watcher:
+                del _watchers[key]
+
+
+def get_watcher(host, user, password, session_id, alive=None, **kwargs):
+    """
+    アカウントの IDLE 監視スレッドを取得（無ければ起動）し、session_id を購読させる。
+    同じアカウントを開いている複数のセッションで 1 本の接続を共有する。
+    """
+    key = account_key(host, user, password)
+    with _watchers_lock:
+        watcher = _watchers.get(key)
+        if watcher is None or watcher.stopped:
+            watcher = IdleWatcher(host, user, password, on_stop=_forget, **kwargs)
+            _watchers[key] = watcher
+            watcher.subscribe(session_id, alive)
+            watcher.start()
+        else:
+            watcher.subscribe(session_id, alive)
+    return watcher
@@ -0,0 +1,224 @@
+"""
+処理段階ごとの所要時間の計測。
+
+「読み込みが遅い」と言われても、TLS 接続・LOGIN・SELECT・SEARCH・FETCH・MIME 解析・
+HTML のテキスト化・音声の準備のどこで時間を使っているのかが分からないと手が打てない。
+ここでは段階（phase）と IMAP ホストの組ごとにヒストグラムを持ち、
+- timed() で囲んだ区間の所要時間を記録する
+- Prometheus のテキスト形式で書き出す（環境変数 MAIL_METRICS_PORT があればその番号で HTTP 配信する）
+- 環境変数 MAIL_METRICS_LOG があれば 1 区間ごとに JSON 1 行をログに出す
+を行う。時間以外の量（通信したバイト数など）は inc() でカウンターに足す。プロセス内で共有し、Streamlit は呼ばない。
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# バケットの上限（秒）。IMAP の往復（数十 ms）から大きな取り込み（数十秒）までを覆う
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_NAME = "mail_reader_phase_seconds"
+COUNTER_PREFIX = "mail_reader_"
+
+logger = logging.getLogger("mailreader.metrics")
+
+
+class Histogram:
+    """累積でないバケット数・合計・件数を持つ。"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最後は +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """バケット内を線形補間した q 分位点の推定値。"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, n in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.max
+            if n and seen + n >= rank:
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+            lower = upper
+        return self.max
+
+
+class MetricsRegistry:
+    """(phase, host) ごとの Histogram をまとめる。"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, log_json=False):
+        self.buckets = buckets
+        self.log_json = log_json
+        self._histograms = {}
+        self._counters = {}  # (name, host, ((ラベル, 値), ...)) -> 合計
+        self._lock = threading.Lock()
+
+    def observe(self, phase, host, seconds, **fields):
+        key = (phase, host or "")
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram(self.buckets)
+            hist.observe(seconds)
+        if self.log_json:
+            record = {"ts": round(time.time(), 3), "phase": phase, "host": host or "",
+                      "seconds": round(seconds, 6)}
+            record.update(fields)
+            logger.info(json.dumps(record, ensure_ascii=False))
+
+    def inc(self, name, host, amount=1, **labels):
+        """カウンター name（host と labels ごと）に amount を足す。"""
+        key = (name, host or "", tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def counters(self):
+        """[{name, host, labels, value}, ...] を名前・ホスト順で返す。"""
+        with self._lock:
+            items = sorted(self._counters.items())
+        return [{"name": name, "host": host, "labels": dict(labels), "value": value}
+                for (name, host, labels), value in items]
+
+    @contextmanager
+    def timed(self, phase, host="", **fields):
+        """with で囲んだ区間の所要時間を記録する（例外で抜けた場合も error=True 付きで記録する）。"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(phase, host, time.perf_counter() - start, error=True, **fields)
+            raise
+        self.observe(phase, host, time.perf_counter() - start, **fields)
+
+    def snapshot(self):
+        """[{phase, host, count, sum, avg, p50, p95, max}, ...] を段階・ホスト順で返す。"""
+        with self._lock:
+            items = sorted(self._histograms.items())
+            rows = []
+            for (phase, host), hist in items:
+                rows.append({
+                    "phase": phase,
+                    "host": host,
+                    "count": hist.count,
+                    "sum": hist.sum,
+                    "avg": hist.sum / hist.count if hist.count else 0.0,
+                    "p50": hist.quantile(0.5),
+                    "p95": hist.quantile(0.95),
+                    "max": hist.max,
+                })
+        return rows
+
+    def render_prometheus(self):
+        """Prometheus のテキスト形式（histogram）で書き出す。"""
+        lines = [f"# HELP {METRIC_NAME} Time spent in each mail reader phase.",
+                 f"# TYPE {METRIC_NAME} histogram"]
+        with self._lock:
+            for (phase, host), hist in sorted(self._histograms.items()):
+                labels = f'phase="{_escape(phase)}",host="{_escape(host)}"'
+                cumulative = 0
+                for bound, n in zip(hist.buckets, hist.counts):
+                    cumulative += n
+                    lines.append(f'{METRIC_NAME}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{METRIC_NAME}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f"{METRIC_NAME}_sum{{{labels}}} {hist.sum:.6f}")
+                lines.append(f"{METRIC_NAME}_count{{{labels}}} {hist.count}")
+            counters = sorted(self._counters.items())
+        typed = set()
+        for (name, host, extra), value in counters:
+            metric = f"{COUNTER_PREFIX}{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            labels = ",".join(f'{k}="{_escape(str(v))}"' for k, v in (("host", host),) + extra)
+            lines.append(f"{metric}{{{labels}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _env_flag(name):
+    return os.environ.get(name, "").strip().lower() not in ("", "0", "false", "no")
+
+
+_registry = MetricsRegistry(log_json=_env_flag("MAIL_METRICS_LOG"))
+_server = None
+_server_error = None
+_server_lock = threading.Lock()
+
+
+def get_registry():
+    """プロセス全体で共有する MetricsRegistry を返す。"""
+    return _registry
+
+
+def timed(phase, host="", **fields):
+    return _registry.timed(phase, host, **fields)
+
+
+def observe(phase, host, seconds, **fields):
+    _registry.observe(phase, host, seconds, **fields)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = _registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, addr="127.0.0.1"):
+    """/metrics を配信する HTTP サーバーをデーモンスレッドで起動する（2 回目以降は何もしない）。"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True,
+                             name="metrics-http").start()
+        return _server
+
+
+def start_http_server_from_env():
+    """環境変数 MAIL_METRICS_PORT（と MAIL_METRICS_ADDR）があれば HTTP 配信を始める。"""
+    global _server_error
+    port = os.environ.get("MAIL_METRICS_PORT")
+    if not port or _server_error is not None:
+        # 起動に失敗した場合は再実行のたびに試し直さない
+        return None
+    try:
+        return start_http_server(int(port), os.environ.get("MAIL_METRICS_ADDR", "127.0.0.1"))
+    except (ValueError, OSError) as e:
+        _server_error = e
+        logger.warning("metrics endpoint not started: %s", e)
+        return None
@@ -0,0 +1,92 @@
+"""
+UID を基準にした一覧のページ送り（Streamlit 非依存）。
+
+件数を増やして最新 N 通を取り直すと、古いメールを見るたびに全部を再取得することになる。
+ここでは読み込み済みのうち最も小さい UID をカーソルにして、それより古い 1 ページ分だけを
+取得して後ろにつなげる（UID は UIDVALIDITY が変わらない限り変わらないので、途中で新着が
+届いてもページがずれない）。読み込んだページはセッションに残し、「新しいメール」に
+戻るときは取得しない。
+件名の選択欄には表示中のページ分だけを並べるので、何千通読み込んでも描画の量は変わらない。
+"""
+from dataclasses import dataclass, field
+
+from .fetch import search_latest_uids
+
+PAGE_SIZE = 10
+PAGE_SIZES = (10, 25, 50, 100)
+
+
+def search_page(conn, category, page_size, before=None, uidnext=None):
+    """
+    UID が before より小さいメールのうち新しいものから page_size 件の UID を新しい順に返す。
+    before が None なら先頭（uidnext より小さいもの）から。
+    """
+    return list(reversed(search_latest_uids(conn, category, page_size, uidnext=before or uidnext)))
+
+
+def page_cursor(mails):
+    """次（より古い）ページを取得するためのカーソル（mails の最小 UID）。空なら None。"""
+    uids = [int(m["uid"]) for m in mails if m.get("uid") is not None]
+    return min(uids) if uids else None
+
+
+@dataclass
+class BrowseState:
+    """
+    読み込み済みのメール（新しい順）と表示位置。
+    - key: 一覧の取得条件（アカウント・カテゴリなど）。変わったら作り直す
+    - has_older: さらに古いメールがありそうか（最後に取得したページが満杯だったか）
+    - offset: 表示中のページの先頭の位置
+    """
+    key: tuple
+    uidvalidity: object = None
+    mails: list = field(default_factory=list)
+    has_older: bool = True
+    offset: int = 0
+
+    @classmethod
+    def start(cls, key, first_page, page_size=PAGE_SIZE):
+        uidvalidity = first_page[0].get("uidvalidity") if first_page else None
+        return cls(key, uidvalidity, list(first_page), has_older=len(first_page) >= page_size)
+
+    @property
+    def cursor(self):
+        return page_cursor(self.mails)
+
+    def window(self, page_size):
+        """表示するページの (開始, 終了) の位置。"""
+        start = min(self.offset, max(0, len(self.mails) - 1))
+        return start, min(start + page_size, len(self.mails))
+
+    def needs_older(self, page_size):
+        """表示位置のページが読み込み済みの範囲を超えていて、取得すべきか。"""
+        return self.has_older and self.offset + page_size > len(self.mails)
+
+    def can_go_newer(self):
+        return self.offset > 0
+
+    def can_go_older(self, page_size):
+        return self.has_older or self.offset + page_size < len(self.mails)
+
+    def move(self, pages, page_size):
+        self.offset = max(0, self.offset + pages * page_size)
+
+    def extend(self, page, page_size):
+        """
+        取得した古いページを後ろにつなげる。UIDVALIDITY が変わっていたら False を返す
+        （カーソルが無効なので呼び出し側で最初から読み込み直す）。
+        """
+        if page and self.uidvalidity is not None and page[0].get("uidvalidity") != self.uidvalidity:
+            return False
+        cursor = self.cursor
+        # 取得の間に新着・削除があっても重複しないよう、カーソルより古いものだけを足す
+        self.mails.extend(m for m in page if cursor is None or int(m["uid"]) < cursor)
+        self.has_older = len(page) >= page_size
+        # 古いメールが無かった場合は最後のページに戻す
+        self.clamp(page_size)
+        return True
+
+    def clamp(self, page_size):
+        """表示位置が読み込み済みの範囲を超えていたら、最後のページに戻す。"""
+        if self.offset >= len(self.mails):
+            self.offset = max(0, (len(self.mails) - 1) // page_size * page_size)
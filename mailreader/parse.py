@@ -0,0 +1,218 @@
+"""
+RFC822 メッセージの解析（ヘッダーのデコード・本文の選択と文字コード変換・HTML のテキスト化）。
+
+解析は CPU だけを使う処理なので、数百通をまとめて取り込むときは
+プロセスプールに分散する（スレッドでは GIL のため 1 コアしか使えない）。
+- parse_many は RFC822 全体から、parse_bodies は取得済みの本文パートから読み上げ用の本文を作る
+  （バッチの本文取得は parse_bodies で HTML のテキスト化をまとめて並列に行う）
+- 少ない件数・小さいメール（ヘッダーだけの取得を含む）ではプロセス間の受け渡しや
+  プールの起動の方が高くつくので、その場で解析する
+- 結果はプロセス間で小さく受け渡せるようタプルで返し、呼び出し側で dict にする
+- Streamlit のサーバーはスレッドを多数抱えているので fork は使わず forkserver / spawn で起動する
+"""
+import email
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from email.header import decode_header, make_header
+
+from .bodystructure import SPEECH_CHAR_BUDGET
+from .html_text import html_to_text, strip_unreadable
+from .metrics import timed
+
+# これより少ない件数はプロセスプールを使わずに解析する
+PROCESS_MIN_BATCH = 32
+# 合計がこれより小さい場合もその場で解析する（ヘッダーだけなら 100 通でも数十 KB）
+PROCESS_MIN_BYTES = 256 * 1024
+# 1 回のプロセス間受け渡しでまとめて送る通数
+PROCESS_CHUNK = 16
+
+
+def decode_mime(s):
+    if s is None:
+        return ""
+    try:
+        # "=?UTF-8?...?=" 形式をまとめてデコード
+        return str(make_header(decode_header(s)))
+    except Exception:
+        return s
+
+
+def _decode_payload(part):
+    payload = part.get_payload(decode=True)
+    charset = part.get_content_charset() or "utf-8"
+    if payload is None:
+        # デコードできなかった場合の保険
+        data = part.get_payload()
+        return data if isinstance(data, str) else ""
+    try:
+        return payload.decode(charset, errors="ignore")
+    except Exception:
+        return payload.decode("utf-8", errors="ignore")
+
+
+def get_best_body(msg, budget=SPEECH_CHAR_BUDGET):
+    """
+    text/plain を優先し、無ければ text/html をプレーンテキスト化。
+    """
+    plain = None
+    html = None
+    for part in msg.walk() if msg.is_multipart() else (msg,):
+        ctype = part.get_content_type()
+        if ctype not in ("text/plain", "text/html"):
+            continue
+        if "attachment" in str(part.get("Content-Disposition") or ""):
+            continue
+        if ctype == "text/plain" and plain is None:
+            plain = _decode_payload(part)
+        elif ctype == "text/html" and html is None:
+            html = _decode_payload(part)
+    if plain and plain.strip():
+        return plain.strip()
+    if html and html.strip():
+        with timed("html_to_text"):
+            return html_to_text(html, budget=budget)
+    return ""
+
+
+def _parse_record(uid, raw, headers_only):
+    msg = email.message_from_bytes(raw)
+    body = readable = None
+    if not headers_only:
+        body = get_best_body(msg)
+        readable = strip_unreadable(body)
+    return (uid, decode_mime(msg.get("Subject")), decode_mime(msg.get("From")),
+            decode_mime(msg.get("Date")), body, readable)
+
+
+def _parse_chunk(items, headers_only):
+    # ワーカープロセス側で実行される
+    return [_parse_record(uid, raw, headers_only) for uid, raw in items]
+
+
+def body_text(part, budget=SPEECH_CHAR_BUDGET):
+    """
+    取得した本文パートから (本文, remove_unreadable 済みの本文) を作る。
+    part は (content-type, 文字列)・RFC822 全体の bytes・None（テキストパート無し）のいずれか。
+    """
+    if part is None:
+        body = ""
+    elif isinstance(part, bytes):
+        body = get_best_body(email.message_from_bytes(part), budget=budget)
+    else:
+        ctype, text = part
+        if ctype == "text/plain":
+            body = text.strip()
+        else:
+            with timed("html_to_text"):
+                body = html_to_text(text, budget=budget)
+    return body, strip_unreadable(body)
+
+
+def _body_chunk(parts):
+    # ワーカープロセス側で実行される
+    return [body_text(part) for part in parts]
+
+
+def _part_size(part):
+    if part is None:
+        return 0
+    return len(part) if isinstance(part, bytes) else len(part[1])
+
+
+def _to_entry(record):
+    uid, subject, sender, date, body, readable = record
+    return {
+        "uid": uid.decode() if isinstance(uid, bytes) else str(uid),
+        "subject": subject,
+        "from": sender,
+        "date": date,
+        "body": body,
+        "readable": readable,
+    }
+
+
+def parse_message(uid, raw, headers_only=False, host=""):
+    """取得したヘッダー（または RFC822 全体）から一覧用の dict を作る。"""
+    with timed("parse", host, messages=1):
+        return _to_entry(_parse_record(uid, raw, headers_only))
+
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers):
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=_mp_context())
+            _executor_workers = max_workers
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def parse_many(items, headers_only=False, max_workers=None, min_batch=PROCESS_MIN_BATCH,
+               min_bytes=PROCESS_MIN_BYTES, host=""):
+    """
+    [(uid, RFC822 の bytes), ...] をまとめて解析し、同じ順の dict のリストを返す。
+    本文付きで min_batch 通以上・合計 min_bytes 以上かつ複数コアがある場合は
+    プロセスプールで並列に解析する。
+    プロセスプールが使えない環境（起動失敗・ワーカーの異常終了）ではその場で解析し直す。
+    host は計測のラベルにだけ使う。
+    """
+    items = list(items)
+    with timed("parse", host, messages=len(items)):
+        return _parse_items(items, headers_only, max_workers, min_batch, min_bytes)
+
+
+def _parse_items(items, headers_only, max_workers, min_batch, min_bytes):
+    if headers_only:
+        return [_to_entry(r) for r in _parse_chunk(items, headers_only)]
+    records = _map_chunks(_parse_chunk, items, sum(len(raw) for _, raw in items),
+                          max_workers, min_batch, min_bytes, headers_only)
+    return [_to_entry(r) for r in records]
+
+
+def parse_bodies(parts, max_workers=None, min_batch=PROCESS_MIN_BATCH,
+                 min_bytes=PROCESS_MIN_BYTES, host=""):
+    """
+    body_text の複数通版。[本文パート, ...] と同じ順の [(本文, remove_unreadable 済みの本文), ...] を返す。
+    プロセスプールを使う条件と、使えない場合の扱いは parse_many と同じ。
+    """
+    parts = list(parts)
+    with timed("parse", host, messages=len(parts)):
+        return _map_chunks(_body_chunk, parts, sum(map(_part_size, parts)),
+                           max_workers, min_batch, min_bytes)
+
+
+def _map_chunks(func, items, total_bytes, max_workers, min_batch, min_bytes, *args):
+    # func(items の一部, *args) -> 結果のリスト を、件数と大きさが十分ならプロセスプールで実行する
+    workers = max_workers or os.cpu_count() or 1
+    if len(items) < min_batch or workers < 2 or total_bytes < min_bytes:
+        return func(items, *args)
+    chunks = [items[i:i + PROCESS_CHUNK] for i in range(0, len(items), PROCESS_CHUNK)]
+    try:
+        executor = _get_executor(workers)
+        results = executor.map(func, chunks, *[[arg] * len(chunks) for arg in args])
+        return [r for chunk in results for r in chunk]
+    except (BrokenProcessPool, OSError):
+        _reset_executor()
+        return func(items, *args)
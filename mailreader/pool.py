@@ -0,0 +1,224 @@
+"""
+IMAP 接続プール。
+
+Streamlit はウィジェット操作のたびにスクリプトを再実行するため、
+毎回 TLS ハンドシェイク + LOGIN を行うと 1〜3 秒かかる。
+ここではアカウントごとにログイン済みの接続を保持し、再実行やセッションを
+またいで使い回す。
+- 再利用前に一定時間アイドルだった接続は NOOP で生存確認し、切れていれば張り直す
+- idle_timeout を超えてアイドルな接続は破棄（LOGOUT）する
+  （アイドルな接続があるあいだは裏のスレッドが定期的に確認するので、操作が無くても閉じられる）
+"""
+import hashlib
+import imaplib
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+
+from .compress import CompressingIMAP4_SSL, compression_enabled
+from .metrics import timed
+
+
+def credentials_digest(user, password):
+    """パスワードをそのまま保持しないためのハッシュ値。"""
+    return hashlib.sha256(f"{user}\0{password}".encode("utf-8")).hexdigest()
+
+
+def account_key(host, user, password):
+    """接続を共有してよい単位のキー（パスワードも含め、誤ったパスワードで既存接続を使えないようにする）。"""
+    return (host, user.lower(), credentials_digest(user, password))
+
+
+def safe_logout(conn):
+    """LOGOUT の失敗（切断済みなど）は無視する。"""
+    try:
+        conn.logout()
+    except Exception:
+        pass
+
+
+def _default_connect(host, timeout, ssl_context):
+    # MAIL_IMAP_COMPRESS が設定されていれば、LOGIN 後に COMPRESS=DEFLATE を試せる接続にする
+    cls = CompressingIMAP4_SSL if compression_enabled() else imaplib.IMAP4_SSL
+    return cls(host, timeout=timeout, ssl_context=ssl_context)
+
+
+class IMAPConnectionPool:
+    """
+    アカウント（ホスト・ユーザー・パスワード）単位の IMAP 接続プール。
+    - idle_timeout: これ以上アイドルな接続は破棄する（秒）
+    - noop_after: これ以上アイドルだった接続は貸し出し前に NOOP で確認する（秒）
+    - max_idle_per_account: アカウントごとに保持するアイドル接続の上限
+    - evict_interval: 期限切れの接続を確認する間隔（秒、省略時は idle_timeout の 1/4）
+    """
+
+    def __init__(self, idle_timeout=300.0, noop_after=10.0, max_idle_per_account=2,
+                 connect=_default_connect, evict_interval=None):
+        self.idle_timeout = idle_timeout
+        self.noop_after = noop_after
+        self.max_idle_per_account = max_idle_per_account
+        self.evict_interval = evict_interval or max(1.0, idle_timeout / 4)
+        self._connect = connect
+        self._evictor = None
+        self._idle = {}  # key -> [(conn, 返却時刻), ...]
+        self._keys = {}  # id(conn) -> key
+        self._lock = threading.Lock()
+
+    def acquire(self, host, user, password, timeout=15, ssl_context=None):
+        """
+        ログイン済みの接続を返す。プールに使える接続が無ければ新規に接続・ログインする。
+        認証エラーなどの例外はそのまま呼び出し元に送出する。
+        """
+        key = account_key(host, user, password)
+        while True:
+            conn, idle_for = self._pop_idle(key)
+            if conn is None:
+                break
+            if idle_for < self.noop_after:
+                self._keys[id(conn)] = key
+                return conn
+            try:
+                with timed("noop", host):
+                    typ, _ = conn.noop()
+                if typ == "OK":
+                    self._keys[id(conn)] = key
+                    return conn
+            except Exception:
+                pass
+            # サーバー側で切られていた接続は捨てて次を試す
+            safe_logout(conn)
+
+        if ssl_context is None:
+            ssl_context = ssl.create_default_context()
+        with timed("connect", host):
+            conn = self._connect(host, timeout, ssl_context)
+        try:
+            with timed("login", host):
+                conn.login(user, password)
+            start_compression = getattr(conn, "start_compression", None)
+            if start_compression is not None:
+                # サーバーが対応していなければ圧縮せずにそのまま使う
+                with timed("compress", host):
+                    start_compression()
+        except Exception:
+            safe_logout(conn)
+            raise
+        self._keys[id(conn)] = key
+        return conn
+
+    def release(self, conn):
+        """使い終わった接続をプールへ戻す。"""
+        key = self._keys.pop(id(conn), None)
+        if key is None:
+            safe_logout(conn)
+            return
+        now = time.monotonic()
+        with self._lock:
+            expired = self._evict_expired_locked(now)
+            bucket = self._idle.setdefault(key, [])
+            if len(bucket) < self.max_idle_per_account:
+                bucket.append((conn, now))
+                conn = None
+                self._start_evictor_locked()
+        for old in expired:
+            safe_logout(old)
+        if conn is not None:
+            safe_logout(conn)
+
+    def discard(self, conn):
+        """エラーが起きた接続はプールへ戻さず閉じる。"""
+        self._keys.pop(id(conn), None)
+        safe_logout(conn)
+
+    @contextmanager
+    def connection(self, host, user, password, timeout=15, ssl_context=None):
+        """
+        with pool.connection(...) as conn: の形で使う。
+        正常終了ならプールへ返却し、例外時は接続を破棄して例外を再送出する。
+        """
+        conn = self.acquire(host, user, password, timeout=timeout, ssl_context=ssl_context)
+        try:
+            yield conn
+        except BaseException:
+            self.discard(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def evict_idle(self):
+        """idle_timeout を過ぎた接続を閉じる。"""
+        with self._lock:
+            expired = self._evict_expired_locked(time.monotonic())
+        for conn in expired:
+            safe_logout(conn)
+        return len(expired)
+
+    def _start_evictor_locked(self):
+        if self._evictor is None:
+            self._evictor = threading.Thread(target=self._evict_loop, daemon=True,
+                                             name="imap-pool-evict")
+            self._evictor.start()
+
+    def _evict_loop(self):
+        # アイドルな接続が無くなったら終了し、次に返却されたときに起動し直す
+        while True:
+            time.sleep(self.evict_interval)
+            self.evict_idle()
+            with self._lock:
+                if not self._idle:
+                    self._evictor = None
+                    return
+
+    def close_all(self):
+        with self._lock:
+            buckets = list(self._idle.values())
+            self._idle.clear()
+        for bucket in buckets:
+            for conn, _ in bucket:
+                safe_logout(conn)
+
+    def _pop_idle(self, key):
+        now = time.monotonic()
+        conn = None
+        released_at = now
+        with self._lock:
+            expired = self._evict_expired_locked(now)
+            bucket = self._idle.get(key)
+            if bucket:
+                # 直近に返却された接続ほど生きている可能性が高い
+                conn, released_at = bucket.pop()
+                if not bucket:
+                    del self._idle[key]
+        for old in expired:
+            safe_logout(old)
+        return conn, now - released_at
+
+    def _evict_expired_locked(self, now):
+        # 期限切れの接続を取り出すだけ。LOGOUT はロックの外で呼び出し元が行う
+        expired = []
+        for key in list(self._idle):
+            alive = []
+            for conn, released_at in self._idle[key]:
+                if now - released_at > self.idle_timeout:
+                    expired.append(conn)
+                else:
+                    alive.append((conn, released_at))
+            if alive:
+                self._idle[key] = alive
+            else:
+                del self._idle[key]
+        return expired
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """プロセス全体で共有する接続プールを返す（スクリプトの再実行では作り直されない）。"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = IMAPConnectionPool()
+        return _pool
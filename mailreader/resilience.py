@@ -0,0 +1,344 @@
+"""
+IMAP ホスト・アカウントごとのサーキットブレーカーと、描画スレッドを止めないリトライ。
+
+描画スレッドで time.sleep して再試行すると、その間セッションが固まり、
+再実行のたびに再試行が最初からやり直しになる。ここでは
+- 最初の 1 回だけ呼び出し元で実行し、失敗したら残りの再試行はバックグラウンドで行う
+  （待ち時間はジッター付きの指数バックオフ。同じ取得の再試行はプロセス全体で 1 本だけ）
+- 同じホスト・アカウントで失敗が続いたら回路を開き、しばらく接続しに行かない
+  （その間は最後に成功した結果を返し、回復の確認はバックグラウンドで行う）
+を行う。最後に成功した結果は stale_ttl 秒・max_entries 件まで（古いものから捨てる）、
+ブレーカーは失敗を抱えていないものを捨てて max_entries 個程度までに抑える（長時間動かしても増え続けない）。
+回路は (ホスト, アカウント) ごとに持つので、1 人の失敗で同じホストの他の利用者は
+止まらない。失敗として数えるのは接続・タイムアウトなどのエラーだけで（BAD / NO 応答の
+コマンドエラーは再試行しても直らないので数えない）、1 回の取得は裏での再試行を含めて 1 回と数える。
+Streamlit は呼ばないので、表示は呼び出し側が Outcome を見て行う。
+"""
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from .engine import is_auth_error, is_transient_error
+
+DEFAULT_RETRIES = 3
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_RESET_TIMEOUT = 15.0
+MAX_RESET_TIMEOUT = 300.0
+# 回復確認をこの回数失敗したら、確認をやめて次の取得に判断を任せる
+DEFAULT_MAX_PROBES = 5
+# 最後に成功した結果を、接続できないときの代わりとして使う秒数と保持する件数
+DEFAULT_STALE_TTL = 3600.0
+DEFAULT_MAX_ENTRIES = 256
+
+
+def jittered_backoff(attempt, base=1.0, cap=30.0):
+    """attempt 回目の待ち時間（0〜base*2^attempt の一様乱数、cap で頭打ち）。"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitOpenError(Exception):
+    """回路が開いているため接続しなかったことを表す。"""
+
+    retryable = False
+
+    def __init__(self, host, last_error=None):
+        super().__init__(f"{host} への接続を一時停止しています（直前のエラー: {last_error}）")
+        self.host = host
+        self.last_error = last_error
+
+
+@dataclass
+class Outcome:
+    """
+    取得を直接行わなかった、または失敗したときの状況。
+    - value: バックグラウンドの再試行で取得できた結果（あればそのまま使える）
+    - stale / stale_at: 最後に成功した結果とその時刻（time.time()）
+    - pending: バックグラウンドで再試行中
+    - circuit_open: 回路が開いていて接続しに行かなかった
+    """
+    value: object = None
+    stale: object = None
+    stale_at: float = None
+    error: BaseException = None
+    pending: bool = False
+    circuit_open: bool = False
+
+    @property
+    def fresh(self):
+        return self.value is not None
+
+
+class CircuitBreaker:
+    """
+    1 ホスト・1 アカウント分のサーキットブレーカー。
+    連続 failure_threshold 回の失敗で開き、reset_timeout（ジッター付き）ごとに
+    バックグラウンドで probe を実行して、成功したら閉じる。失敗するたびに間隔を倍にする。
+    probe が認証エラーになった場合や max_probes 回失敗した場合は確認をやめ、回路を半開きにする
+    （次の取得を 1 回だけ通し、それも失敗したら開き直して、その取得で確認をやり直す）。
+    使う人がいなくなったアカウントに接続し続けないようにするため。
+    """
+
+    def __init__(self, host, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT, on_recover=None, account=None,
+                 max_probes=DEFAULT_MAX_PROBES):
+        self.host = host
+        self.account = account
+        self.failure_threshold = failure_threshold
+        self.max_probes = max_probes
+        self.initial_reset_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._on_recover = on_recover
+        self._probe = None  # (key, fn)
+        self._prober = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self.opened_at is not None
+
+    def allow(self):
+        return not self.is_open
+
+    @property
+    def idle(self):
+        """閉じていて失敗も数えていない（捨てても状態を失わない）。"""
+        with self._lock:
+            return self.opened_at is None and self.failures == 0
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.reset_timeout = self.initial_reset_timeout
+
+    def record_failure(self, exc, probe=None):
+        """失敗を記録する。probe=(key, fn) は回路が開いたときの回復確認に使う。"""
+        with self._lock:
+            self.failures += 1
+            self.last_error = exc
+            if probe is not None:
+                self._probe = probe
+            if self.opened_at is None and self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+            if self.opened_at is not None and self._probe is not None and (
+                    self._prober is None or not self._prober.is_alive()):
+                self._prober = threading.Thread(target=self._probe_loop, daemon=True,
+                                                name=f"imap-probe-{self.host}")
+                self._prober.start()
+
+    def _probe_loop(self):
+        for _ in range(self.max_probes):
+            with self._lock:
+                if self.opened_at is None:
+                    return
+                delay = self.reset_timeout
+            time.sleep(random.uniform(delay / 2, delay))
+            with self._lock:
+                key, fn = self._probe
+            try:
+                value = fn()
+            except Exception as e:
+                with self._lock:
+                    self.last_error = e
+                    self.reset_timeout = min(self.reset_timeout * 2, MAX_RESET_TIMEOUT)
+                if is_auth_error(e):
+                    # パスワードが変わった・取り消されたアカウントに LOGIN を繰り返さない
+                    break
+                continue
+            self.record_success()
+            if self._on_recover is not None:
+                self._on_recover(key, value)
+            return
+        self._half_open()
+
+    def _half_open(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            self.opened_at = None
+            self.failures = self.failure_threshold - 1
+            self.reset_timeout = self.initial_reset_timeout
+            self._probe = None
+
+
+class _Job:
+    __slots__ = ("fn", "error", "pending", "result", "has_result")
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.error = None
+        self.pending = False
+        self.result = None
+        self.has_result = False
+
+
+class Retrier:
+    """
+    取得処理をキー（アカウント・カテゴリ等）ごとに管理する。使い方:
+
+        outcome = retrier.begin(key, host, account)
+        if outcome is None:           # 接続してよい
+            try:
+                value = fetch()
+            except Exception as e:
+                outcome = retrier.failed(key, host, e, fetch, account)
+            else:
+                retrier.succeeded(key, host, value, account)
+        # outcome があれば value / stale を表示する
+
+    呼び出し元では待たない。バックグラウンドで結果が得られると version が増える。
+    """
+
+    def __init__(self, retries=DEFAULT_RETRIES, base_delay=1.0, max_delay=30.0,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT,
+                 stale_ttl=DEFAULT_STALE_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.version = 0
+        self._breakers = {}
+        self._jobs = {}
+        self._last_good = {}  # key -> (value, time.time())
+        self._lock = threading.Lock()
+
+    def breaker(self, host, account=None):
+        with self._lock:
+            breaker = self._breakers.get((host, account))
+            if breaker is None:
+                if len(self._breakers) >= self.max_entries:
+                    # 失敗を抱えていないブレーカーは作り直しても同じなので捨てる
+                    for k in [k for k, b in self._breakers.items() if b.idle]:
+                        del self._breakers[k]
+                breaker = CircuitBreaker(host, self.failure_threshold, self.reset_timeout,
+                                         on_recover=self._store_result, account=account)
+                self._breakers[(host, account)] = breaker
+            return breaker
+
+    def begin(self, key, host, account=None):
+        """
+        接続してよければ None を返す。バックグラウンドの結果がある・再試行中・回路が開いている
+        場合は、接続せずに Outcome を返す。
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.has_result:
+                del self._jobs[key]
+                return Outcome(value=job.result)
+            if job is not None and job.pending:
+                return self._degraded_locked(key, job.error, pending=True)
+        breaker = self.breaker(host, account)
+        if not breaker.allow():
+            with self._lock:
+                return self._degraded_locked(key, breaker.last_error, circuit_open=True)
+        return None
+
+    def succeeded(self, key, host, value, account=None):
+        self.breaker(host, account).record_success()
+        with self._lock:
+            self._remember_locked(key, value)
+            self._jobs.pop(key, None)
+
+    def failed(self, key, host, exc, fn, account=None):
+        """
+        呼び出し元での失敗を記録し、残りの再試行をバックグラウンドで始める。
+        認証エラーやコマンドのエラーは再試行もブレーカーへの記録もしない（呼び出し側で表示する）。
+        """
+        breaker = self.breaker(host, account)
+        if is_auth_error(exc) or not is_transient_error(exc):
+            with self._lock:
+                return self._degraded_locked(key, exc)
+        # 裏での再試行は同じ取得の続きなので、ブレーカーにはここで 1 回だけ数える
+        breaker.record_failure(exc, probe=(key, fn))
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None:
+                if not breaker.allow() or self.retries <= 1:
+                    return self._degraded_locked(key, exc, circuit_open=not breaker.allow())
+                job = self._jobs[key] = _Job(fn)
+            job.fn = fn
+            job.error = exc
+            if not job.pending and breaker.allow() and self.retries > 1:
+                job.pending = True
+                threading.Thread(target=self._retry_loop, args=(breaker, key, job), daemon=True,
+                                 name=f"imap-retry-{host}").start()
+            return self._degraded_locked(key, exc, pending=job.pending,
+                                         circuit_open=not breaker.allow())
+
+    def _retry_loop(self, breaker, key, job):
+        for attempt in range(1, self.retries):
+            time.sleep(jittered_backoff(attempt, self.base_delay, self.max_delay))
+            if not breaker.allow():
+                # 回路が開いたら回復確認はブレーカー側に任せる
+                break
+            try:
+                value = job.fn()
+            except Exception as e:
+                with self._lock:
+                    job.error = e
+                if is_auth_error(e) or not is_transient_error(e):
+                    break
+                continue
+            breaker.record_success()
+            self._store_result(key, value)
+            return
+        with self._lock:
+            job.pending = False
+            if self._jobs.get(key) is job:
+                # 結果が無いまま終わった再試行は残しておいても使わない
+                del self._jobs[key]
+
+    def _store_result(self, key, value):
+        with self._lock:
+            self._remember_locked(key, value)
+            job = self._jobs.get(key)
+            if job is None:
+                job = self._jobs[key] = _Job(None)
+            job.result = value
+            job.has_result = True
+            job.pending = False
+            self.version += 1
+
+    def _remember_locked(self, key, value):
+        now = time.time()
+        self._last_good[key] = (value, now)
+        for k in [k for k, (_, at) in self._last_good.items() if now - at > self.stale_ttl]:
+            del self._last_good[k]
+        # 上限を超えたら取得の古いものから捨てる
+        overflow = len(self._last_good) - self.max_entries
+        if overflow > 0:
+            oldest = sorted(self._last_good, key=lambda k: self._last_good[k][1])[:overflow]
+            for k in oldest:
+                del self._last_good[k]
+        # 回復確認で得た結果のうち、取りに来ないまま古い結果からも消えたものは捨てる
+        for k in [k for k, job in self._jobs.items()
+                  if job.has_result and k not in self._last_good]:
+            del self._jobs[k]
+
+    def _degraded_locked(self, key, error, pending=False, circuit_open=False):
+        stale, stale_at = self._last_good.get(key, (None, None))
+        if stale_at is not None and time.time() - stale_at > self.stale_ttl:
+            stale = stale_at = None
+        return Outcome(stale=stale, stale_at=stale_at, error=error,
+                       pending=pending, circuit_open=circuit_open)
+
+
+_retrier = None
+_retrier_lock = threading.Lock()
+
+
+def get_retrier():
+    """プロセス全体で共有する Retrier を返す。"""
+    global _retrier
+    with _retrier_lock:
+        if _retrier is None:
+            _retrier = Retrier()
+        return _retrier
@@ -0,0 +1,142 @@
+"""
+imaplib が返す FETCH 応答を構造化するための簡易パーサ。
+
+imaplib は FETCH 応答を
+    [(b'12 (UID 345 RFC822 {1234}', b'<本体>'), b')', b'13 (UID 346 FLAGS ())', ...]
+のような「行＋リテラル」の並びで返すので、これを括弧リストとして読み直し
+メッセージごとの {項目名: 値} に分解する。
+"""
+import re
+
+_LITERAL_RE = re.compile(rb"\{\d+\}\s*$")
+
+_OPEN = object()
+_CLOSE = object()
+
+
+class _Atom(bytes):
+    """クォートされていないアトム（クォート文字列の "NIL" と区別するため）。"""
+
+
+class _Literal:
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+
+def _pieces(data):
+    # imaplib の応答リストを「テキスト片」と「リテラル」の並びに平坦化する
+    for item in data:
+        if isinstance(item, tuple):
+            head, literal = item[0], item[1]
+            # 行末の {n} はリテラルの予告なので取り除く
+            yield _LITERAL_RE.sub(b"", head)
+            yield _Literal(literal)
+        elif item is not None:
+            yield item
+
+
+def _tokenize(text):
+    i = 0
+    n = len(text)
+    while i < n:
+        c = text[i:i + 1]
+        if c in (b" ", b"\r", b"\n", b"\t"):
+            i += 1
+        elif c == b"(":
+            yield _OPEN
+            i += 1
+        elif c == b")":
+            yield _CLOSE
+            i += 1
+        elif c == b'"':
+            i += 1
+            buf = bytearray()
+            while i < n and text[i:i + 1] != b'"':
+                if text[i:i + 1] == b"\\" and i + 1 < n:
+                    i += 1
+                buf += text[i:i + 1]
+                i += 1
+            i += 1
+            yield bytes(buf)
+        else:
+            start = i
+            depth = 0
+            while i < n:
+                c = text[i:i + 1]
+                if c == b"[":
+                    depth += 1
+                elif c == b"]":
+                    depth -= 1
+                elif depth == 0 and c in (b" ", b"(", b")", b"\r", b"\n"):
+                    break
+                i += 1
+            atom = text[start:i]
+            yield None if atom.upper() == b"NIL" else _Atom(atom)
+
+
+def parse_tokens(data):
+    """imaplib の応答リストをトークン列（bytes / None / 括弧 / _Literal）にする。"""
+    tokens = []
+    for piece in _pieces(data):
+        if isinstance(piece, _Literal):
+            tokens.append(piece)
+        else:
+            tokens.extend(_tokenize(piece))
+    return tokens
+
+
+def parse_sexp(tokens):
+    """トークン列を入れ子リストに組み立てる。リテラルは bytes に置き換える。"""
+    stack = [[]]
+    for tok in tokens:
+        if tok is _OPEN:
+            stack.append([])
+        elif tok is _CLOSE:
+            if len(stack) > 1:
+                done = stack.pop()
+                stack[-1].append(done)
+        elif isinstance(tok, _Literal):
+            stack[-1].append(tok.data)
+        else:
+            stack[-1].append(tok)
+    while len(stack) > 1:
+        done = stack.pop()
+        stack[-1].append(done)
+    return stack[0]
+
+
+def parse_fetch_response(data):
+    """
+    FETCH 応答をメッセージごとの dict のリストにする。
+    キーは大文字化した項目名（str）、値は bytes / None / 入れ子リスト。
+    例: [{"UID": b"345", "RFC822": b"..."}, ...]
+    """
+    messages = []
+    items = parse_sexp(parse_tokens(data))
+    for i, item in enumerate(items):
+        if not isinstance(item, list):
+            continue
+        # 直前がシーケンス番号、item が (キー 値 キー 値 ...) のリスト
+        msg = {}
+        for j in range(0, len(item) - 1, 2):
+            key = item[j]
+            if isinstance(key, bytes):
+                msg[key.decode("ascii", "replace").upper()] = item[j + 1]
+        if i > 0 and isinstance(items[i - 1], bytes) and items[i - 1].isdigit():
+            msg.setdefault("SEQ", items[i - 1])
+        messages.append(msg)
+    return messages
+
+
+def find_item(msg, prefix):
+    """
+    BODY[...] のようにサーバーが返す表記が揺れる項目を前方一致で探す。
+    例: find_item(msg, "BODY[HEADER") は "BODY[HEADER.FIELDS (SUBJECT)]" にも当たる。
+    """
+    prefix = prefix.upper()
+    for key, value in msg.items():
+        if key.startswith(prefix):
+            return value
+    return None
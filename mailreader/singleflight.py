@@ -0,0 +1,162 @@
+"""
+プロセス全体での取得の相乗り（single-flight）と、結果の短時間共有。
+
+同じアカウントを複数のタブ・端末で開くと、セッションごとに同じ一覧を取得しに行き、
+並列の LOGIN（Gmail は制限をかけてくる）と同じメールの重複ダウンロードが発生する。ここでは
+- 同じキー（アカウント・カテゴリ・取得範囲）の取得が実行中なら、新たに接続せずその結果を待つ
+- 取得できた結果は ttl 秒だけ共有し、その間の同じ取得には接続せずに返す
+ことで、サーバーへの負荷がタブ数ではなくアカウント数に比例するようにする。
+共有した結果は複数のセッションから参照されるので、受け取った側で書き換えないこと。
+"""
+import threading
+import time
+
+DEFAULT_TTL = 10.0
+DEFAULT_MAX_ENTRIES = 256
+
+
+class SharedFailure(Exception):
+    """相乗りしていた取得が失敗したことを表す（再試行・失敗の記録は実行した側で済んでいる）。"""
+
+    retryable = False
+
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
+
+
+class _Call:
+    __slots__ = ("done", "value", "error", "abandoned")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.abandoned = False
+
+
+class SingleFlight:
+    """
+    キーごとに実行中の取得を 1 つにまとめる。使い方:
+
+        value = flights.do(key, fetch)        # 同じ key の実行中・共有中の結果があればそれを返す
+
+    取得しながら結果を少しずつ使いたい場合は、acquire で実行役になってから
+    finish / fail / abandon で結果を知らせる。
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.calls = 0    # 実際に実行した回数
+        self.shared = 0   # 実行中の取得に相乗りした回数
+        self.hits = 0     # 共有中の結果を返した回数
+        self._inflight = {}  # key -> _Call
+        self._results = {}   # key -> (値, 期限 time.monotonic())
+        self._lock = threading.Lock()
+
+    def acquire(self, key, fresh=False):
+        """
+        (実行役の _Call, None) か (None, 共有された値) を返す。
+        fresh=True なら共有中の結果は使わない（実行中の取得には相乗りする）。
+        相乗りした取得が失敗した場合は SharedFailure を送出する。
+        """
+        while True:
+            with self._lock:
+                if not fresh:
+                    hit = self._results.get(key)
+                    if hit is not None and hit[1] > time.monotonic():
+                        self.hits += 1
+                        return None, hit[0]
+                call = self._inflight.get(key)
+                if call is None:
+                    call = self._inflight[key] = _Call()
+                    self.calls += 1
+                    return call, None
+                self.shared += 1
+            call.done.wait()
+            if call.abandoned:
+                # 実行役が途中でやめたので、あらためて実行役を決める
+                continue
+            if call.error is not None:
+                raise SharedFailure(call.error)
+            return None, call.value
+
+    def finish(self, key, call, value, ttl=None):
+        """実行役が結果を知らせる。待っている呼び出しに値を渡し、ttl 秒共有する。"""
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            if self._inflight.get(key) is call:
+                del self._inflight[key]
+            if ttl > 0:
+                self._results[key] = (value, time.monotonic() + ttl)
+                self._evict_locked()
+        call.value = value
+        call.done.set()
+
+    def fail(self, key, call, error):
+        """実行役が失敗を知らせる（失敗は共有しない）。"""
+        with self._lock:
+            if self._inflight.get(key) is call:
+                del self._inflight[key]
+        call.error = error
+        call.done.set()
+
+    def abandon(self, key, call):
+        """実行役が結果を出さずにやめたことを知らせる（結果を出した後なら何もしない）。"""
+        if call.done.is_set():
+            return
+        with self._lock:
+            if self._inflight.get(key) is call:
+                del self._inflight[key]
+        call.abandoned = True
+        call.done.set()
+
+    def do(self, key, fn, fresh=False, ttl=None):
+        """key の取得を fn() で行う。実行中・共有中の結果があれば fn は呼ばない。"""
+        call, value = self.acquire(key, fresh)
+        if call is None:
+            return value
+        try:
+            value = fn()
+        except Exception as e:
+            self.fail(key, call, e)
+            raise
+        else:
+            self.finish(key, call, value, ttl)
+            return value
+        finally:
+            # KeyboardInterrupt などで抜けた場合も待っている側を止めたままにしない
+            self.abandon(key, call)
+
+    def forget(self, key):
+        with self._lock:
+            self._results.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def _evict_locked(self):
+        now = time.monotonic()
+        for key in [k for k, (_, expires) in self._results.items() if expires <= now]:
+            del self._results[key]
+        # 上限を超えたら期限の近いものから捨てる
+        overflow = len(self._results) - self.max_entries
+        if overflow > 0:
+            oldest = sorted(self._results, key=lambda k: self._results[k][1])[:overflow]
+            for key in oldest:
+                del self._results[key]
+
+
+_flights = None
+_flights_lock = threading.Lock()
+
+
+def get_flights():
+    """プロセス全体で共有する SingleFlight を返す。"""
+    global _flights
+    with _flights_lock:
+        if _flights is None:
+            _flights = SingleFlight()
+        return _flights
@@ -0,0 +1,57 @@
+"""
+読み上げテキストの分割。
+
+長い文章を 1 つの SpeechSynthesisUtterance に渡すと、ブラウザによっては話し始めるまで
+固まったり、途中で黙って打ち切られたりする。そこで文末（。！？）と改行で区切った
+短いチャンクにし、ブラウザ側のキューで 1 つずつ読み上げる。
+"""
+import re
+
+# 1 チャンクの最大文字数（長すぎる 1 文は読点・空白・この長さで区切る）
+MAX_CHUNK_CHARS = 120
+
+_SENTENCE_RE = re.compile(r"[^。！？!?\n]*(?:[。！？!?]+[」』）)]*|\n|$)")
+_SOFT_BREAK_RE = re.compile(r"[、，,]|\s")
+
+
+def _split_long(sentence, max_chars):
+    while len(sentence) > max_chars:
+        # 読点か空白の直後で切る。見つからなければ max_chars で切る
+        cut = 0
+        for m in _SOFT_BREAK_RE.finditer(sentence, 0, max_chars):
+            cut = m.end()
+        if cut == 0:
+            cut = max_chars
+        yield sentence[:cut]
+        sentence = sentence[cut:]
+    if sentence:
+        yield sentence
+
+
+def iter_sentences(text, max_chars=MAX_CHUNK_CHARS):
+    """text を文末・改行で区切り、空白だけのチャンクを除いて順に返す。"""
+    for m in _SENTENCE_RE.finditer(text):
+        sentence = m.group().strip()
+        if sentence:
+            yield from _split_long(sentence, max_chars)
+
+
+def split_sentences(text, max_chars=MAX_CHUNK_CHARS):
+    return list(iter_sentences(text, max_chars))
+
+
+def iter_batches(chunks, first=1, growth=4, limit=64):
+    """
+    チャンクを送信用のまとまりにする。最初は first 個だけにしてすぐ話し始められるようにし、
+    以降は growth 倍ずつ（limit まで）大きくする。
+    """
+    size = first
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+            size = min(size * growth, limit)
+    if batch:
+        yield batch
@@ -0,0 +1,231 @@
+"""
+サーバー側の音声合成と、合成済み音声のキャッシュ。
+
+ブラウザの SpeechSynthesis は再実行のたびに、端末ごとに同じメールを合成し直す。
+ここではオフラインの合成エンジン（espeak-ng）で WAV を作り、
+(正規化したテキスト, 声の設定, エンジン) のハッシュをファイル名にしてディスクに保存する。
+- 合計サイズが max_bytes を超えたら最後に使われた時刻が古いものから削除する
+- 一覧の次の数通はワーカースレッドで先に合成しておき、選んだ瞬間に再生できるようにする
+"""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+from .metrics import timed
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_PREFETCH_WORKERS = 2
+
+_SPACES = str.maketrans({"\r": " ", "\n": " ", "\t": " "})
+
+
+@dataclass(frozen=True)
+class VoiceSettings:
+    """声の設定。キャッシュのキーに含まれる。"""
+    voice: str = "ja"
+    rate: int = 175   # 1 分あたりの単語数（espeak-ng の -s）
+    pitch: int = 50   # 0〜99（espeak-ng の -p）
+
+
+def normalize_text(text):
+    """読み上げ結果が変わらない違い（全角英数・空白の量）をならす。"""
+    text = unicodedata.normalize("NFKC", text).translate(_SPACES)
+    return " ".join(text.split())
+
+
+def audio_key(backend_name, settings, text):
+    payload = json.dumps([backend_name, asdict(settings), normalize_text(text)],
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSBackend:
+    """合成エンジンの共通インターフェース。synthesize は WAV のバイト列を返す。"""
+    name = "base"
+
+    def available(self):
+        return False
+
+    def synthesize(self, text, settings):
+        raise NotImplementedError
+
+
+class EspeakBackend(TTSBackend):
+    """espeak-ng（無ければ espeak）をサブプロセスで呼び出す。"""
+    name = "espeak-ng"
+
+    def __init__(self, executable=None, timeout=60):
+        self.executable = executable or shutil.which("espeak-ng") or shutil.which("espeak")
+        self.timeout = timeout
+
+    def available(self):
+        return self.executable is not None
+
+    def synthesize(self, text, settings):
+        result = subprocess.run(
+            [self.executable, "-v", settings.voice, "-s", str(settings.rate),
+             "-p", str(settings.pitch), "--stdout", "--stdin"],
+            input=normalize_text(text).encode("utf-8"),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            timeout=self.timeout, check=False,
+        )
+        if result.returncode != 0 or not result.stdout:
+            raise RuntimeError(f"{self.name} failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+        return result.stdout
+
+
+def default_audio_dir():
+    """環境変数 MAIL_AUDIO_CACHE_DIR が無ければ ~/.cache/mail-reader/audio を使う。"""
+    path = os.environ.get("MAIL_AUDIO_CACHE_DIR")
+    if path:
+        return path
+    return os.path.join(os.path.expanduser("~"), ".cache", "mail-reader", "audio")
+
+
+class AudioCache:
+    """
+    ハッシュをファイル名にした音声キャッシュ（<key>.wav）。
+    ファイルの更新時刻を最終参照時刻として使い、超過時は古い順に削除する。
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_audio_dir()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._sizes = {}
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".wav") and entry.is_file():
+                self._sizes[entry.name[:-4]] = entry.stat().st_size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".wav")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def put(self, key, data):
+        # 書きかけのファイルを読まれないよう、一時ファイルに書いてから置き換える
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._sizes[key] = len(data)
+        self._evict()
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def _evict(self):
+        with self._lock:
+            total = sum(self._sizes.values())
+            if total <= self.max_bytes:
+                return
+            target = total - int(self.max_bytes * 0.9)
+            entries = []
+            for key in self._sizes:
+                try:
+                    entries.append((os.stat(self._path(key)).st_mtime, key))
+                except OSError:
+                    entries.append((0, key))
+            entries.sort()
+            freed = 0
+            for _, key in entries:
+                if freed >= target:
+                    break
+                freed += self._sizes.pop(key)
+                try:
+                    os.unlink(self._path(key))
+                except OSError:
+                    pass
+
+
+class TTSRenderer:
+    """キャッシュを通して合成し、先読みの合成をスレッドプールで行う。"""
+
+    def __init__(self, backend, cache, settings=VoiceSettings(), max_workers=DEFAULT_PREFETCH_WORKERS):
+        self.backend = backend
+        self.cache = cache
+        self.settings = settings
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts")
+        self._inflight = {}  # 先読みのジョブキー -> Future
+        self._lock = threading.Lock()
+
+    def key(self, text, settings=None):
+        return audio_key(self.backend.name, settings or self.settings, text)
+
+    def cached(self, text, settings=None):
+        """合成済みなら WAV を、まだなら None を返す（合成はしない）。"""
+        return self.cache.get(self.key(text, settings))
+
+    def render(self, text, settings=None):
+        settings = settings or self.settings
+        key = self.key(text, settings)
+        data = self.cache.get(key)
+        if data is None:
+            with timed("tts_synthesize", chars=len(text)):
+                data = self.backend.synthesize(text, settings)
+            self.cache.put(key, data)
+        return data
+
+    def prefetch(self, job_key, make_text, settings=None):
+        """
+        make_text() でテキストを作って合成するジョブを裏で実行する。
+        同じ job_key のジョブが実行中なら何もしない（本文の取得もここで行える）。
+        """
+        with self._lock:
+            future = self._inflight.get(job_key)
+            if future is not None and not future.done():
+                return future
+            future = self._executor.submit(lambda: self.render(make_text(), settings))
+            self._inflight[job_key] = future
+        future.add_done_callback(lambda f: self._forget(job_key, f))
+        return future
+
+    def _forget(self, job_key, future):
+        with self._lock:
+            if self._inflight.get(job_key) is future:
+                del self._inflight[job_key]
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    """プロセス全体で共有する合成器を返す。合成エンジンが無い環境では None。"""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            backend = EspeakBackend()
+            if not backend.available():
+                return None
+            try:
+                cache = AudioCache()
+            except OSError:
+                cache = AudioCache(os.path.join(tempfile.gettempdir(), "mail-reader-audio"))
+            _renderer = TTSRenderer(backend, cache)
+        return _renderer
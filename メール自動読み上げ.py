@@ -1,12 +1,32 @@
 import streamlit as st
 import os
 from datetime import datetime
-import imaplib
 import email
-from email.header import decode_header, make_header
-import quopri, base64, re, json
-import ssl
+import quopri, re, json
+import hashlib
+import threading
 import time
+from streamlit.runtime import get_instance as get_runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from mailreader.assets import data_uri, publish_image
+from mailreader.core import (
+    Account, cache_account, fetch_gmail_window, fetch_mail_body, fetch_new_mails, fetch_window,
+    imap_connection, imap_host, iter_window, read_text, speech_text,
+)
+from mailreader.engine import FetchJob, fetch_feed, is_auth_error
+from mailreader.fetch import fetch_raw_messages, search_latest_uids, select_mailbox
+from mailreader.gmail import is_gmail_host
+from mailreader.html_text import strip_unreadable
+from mailreader.idle import get_watcher
+from mailreader.metrics import get_registry, start_http_server_from_env, timed
+from mailreader.pagination import PAGE_SIZE, PAGE_SIZES, BrowseState
+from mailreader.parse import decode_mime, get_best_body
+from mailreader.pool import credentials_digest
+from mailreader.resilience import CircuitOpenError, get_retrier
+from mailreader.singleflight import SharedFailure, get_flights
+from mailreader.speech import iter_batches, iter_sentences
+from mailreader.tts import get_renderer
 
 # マルチページサポート設定
 st.set_page_config(
@@ -17,11 +37,6 @@ st.set_page_config(
 )
 
 
-def remove_unreadable(text):
-    # 日本語・英数字・句読点・スペースのみ残す（スラッシュ等も除去）
-    return re.sub(r'[^\u3040-\u30FF\u4E00-\u9FFF\uFF10-\uFF19\uFF21-\uFF3A\uFF41-\uFF5A\u0020-\u007E。、．，・！？\n\r]', '', text)
-
-
 st.markdown("""
     <style>
     @import url('https://fonts.googleapis.com/css2?family=Noto+Sans+JP:wght@700&display=swap');
@@ -34,20 +49,28 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # 変更: 背景適用処理を強化（拡張子判定、複数セレクタ、!important）
+# 画像は static/ に一度だけ書き出して URL で参照する（再実行のたびに画像を送らない）
 bg_name = "unnamed.jpg"
-bg_path = os.path.join(os.path.dirname(__file__), bg_name) if "__file__" in globals() else bg_name
+app_dir = os.path.dirname(os.path.abspath(__file__)) if "__file__" in globals() else "."
+bg_path = os.path.join(app_dir, bg_name)
 if os.path.exists(bg_path):
     try:
-        # 拡張子から MIME を決定
-        ext = os.path.splitext(bg_path)[1].lower().lstrip('.')
-        mime = "jpeg" if ext in ("jpg", "jpeg") else ("png" if ext == "png" else ("webp" if ext=="webp" else "jpeg"))
-        with open(bg_path, "rb") as _f:
-            _b64 = base64.b64encode(_f.read()).decode()
+        if st.get_option("server.enableStaticServing"):
+            asset = publish_image(bg_path, os.path.join(app_dir, "static"))
+            bg_rules = f'background-image: url("{asset["url"]}") !important;'
+            if asset["webp_url"]:
+                # 対応ブラウザでは小さい WebP 版を使う（非対応なら上の指定が残る）
+                bg_rules += (f'\n                background-image: image-set('
+                             f'url("{asset["webp_url"]}") type("image/webp"), '
+                             f'url("{asset["url"]}") type("{asset["mime"]}")) !important;')
+        else:
+            # 静的ファイル配信が無効な環境では従来どおり埋め込む（エンコードは初回のみ）
+            bg_rules = f'background-image: url("{data_uri(bg_path)}") !important;'
         # Streamlit のさまざまなコンテナに効くように複数セレクタに適用し、重要度を高める
         st.markdown(f"""
             <style>
             body, .stApp, .main, .block-container, .css-1d391kg {{
-                background-image: url("data:image/{mime};base64,{_b64}") !important;
+                {bg_rules}
                 background-size: cover !important;
                 background-repeat: no-repeat !important;
                 background-position: center center !important;
@@ -112,74 +135,129 @@ else:
         "読むメールの種類を選んでください",
         ("すべて", "メイン", "広告")
     )
-def fetch_mails(user, password, category="広告", num=10):
+
+# 複数のメールボックス・カテゴリをまとめて取得する設定（任意）
+extra_categories = []
+extra_accounts = []
+if not test_mode:
+    with st.expander("複数のメールボックス・カテゴリをまとめて取得する"):
+        extra_categories = st.multiselect(
+            "一緒に取得するカテゴリ",
+            ("すべて", "メイン", "広告")
+        )
+        accounts_text = st.text_area(
+            "追加のアカウント（1行に「メールアドレス アプリパスワード」）",
+            placeholder="shop@example.com abcd efgh ijkl mnop"
+        )
+        for line in accounts_text.splitlines():
+            parts = line.split()
+            if len(parts) >= 2:
+                # アプリパスワードは空白区切りで表示されるのでそのまま連結する
+                extra_accounts.append((parts[0], " ".join(parts[1:])))
+
+# espeak-ng が使える環境では、サーバー側で合成した音声を再生できる
+use_server_tts = get_renderer() is not None and st.checkbox(
+    "サーバーで音声を合成する（espeak-ng、合成済みの音声はすぐ再生されます）"
+)
+
+# 環境変数 MAIL_METRICS_PORT があれば、処理時間の計測結果を /metrics で配信する
+start_http_server_from_env()
+
+# Gmail の全カテゴリ先読み結果をセッション内で使い回す秒数
+GMAIL_PREFETCH_TTL = 120
+# サーバー合成時に、選択中のメールの次から先に合成しておく通数
+TTS_PREFETCH_COUNT = 3
+
+def fetch_gmail_categories(user, password, num=10, fresh=False):
     """
-    Gmail IMAPからカテゴリ最新num件を取得。
-    Streamlit Cloud 対応: リトライロジック追加
+    Gmail 用: 1回の接続で「すべて」「メイン」「広告」の最新num件をまとめて取得し、
+    {カテゴリ: [メール, ...]} を返す（カテゴリ切り替えは手元で引くだけになる）。
     """
-    mails = []
-    mail = None
-    max_retries = 3
-    
-    for attempt in range(max_retries):
+    key = _retry_key("gmail", user, password, num)
+    host = imap_host(user)
+    with timed("fetch_gmail", host):
+        return _with_retries(lambda: fetch_gmail_window(Account(user, password), num), {},
+                             key, host, fresh)
+
+def prefetch_gmail_categories(user, password, num=10, fresh=False):
+    """
+    fetch_gmail_categories の取得を裏のスレッドで始めておく（表示はしない）。
+    結果は GMAIL_PREFETCH_TTL 秒共有されるので、次の再実行の fetch_gmail_categories は
+    接続せずにそれを使う（取得中ならその完了を待つ）。
+    """
+    key = _retry_key("gmail", user, password, num)
+    fetch = lambda: fetch_gmail_window(Account(user, password), num)
+    threading.Thread(target=_fetch_or_outcome, args=(fetch, key, imap_host(user), fresh),
+                     kwargs={"ttl": GMAIL_PREFETCH_TTL}, daemon=True,
+                     name="gmail-prefetch").start()
+
+def _retry_key(kind, user, password, *params):
+    """
+    再試行・古い結果の管理に使うキー（パスワードも含め、他のセッションの結果を認証なしで見せない）。
+    2 番目の要素（キャッシュ上のアカウント識別子）はサーキットブレーカーの単位にも使う。
+    """
+    return (kind, cache_account(user), credentials_digest(user, password)) + params
+
+def _with_retries(fetch, default, key, host, fresh=False):
+    """
+    取得処理を1回だけ実行し、失敗したら残りの再試行はバックグラウンドに任せる（ここでは待たない）。
+    取得できなかったときは、最後に取得できた結果があればそれを注意書き付きで返し、無ければ default を返す。
+    同じキーの取得が他のセッションで実行中なら、接続せずにその結果を待って使う。
+    """
+    value, outcome = _fetch_or_outcome(fetch, key, host, fresh)
+    if outcome is None:
+        return value
+    return _serve_outcome(outcome, host, default)
+
+def _fetch_or_outcome(fetch, key, host, fresh=False, ttl=None):
+    """
+    _with_retries の取得部分。(結果, None) か、取得できなかったときは (None, Outcome) を返す。
+    Streamlit を呼ばないので、ワーカースレッドからも使える。ttl は結果を他の取得と共有する秒数。
+    """
+    retrier = get_retrier()
+    account = key[1]
+    outcome = retrier.begin(key, host, account)
+    if outcome is None:
         try:
-            imap_host = get_imap_host(user)
-            
-            # Streamlit Cloud 環境を検出
-            is_streamlit_cloud = "streamlit.app" in os.environ.get("STREAMLIT_SERVER_HEADLESS", "")
-            
-            # SSL コンテキスト設定（Streamlit Cloud 互換性対応）
-            context = ssl.create_default_context()
-            context.check_hostname = True
-            context.verify_mode = ssl.CERT_REQUIRED
-            
-            # タイムアウトを長めに設定（Streamlit Cloud のネットワーク遅延対応）
-            timeout = 20 if is_streamlit_cloud else 15
-            
-            mail = imaplib.IMAP4_SSL(imap_host, timeout=timeout, ssl_context=context)
-            mail.login(user, password)
-            
-            # 認証成功後、各操作を実行
-            mail.select('inbox')
-            if category == "すべて":
-                result, data = mail.search(None, 'ALL')
-            elif category == "メイン":
-                result, data = mail.search(None, 'X-GM-RAW', 'category:primary')
-            else:
-                result, data = mail.search(None, 'X-GM-RAW', 'category:promotions')
-            
-            if result != "OK":
-                return []
-            
-            mail_ids = data[0].split()
-            if not mail_ids:
-                return []
-            
-            # 最新num件のIDを取得
-            latest_ids = mail_ids[-num:]
-            for mail_id in reversed(latest_ids):
-                result, msg_data = mail.fetch(mail_id, '(RFC822)')
-                if result != "OK":
-                    continue
-                raw_email = msg_data[0][1]
-                msg = email.message_from_bytes(raw_email)
-                subject = _decode_mime(msg.get("Subject"))
-                from_ = _decode_mime(msg.get("From"))
-                body = _get_best_body(msg)
-                mails.append({
-                    "subject": subject,
-                    "from": from_,
-                    "body": body
-                })
-            return mails
-            
+            value = get_flights().do(key, fetch, fresh=fresh, ttl=ttl)
+        except SharedFailure as e:
+            # 相乗りした取得の失敗は実行したセッションで記録済みなので、二重に数えない
+            outcome = (retrier.begin(key, host, account)
+                       or retrier.failed(key, host, e.error, fetch, account))
         except Exception as e:
-            error_msg = str(e)
-            
-            # 認証エラーはリトライしない
-            if "AUTHENTICATIONFAILED" in error_msg or "Invalid credentials" in error_msg:
-                st.error(f"メール取得エラー: {error_msg}")
-                st.warning("⚠️  認証に失敗しました。以下をご確認ください：\n"
+            # ネットワークエラーはバックグラウンドで再試行（プール内の切れた接続は破棄済み）
+            outcome = retrier.failed(key, host, e, fetch, account)
+        else:
+            retrier.succeeded(key, host, value, account)
+            return value, None
+    return None, outcome
+
+def _serve_outcome(outcome, host, default):
+    """取得を直接行えなかったときの結果を表示用に選び、状況を画面に出す。"""
+    if outcome.fresh:
+        # バックグラウンドの再試行で取得できた
+        return outcome.value
+    if outcome.error is not None and is_auth_error(outcome.error):
+        _show_auth_error(outcome.error)
+        return default
+    # 次の再実行で取り直すよう、一覧のメモを古い扱いにする
+    st.session_state["fetch_degraded"] = True
+    if outcome.circuit_open:
+        status = f"{host} への接続の失敗が続いているため、しばらく接続を止めて回復を待っています"
+    elif outcome.pending:
+        status = f"{host} に接続できませんでした。裏で再接続を試しています"
+    else:
+        status = f"{host} に接続できませんでした"
+    if outcome.stale is not None:
+        fetched = datetime.fromtimestamp(outcome.stale_at).strftime('%H:%M:%S')
+        st.warning(f"⚠️ {status}。{fetched} に取得した一覧を表示しています。（{outcome.error}）")
+        return outcome.stale
+    st.error(f"メール取得エラー: {status}。（{outcome.error}）")
+    return default
+
+def _show_auth_error(e):
+    st.error(f"メール取得エラー: {e}")
+    st.warning("⚠️  認証に失敗しました。以下をご確認ください：\n"
                           "1. メールアドレスが正しいか\n"
                           "2. アプリパスワードが正しいか（通常のパスワードではなく）\n"
                           "3. iPad の日時が正確か\n"
@@ -188,57 +266,81 @@ def fetch_mails(user, password, category="広告", num=10):
                           "・Safari キャッシュをクリアしてから再度アクセス\n"
                           "・Google アカウント > セキュリティで最近のアクティビティを確認\n"
                           "・必要に応じて Streamlit Cloud での新しいセッションを許可")
-                return []
-            
-            # ネットワークエラーはリトライ
-            if attempt < max_retries - 1:
-                wait_time = 2 ** attempt  # 指数バックオフ：2秒、4秒...
-                st.info(f"接続を再試行しています... ({attempt + 1}/{max_retries})")
-                time.sleep(wait_time)
-                continue
-            else:
-                st.error(f"メール取得エラー（複数回試行後）: {error_msg}")
-                return []
-        
-        finally:
-            try:
-                if mail is not None:
-                    mail.logout()
-            except:
-                pass
-
-def remove_unreadable(text):
-    # URLを除去
-    text = re.sub(r'https?://\S+|www\.\S+', '', text)
-    # 日本語・英数字・句読点・スペースのみ残す（記号は除去）
-    text = re.sub(r'[^0-9A-Za-z\u3040-\u30FF\u4E00-\u9FFF。、．，・！？\s\n\r]', '', text)
-    return text
-
-def _decode_mime(s):
-    if s is None:
-        return ""
-    try:
-        # "=?UTF-8?...?=" 形式をまとめてデコード
-        return str(make_header(decode_header(s)))
-    except Exception:
-        return s
 
-# 追加: メールアドレスから適切なIMAPホストを決定するヘルパー
-def get_imap_host(user_email: str) -> str:
+def stream_mails(user, password, category="広告", num=10, headers_only=False, first_body=False,
+                 fresh=False):
     """
-    user_email のドメインに応じてIMAPホストを返す。
-    - ドメインが 'gmail.com' を末尾に含む場合は Gmail の公式ホストを使う（test.6765884.gmail.com 等に対応）
-    - それ以外は簡易的に 'imap.<domain>' を返す（必要なら設定UIを追加してください）
+    カテゴリ最新num件を (番号, 件数, メール) の形で新しい順に、取得でき次第返す。
+    接続はプールから借りて再実行をまたいで使い回す（毎回の TLS + LOGIN を省く）。
+    headers_only=True の場合は件名・差出人・日付だけを取得し、body は None になる
+    （本文は選択されたメールだけ fetch_mail_body で取得する）。
+    first_body=True なら最新の1通だけ本文も同じ接続で取得してから返す（すぐ読み上げられるように）。
+    失敗した場合は再試行をバックグラウンドに任せ、
+    まだ何も返していなければ最後に取得できた一覧を返す。
+    同じ一覧を他のセッションが取得中・取得直後なら、接続せずにその結果をまとめて返す。
     """
-    try:
-        domain = user_email.split('@')[-1].lower()
-    except Exception:
-        domain = ""
-    if domain.endswith("gmail.com"):
-        return "imap.gmail.com"
-    if domain:
-        return f"imap.{domain}"
-    return "imap.gmail.com"
+    key = _retry_key("window", user, password, category, num, headers_only)
+    host = imap_host(user)
+    fetch = lambda: fetch_window(Account(user, password), category, num, headers_only)
+    retrier = get_retrier()
+    account = key[1]
+    outcome = retrier.begin(key, host, account)
+    if outcome is None:
+        flights = get_flights()
+        try:
+            call, shared = flights.acquire(key, fresh)
+        except SharedFailure as e:
+            outcome = (retrier.begin(key, host, account)
+                       or retrier.failed(key, host, e.error, fetch, account))
+        else:
+            if call is None:
+                retrier.succeeded(key, host, shared, account)
+                for i, entry in enumerate(shared):
+                    yield i, len(shared), entry
+                return
+            streamed = []
+            try:
+                for i, total, entry in iter_window(Account(user, password), category, num,
+                                                   headers_only, first_body=first_body):
+                    streamed.append(entry)
+                    yield i, total, entry
+            except Exception as e:
+                flights.fail(key, call, e)
+                outcome = retrier.failed(key, host, e, fetch, account)
+                if streamed:
+                    # 途中まで表示できた分はそのまま使う（残りは再取得ボタンか次の再実行で）
+                    _serve_outcome(outcome, host, [])
+                    return
+            else:
+                # 本文を付けた分も含めて記録する（一覧の形は fetch_window と同じ）
+                flights.finish(key, call, streamed)
+                retrier.succeeded(key, host, streamed, account)
+                return
+            finally:
+                # 表示の途中でセッションが止まった場合も、待っている他のセッションを止めたままにしない
+                flights.abandon(key, call)
+    mails = _serve_outcome(outcome, host, [])
+    for i, entry in enumerate(mails):
+        yield i, len(mails), entry
+
+def fetch_page(user, password, category, page_size, before):
+    """
+    UID が before より小さいメールを新しい順に page_size 件取得する（一覧のページ送り用、ヘッダーのみ）。
+    取得するのはそのページの分だけで、読み込み済みのページは取り直さない。
+    取得できず古い結果も無い場合は None を返す。
+    """
+    key = _retry_key("page", user, password, category, page_size, before)
+    host = imap_host(user)
+    with timed("fetch_page", host):
+        return _with_retries(
+            lambda: fetch_window(Account(user, password), category, page_size, True, before=before),
+            None, key, host)
+
+def _current_session():
+    """(セッションID, セッションが生きているかを返す関数) を返す。"""
+    session_id = get_script_run_ctx().session_id
+    runtime = get_runtime()
+    return session_id, lambda: runtime.is_active_session(session_id)
 
 def get_dummy_mails(category="広告", num=10):
     """
@@ -273,107 +375,25 @@ def get_dummy_mails(category="広告", num=10):
     ]
     return test_mails[:num]
 
-def _html_to_text(html: str) -> str:
-    # 超簡易: タグ除去 & 余分な空白整形（必要ならBeautifulSoupに置換可）
-    text = re.sub(r"(?is)<(script|style).*?>.*?</\1>", "", html)
-    text = re.sub(r"(?is)<br\s*/?>", "\n", text)
-    text = re.sub(r"(?is)</p\s*>", "\n\n", text)
-    text = re.sub(r"(?is)<.*?>", "", text)
-    text = re.sub(r"[ \t]+", " ", text)
-    text = re.sub(r"\n\s*\n\s*\n+", "\n\n", text)
-    return text.strip()
-
-def _get_best_body(msg: email.message.Message) -> str:
-    """
-    text/plain を優先し、無ければ text/html をプレーンテキスト化。
-    """
-    plain = None
-    html = None
-
-    if msg.is_multipart():
-        for part in msg.walk():
-            ctype = part.get_content_type()
-            disp = str(part.get("Content-Disposition") or "")
-            if "attachment" in disp:
-                continue
-            try:
-                payload = part.get_payload(decode=True)
-            except Exception:
-                payload = None
-            charset = part.get_content_charset() or "utf-8"
-
-            if payload is None:
-                # デコードできなかった場合の保険
-                payload = part.get_payload()
-                if isinstance(payload, str):
-                    data = payload
-                else:
-                    data = ""
-            else:
-                try:
-                    data = payload.decode(charset, errors="ignore")
-                except Exception:
-                    data = payload.decode("utf-8", errors="ignore")
-
-            if ctype == "text/plain" and plain is None:
-                plain = data
-            elif ctype == "text/html" and html is None:
-                html = data
-    else:
-        ctype = msg.get_content_type()
-        payload = msg.get_payload(decode=True)
-        charset = msg.get_content_charset() or "utf-8"
-        if payload is None:
-            data = msg.get_payload() if isinstance(msg.get_payload(), str) else ""
-        else:
-            try:
-                data = payload.decode(charset, errors="ignore")
-            except Exception:
-                data = payload.decode("utf-8", errors="ignore")
-
-        if ctype == "text/plain":
-            plain = data
-        elif ctype == "text/html":
-            html = data
-
-    if plain and plain.strip():
-        return plain.strip()
-    if html and html.strip():
-        return _html_to_text(html)
-    return ""
-
-
 def fetch_latest_mail(user, password, category="広告"):
     """
     Gmail IMAPからカテゴリ最新1通を取得。
     """
-    mail = None
     try:
-        imap_host = get_imap_host(user)  # 変更: ホストを決定
-        mail = imaplib.IMAP4_SSL(imap_host)
-        mail.login(user, password)
-        mail.select('inbox')
-        # ▼カテゴリごとに検索条件を切り替え
-        if category == "すべて":
-            result, data = mail.search(None, 'ALL')
-        elif category == "メイン":
-            result, data = mail.search(None, 'X-GM-RAW', 'category:primary')
-        else:  # "広告"
-            result, data = mail.search(None, 'X-GM-RAW', 'category:promotions')
-        if result != "OK":
-            return None
-        mail_ids = data[0].split()
-        if not mail_ids:
-            return None
-        latest_id = mail_ids[-1]
-        result, msg_data = mail.fetch(latest_id, '(RFC822)')
-        if result != "OK":
-            return None
-        raw_email = msg_data[0][1]
+        with imap_connection(Account(user, password)) as mail:
+            box = select_mailbox(mail, 'inbox')
+            # ▼カテゴリごとに検索条件を切り替え
+            mail_uids = search_latest_uids(mail, category, 1, uidnext=box["uidnext"])
+            if not mail_uids:
+                return None
+            latest_uid = mail_uids[-1]
+            raw_email = fetch_raw_messages(mail, [latest_uid]).get(latest_uid)
+            if raw_email is None:
+                return None
         msg = email.message_from_bytes(raw_email)
-        subject = _decode_mime(msg.get("Subject"))
-        from_ = _decode_mime(msg.get("From"))
-        body = _get_best_body(msg)
+        subject = decode_mime(msg.get("Subject"))
+        from_ = decode_mime(msg.get("From"))
+        body = get_best_body(msg)
         return {
             "subject": subject,
             "from": from_,
@@ -382,200 +402,537 @@ def fetch_latest_mail(user, password, category="広告"):
     except Exception as e:
         st.error(f"メール取得エラー: {e}")
         return None
-    finally:
-        try:
-            if mail is not None:
-                mail.logout()
-        except:
-            pass
 
-def speak_component(text_to_say: str):
+SPEECH_CHANNEL_PREFIX = "mail-speech-"
+
+def _speech_player(channel: str):
     """
-    ページに再生ボタンを追加し、自動で押す試みを行う。
-    - 可視ボタン（ユーザーが押せる）と隠しボタン（自動クリック対象）を作る
-    - どちらのクリックでも短い音声を再生してから SpeechSynthesis を行う
-    - 自動クリックは element.click(), MouseEvent dispatch, 繰り返し試行 を行う
+    読み上げキューとボタン（再生・一時停止・再開・スキップ・停止）を持つプレーヤーを置く。
+    中身が毎回同じなので再実行してもiframeは作り直されず、読み上げは途切れない。
+    テキストは _speech_feeder から BroadcastChannel で少しずつ受け取る。
     """
-    safe = json.dumps(text_to_say)  # JS文字列として安全にエスケープ
-
     # 簡易サイレントWAV（短いヘッダのみ）を data URI として使う
     silent_wav = "data:audio/wav;base64,UklGRiQAAABXQVZFZm10IBAAAAABAAEAESsAACJWAAACABAAZGF0YQAAAAA="
 
-    # 変更: height を 0 -> 140 にしてボタンを表示可能にする
     st.components.v1.html(f"""
+        <div id="player" style="font-family:sans-serif;">
+            <button data-action="play">読み上げ再生</button>
+            <button data-action="pause">一時停止</button>
+            <button data-action="resume">再開</button>
+            <button data-action="skip">スキップ</button>
+            <button data-action="stop">停止</button>
+            <span id="status" style="margin-left:8px;color:#555;"></span>
+        </div>
+        <style>
+            #player button {{
+                margin: 4px; padding: 6px 10px; border: none; border-radius: 6px;
+                background: #4CAF50; color: #fff; cursor: pointer;
+                box-shadow: 0 2px 6px rgba(0,0,0,0.2);
+            }}
+        </style>
         <script>
-        (async function(){{
-            const text = {safe};
-            const silent = "{silent_wav}";
-
-            function waitForBody(timeout = 2000) {{
-                return new Promise((resolve) => {{
-                    if (document && document.body) return resolve(document.body);
-                    let resolved = false;
-                    const onReady = () => {{
-                        if (document && document.body) {{
-                            cleanup();
-                            resolved = true;
-                            resolve(document.body);
-                        }}
-                    }};
-                    const cleanup = () => {{
-                        document.removeEventListener('DOMContentLoaded', onReady);
-                        document.removeEventListener('readystatechange', onReady);
-                    }};
-                    document.addEventListener('DOMContentLoaded', onReady);
-                    document.addEventListener('readystatechange', onReady);
-
-                    let waited = 0;
-                    const iv = setInterval(() => {{
-                        if (document && document.body) {{
-                            clearInterval(iv);
-                            cleanup();
-                            if (!resolved) {{
-                                resolved = true;
-                                resolve(document.body);
-                            }}
-                        }}
-                        waited += 100;
-                        if (waited > timeout) {{
-                            clearInterval(iv);
-                            cleanup();
-                            if (!resolved) {{
-                                resolved = true;
-                                resolve(null);
-                            }}
-                        }}
-                    }}, 100);
-                }});
+        (function(){{
+            const synth = window.speechSynthesis;
+            const channel = new BroadcastChannel({json.dumps(channel)});
+            const status = document.getElementById('status');
+            // chunks: 受信済みのチャンク, index: 次に読むチャンク, token: 読み上げ中の発話の識別子
+            let state = {{id: null, born: 0, chunks: [], batches: {{}}, nextSeq: 0,
+                          index: 0, playing: false, paused: false, current: null, token: 0}};
+
+            function render() {{
+                const total = state.chunks.length;
+                let label = total ? `${{Math.min(state.index + (state.current !== null ? 1 : 0), total)}} / ${{total}}` : '';
+                if (state.paused) label += '（一時停止中）';
+                else if (state.playing && state.index >= total && total) label = '読み上げ完了';
+                status.textContent = label;
             }}
 
-            function doSpeakOnce() {{
+            function unlockAudio() {{
+                // 無音音声を再生してオーディオをアンロック
                 try {{
-                    // 無音音声を再生してオーディオをアンロック
                     const audio = document.createElement('audio');
-                    audio.src = silent;
-                    audio.autoplay = true;
-                    audio.playsInline = true;
+                    audio.src = "{silent_wav}";
                     audio.muted = true;
-                    audio.style.width = "1px";
-                    audio.style.height = "1px";
-                    audio.style.opacity = "0";
-                    audio.style.position = "fixed";
-                    audio.style.left = "-9999px";
-                    // append は安全に行う
-                    try {{ (document.body || document.documentElement || document).appendChild(audio); }} catch(e) {{ /* ignore */ }}
-
-                    // 再生試行（Promise拒否は無視）
-                    try {{ audio.play().catch(()=>{{}}); }} catch(e) {{ }}
-
-                    // 少し待ってからSpeechSynthesis
-                    setTimeout(function() {{
-                        try {{
-                            const utter = new SpeechSynthesisUtterance(text);
-                            window.speechSynthesis.cancel();
-                            window.speechSynthesis.speak(utter);
-                        }} catch (e) {{
-                            console.warn('speak failed', e);
-                        }}
-                    }}, 200);
-
-                }} catch (e) {{
-                    console.warn('doSpeakOnce error', e);
-                }}
+                    audio.play().catch(() => {{}});
+                }} catch (e) {{ }}
             }}
 
-            // ボタン作成
-            try {{
-                const body = await waitForBody();
-                const container = body || document.documentElement || document;
-
-                // 可視ボタン（ユーザーが押せる）
-                const btn = document.createElement('button');
-                btn.id = 'streamlit_speak_button';
-                btn.textContent = '読み上げ再生';
-                btn.style.position = 'relative';
-                btn.style.display = 'inline-block';
-                btn.style.margin = '8px';
-                btn.style.padding = '8px 12px';
-                btn.style.borderRadius = '6px';
-                btn.style.background = '#4CAF50';
-                btn.style.color = '#fff';
-                btn.style.border = 'none';
-                btn.style.boxShadow = '0 2px 6px rgba(0,0,0,0.2)';
-                btn.style.cursor = 'pointer';
-
-                // 隠しボタン（自動クリック用）
-                const hidden = document.createElement('button');
-                hidden.id = 'streamlit_speak_button_hidden';
-                hidden.style.position = 'fixed';
-                hidden.style.left = '-9999px';
-                hidden.style.opacity = '0';
-                hidden.style.width = '1px';
-                hidden.style.height = '1px';
-
-                const handler = function(e) {{
-                    e && e.preventDefault && e.preventDefault();
-                    doSpeakOnce();
-                }};
-
-                btn.addEventListener('click', handler);
-                hidden.addEventListener('click', handler);
-
-                try {{ container.appendChild(btn); }} catch(e) {{ /* ignore */ }}
-                try {{ container.appendChild(hidden); }} catch(e) {{ /* ignore */ }}
+            function cancelCurrent() {{
+                // token を進めておくと、cancel で発生する onend/onerror を無視できる
+                state.token++;
+                state.current = null;
+                try {{ synth.cancel(); }} catch (e) {{ }}
+            }}
 
-                // 自動クリックを複数手法で試す
-                const tryAutoClick = () => {{
-                    try {{ hidden.click(); }} catch(e){{}}
-                    try {{ hidden.dispatchEvent(new MouseEvent('click', {{bubbles:true, cancelable:true, view:window}})); }} catch(e){{}}
-                    try {{ btn.click(); }} catch(e){{}}
+            function speakNext() {{
+                if (!state.playing || state.paused || state.current !== null) return render();
+                if (state.index >= state.chunks.length) return render();  // 続きの受信を待つ
+                const token = ++state.token;
+                const utter = new SpeechSynthesisUtterance(state.chunks[state.index]);
+                utter.lang = 'ja-JP';
+                utter.onend = utter.onerror = function() {{
+                    if (token !== state.token) return;
+                    state.current = null;
+                    state.index++;
+                    speakNext();
                 }};
+                state.current = token;
+                try {{ synth.speak(utter); }} catch (e) {{ console.warn('speak failed', e); }}
+                render();
+            }}
 
-                // 即時、アニメフレーム、タイマーで繰り返し試行（計1秒程度）
-                tryAutoClick();
-                requestAnimationFrame(() => tryAutoClick());
-                setTimeout(() => tryAutoClick(), 50);
-                setTimeout(() => tryAutoClick(), 200);
-                setTimeout(() => tryAutoClick(), 500);
+            const actions = {{
+                play() {{
+                    unlockAudio();
+                    cancelCurrent();
+                    if (state.index >= state.chunks.length) state.index = 0;
+                    state.playing = true;
+                    state.paused = false;
+                    speakNext();
+                }},
+                // エンジンによって pause/resume が不安定なので、止めた文を再開時に読み直す
+                pause() {{
+                    if (!state.playing) return;
+                    state.paused = true;
+                    cancelCurrent();
+                    render();
+                }},
+                resume() {{
+                    if (!state.paused) return;
+                    state.paused = false;
+                    speakNext();
+                }},
+                skip() {{
+                    cancelCurrent();
+                    state.index = Math.min(state.index + 1, state.chunks.length);
+                    speakNext();
+                }},
+                stop() {{
+                    cancelCurrent();
+                    state.playing = false;
+                    state.paused = false;
+                    state.index = 0;
+                    render();
+                }},
+            }};
+            document.querySelectorAll('#player button').forEach(function(btn) {{
+                btn.addEventListener('click', function(e) {{
+                    e.preventDefault();
+                    actions[btn.dataset.action]();
+                }});
+            }});
+
+            channel.onmessage = function(ev) {{
+                const m = ev.data;
+                if (!m || m.type !== 'chunks') return;
+                channel.postMessage({{type: 'ack', id: m.id, seq: m.seq}});
+                if (m.id !== state.id) {{
+                    // 古いフィーダーの再送で前のメールに戻らないようにする
+                    if (m.born < state.born) return;
+                    cancelCurrent();
+                    state = {{id: m.id, born: m.born, chunks: [], batches: {{}}, nextSeq: 0,
+                              index: 0, playing: true, paused: false, current: null, token: state.token}};
+                }}
+                if (m.seq < state.nextSeq || m.seq in state.batches) return;
+                state.batches[m.seq] = m.chunks;
+                while (state.nextSeq in state.batches) {{
+                    state.chunks.push(...state.batches[state.nextSeq]);
+                    delete state.batches[state.nextSeq];
+                    state.nextSeq++;
+                }}
+                if (state.chunks.length && state.index === 0 && state.current === null) unlockAudio();
+                speakNext();
+            }};
+        }})();
+        </script>
+    """, height=60)
 
-                // もし自動クリックで動作しなければ、ボタンは残してユーザーが押せるようにする
-            }} catch (e) {{
-                console.warn('speak_component init error', e);
-            }}
+def _speech_feeder(channel: str, speech_id: str, seq: int, chunks):
+    """チャンクのまとまりを 1 つプレーヤーへ送る（受信確認が来るまで再送する）。"""
+    payload = json.dumps({"type": "chunks", "id": speech_id, "seq": seq, "chunks": chunks})
+    payload = payload.replace("</", "<\\/")  # script タグを閉じてしまわないように
+    st.components.v1.html(f"""
+        <script>
+        (function(){{
+            const channel = new BroadcastChannel({json.dumps(channel)});
+            const message = {payload};
+            message.born = performance.timeOrigin + performance.now();
+            let acked = false;
+            channel.onmessage = function(ev) {{
+                const m = ev.data;
+                if (m && m.type === 'ack' && m.id === message.id && m.seq === message.seq) {{
+                    acked = true;
+                    channel.close();
+                }}
+            }};
+            // プレーヤーの読み込みが後になることがあるので、確認が来るまで最大15秒送り直す
+            const started = Date.now();
+            (function send() {{
+                if (acked || Date.now() - started > 15000) return;
+                channel.postMessage(message);
+                setTimeout(send, 250);
+            }})();
         }})();
         </script>
-    """, height=140)
+    """, height=0)
+
+def speak_server_audio(text_to_say: str, key: str = "detail"):
+    """サーバー側で合成した音声を再生する（合成済みならキャッシュから即座に返る）。"""
+    try:
+        with st.spinner("音声を合成しています…"), timed("speech"):
+            audio = get_renderer().render(text_to_say)
+    except Exception as e:
+        st.warning(f"音声の合成に失敗したため、ブラウザで読み上げます: {e}")
+        speak_component(text_to_say, key=key)
+        return
+    st.audio(audio, format="audio/wav", autoplay=True)
+
+def prefetch_speech(mails, idx, credentials, default_user, default_pass):
+    """
+    一覧で選択中のメールの次の数通を裏で合成しておく。
+    本文が未取得のメールは、合成の前に同じワーカーで本文も取得する（結果はキャッシュに残る）。
+    """
+    renderer = get_renderer()
+    for m in mails[idx + 1: idx + 1 + TTS_PREFETCH_COUNT]:
+        mail_user = m.get("account", default_user)
+
+        def make_text(m=m, mail_user=mail_user):
+            body, readable = m["body"], m.get("readable")
+            if body is None:
+                body, readable = fetch_mail_body(
+                    Account(mail_user, credentials.get(mail_user, default_pass)),
+                    m["uid"], uidvalidity=m["uidvalidity"])
+            if readable is None:
+                readable = strip_unreadable(body)
+            return speech_text(m, body, readable)
+
+        job_key = (mail_user.lower(), m.get("uidvalidity"), m.get("uid"), m["subject"])
+        renderer.prefetch(job_key, make_text)
+
+def speak_component(text_to_say: str, key: str = "detail", with_player: bool = True):
+    """
+    文ごとに区切って読み上げる。
+    - プレーヤー（key ごとに 1 つ）を置き、本文はチャンクのまとまりに分けて順に送る
+      （with_player=False ならプレーヤーは置かず、別の場所に置いた同じ key のプレーヤーへ送る）
+    - 最初のまとまりは 1 文だけにして、残りを送っている間にすぐ話し始める
+    - 一時停止・再開・スキップはプレーヤー側のキューで行う
+    """
+    channel = SPEECH_CHANNEL_PREFIX + key
+    with timed("speech"):
+        if with_player:
+            _speech_player(channel)
+        speech_id = hashlib.sha1(text_to_say.encode("utf-8")).hexdigest()[:16]
+        for seq, batch in enumerate(iter_batches(iter_sentences(text_to_say))):
+            _speech_feeder(channel, speech_id, seq, batch)
+
+def load_mails(accounts, categories, category, refresh_nonce=0, fresh=False):
+    """
+    一覧を取得し、(メール一覧, {FetchJob: 例外}) を返す。
+    accounts は [(アドレス, パスワード), ...]、categories は取得するカテゴリ（先頭が選択中のもの）。
+    fresh=True（再取得ボタン）なら、他のセッションが直前に取得した結果も使わずに取り直す。
+    """
+    gmail_user, gmail_pass = accounts[0]
+    if len(accounts) == 1 and len(categories) == 1 and is_gmail_host(imap_host(gmail_user)):
+        # Gmail は全カテゴリを1回で取得してセッションに保持し、切り替えは手元で引くだけにする
+        prefetch_key = (gmail_user.lower(), credentials_digest(gmail_user, gmail_pass), refresh_nonce)
+        prefetched = st.session_state.get("gmail_prefetch")
+        if (prefetched and prefetched["key"] == prefetch_key
+                and time.time() - prefetched["fetched_at"] <= GMAIL_PREFETCH_TTL):
+            if prefetched["mails"] is not None:
+                return prefetched["mails"].get(category, []), {}
+            # 裏で始めた先読みの結果を使う（まだ取得中なら完了を待つ）
+            by_category = fetch_gmail_categories(gmail_user, gmail_pass, num=10)
+            if by_category and not st.session_state.get("fetch_degraded"):
+                st.session_state["gmail_prefetch"] = dict(prefetched, mails=by_category)
+            return by_category.get(category, []), {}
+        # 選択中のカテゴリは取得しながら表示して読み上げを始め、全カテゴリの先読みはその後に裏で行う
+        mails = stream_mail_list(gmail_user, gmail_pass, category, num=10, fresh=fresh)
+        prefetch_gmail_categories(gmail_user, gmail_pass, num=10, fresh=fresh)
+        st.session_state["gmail_prefetch"] = {"key": prefetch_key, "fetched_at": time.time(),
+                                              "mails": None}
+        return mails, {}
+    if len(accounts) == 1 and len(categories) == 1:
+        # 一覧はヘッダーだけ取得し、本文は選択されたメールのみ後から取得する
+        return stream_mail_list(gmail_user, gmail_pass, category, num=10, fresh=fresh), {}
+    # アカウント×カテゴリを並列に取得して日付順の1本のフィードにまとめる
+    jobs = [FetchJob(imap_host(u), u, p, c, 10) for u, p in accounts for c in categories]
+    outcomes = {}
+
+    def fetch_job(job):
+        # 1 アカウントのときと同じく、失敗したら再試行は裏に任せて最後に取得できた一覧を使う
+        # （回路が開いているアカウントへは接続しに行かず、他のセッションと同じ取得には相乗りする）
+        value, outcome = _fetch_or_outcome(
+            lambda: fetch_window(Account(job.user, job.password), job.category, job.num, True),
+            _retry_key("window", job.user, job.password, job.category, job.num, True),
+            job.host, fresh)
+        if outcome is None:
+            return value
+        if outcome.fresh:
+            return outcome.value
+        outcomes[job] = outcome
+        if outcome.stale is None or is_auth_error(outcome.error):
+            raise outcome.error or CircuitOpenError(job.host)
+        return outcome.stale
+
+    progress = st.progress(0.0, text="メールを取得しています…")
+    with timed("fetch_feed"):
+        result = fetch_feed(
+            jobs, fetch_job, retries=1,
+            on_progress=lambda done, total, job: progress.progress(
+                done / total, text=f"{job.user}（{job.category}）を取得しました（{done}/{total}）")
+        )
+    progress.empty()
+    for job, outcome in outcomes.items():
+        if outcome.stale is not None and not is_auth_error(outcome.error):
+            # 古い一覧を使ったジョブは注意書きを出す（取得できなかったジョブは呼び出し側で表示する）
+            _serve_outcome(outcome, f"{job.host}（{job.user}）", [])
+        elif not is_auth_error(outcome.error):
+            st.session_state["fetch_degraded"] = True
+    return result
+
+def stream_mail_list(user, password, category, num=10, fresh=False):
+    """
+    一覧を取得しながら表示する。件名は届いた順に並べ、
+    最新の1通は本文も先に取得して、残りを取得している間に読み上げを始める。
+    """
+    progress = st.progress(0.0, text="メールを取得しています…")
+    listing = st.empty()
+    early_speech = st.empty()
+    mails = []
+    # 一覧の取得全体（最初の1通の本文・表示を含む）の所要時間
+    with timed("fetch_list", imap_host(user)):
+        for i, total, entry in stream_mails(user, password, category, num=num,
+                                            headers_only=True, first_body=True, fresh=fresh):
+            mails.append(entry)
+            if len(mails) == 1 and entry["body"] is not None:
+                to_read = speech_text(entry, entry["body"], entry["readable"])
+                if use_server_tts:
+                    # 合成だけ先に始めておき、一覧の表示後にキャッシュから再生する
+                    get_renderer().prefetch(("early", to_read), lambda: to_read)
+                else:
+                    # 一覧表示後の読み上げと同じ内容なので、プレーヤー側で二重に読まれることはない
+                    with early_speech.container():
+                        speak_component(to_read, with_player=False)
+            progress.progress((i + 1) / total, text=f"メールを取得しています…（{i + 1}/{total}）")
+            listing.markdown("\n".join(
+                f"{n + 1}. {strip_unreadable(m['subject'])}" for n, m in enumerate(mails)
+            ))
+    progress.empty()
+    listing.empty()
+    return mails
+
+def _browse_page(browse, category):
+    """
+    ページ送りの操作欄を表示し、表示するページの (開始位置, メール) を返す。
+    読み込み済みの範囲を超えたページに移ったときだけ、そのページの分を取得する。
+    """
+    page_size = st.session_state.get("page_size", PAGE_SIZE)
+    if browse.needs_older(page_size):
+        with st.spinner("古いメールを取得しています…"):
+            page = fetch_page(gmail_user, gmail_pass, category, page_size, browse.cursor)
+        if page is None:
+            # 取得できなかった（エラーは表示済み）ので、読み込み済みの範囲を表示する
+            browse.clamp(page_size)
+        elif not browse.extend(page, page_size):
+            # UIDVALIDITY が変わった（受信箱が作り直された）ので最初から読み込み直す
+            st.session_state.pop("browse", None)
+            st.session_state["refresh_nonce"] = st.session_state.get("refresh_nonce", 0) + 1
+            st.rerun(scope="app")
+    start, end = browse.window(page_size)
+    newer_col, info_col, older_col = st.columns([1, 2, 1])
+    # on_click で位置を動かしてから再実行するので、ボタンの有効・無効は常に最新の位置で決まる
+    newer_col.button("＜ 新しいメール", disabled=not browse.can_go_newer(),
+                     on_click=browse.move, args=(-1, page_size))
+    older_col.button("古いメール ＞", disabled=not browse.can_go_older(page_size),
+                     on_click=browse.move, args=(1, page_size))
+    info_col.caption(f"{start + 1}〜{end} 通目（読み込み済み {len(browse.mails)} 通）")
+    return start, browse.mails[start:end]
+
+@st.fragment
+def mail_panel(mails, credentials, browse=None):
+    """
+    件名の選択と本文の表示・読み上げ。
+    別の件名を選んでもこの部分だけが再実行され、一覧の取得や画面全体の描画はやり直さない。
+    browse（BrowseState）があれば古いメールへのページ送りができ、選択欄には表示中のページ分だけを並べる。
+    """
+    start = 0
+    if browse is not None:
+        start, mails = _browse_page(browse, category)
+        if not mails:
+            st.write("これより古いメールはありません。")
+            return
+    # 件名一覧を表示して選択（複数アカウントのときは宛先アカウントも表示）
+    multi_account = len({m.get("account") for m in mails}) > 1
+    subjects = [
+        f"{start + i + 1}. " + (f"[{m['account']}] " if multi_account else "")
+        + strip_unreadable(m['subject'])
+        for i, m in enumerate(mails)
+    ]
+    selected = st.selectbox("読み上げるメールを選んでください", subjects)
+    idx = subjects.index(selected)
+    mail = mails[idx]
+    subject = mail["subject"] or "(件名なし)"
+    from_ = mail["from"] or "(差出人不明)"
+    body = mail["body"]
+    readable_body = mail.get("readable")
+    if body is None:
+        mail_user = mail.get("account", gmail_user)
+        mail_pass = credentials.get(mail_user, gmail_pass)
+        # 取得済みの本文はセッション内で使い回す
+        body_cache = st.session_state.setdefault("mail_bodies", {})
+        cache_key = (mail_user.lower(), mail["uidvalidity"], mail["uid"])
+        if cache_key not in body_cache:
+            try:
+                body_cache[cache_key] = fetch_mail_body(Account(mail_user, mail_pass), mail["uid"],
+                                                        uidvalidity=mail["uidvalidity"])
+            except Exception as e:
+                # 失敗は記録せず、次の再実行で取り直す
+                st.error(f"本文の取得に失敗しました: {e}")
+        body, readable_body = body_cache.get(cache_key) or ("", "")
+    if readable_body is None:
+        readable_body = strip_unreadable(body)
+
+    from_masked = re.sub(r'<.*?>', '<***>', from_)
+
+    st.write(f"**差出人**: {from_masked}")
+    st.write(f"**件名**: {subject}")
+    st.write("**本文（先頭）**:")
+    st.write((body[:500] + "…") if len(body) > 500 else (body or "(本文なし)"))
+
+    to_read = speech_text(mail, body, readable_body)
+    if use_server_tts:
+        speak_server_audio(to_read)
+        prefetch_speech(mails, idx, credentials, gmail_user, gmail_pass)
+    else:
+        # プレーヤーは一覧の上に置いてあるので、ここでは文章を送るだけ
+        speak_component(to_read, with_player=False)
+
+    now = datetime.now()
+    st.caption(f"取得時刻: {now.strftime('%Y-%m-%d %H:%M:%S')}")
 
 if test_mode or (gmail_user and gmail_pass):
+    if not use_server_tts:
+        # 一覧の取得中から読み上げを始められるよう、プレーヤーは一覧より先に置く
+        _speech_player(SPEECH_CHANNEL_PREFIX + "detail")
     if test_mode:
         mails = get_dummy_mails(category, num=10)
+        credentials = {}
     else:
-        mails = fetch_mails(gmail_user, gmail_pass, category, num=10)
-    
+        accounts = [(gmail_user, gmail_pass)] + extra_accounts
+        categories = [category] + [c for c in extra_categories if c != category]
+        credentials = dict(accounts)
+        refresh = st.button("メールを再取得")
+        if refresh:
+            st.session_state["refresh_nonce"] = st.session_state.get("refresh_nonce", 0) + 1
+        refresh_nonce = st.session_state.get("refresh_nonce", 0)
+        # 一覧はアカウント・カテゴリ・再取得ボタンが変わったときだけ取得し直す
+        list_key = (tuple((u.lower(), credentials_digest(u, p)) for u, p in accounts),
+                    tuple(categories), refresh_nonce)
+        loaded = st.session_state.get("mail_list")
+        if not loaded or loaded["key"] != list_key or loaded["degraded"]:
+            st.session_state["fetch_degraded"] = False
+            mails, errors = load_mails(accounts, categories, category, refresh_nonce, fresh=refresh)
+            # 接続できずに古い一覧を出している場合は、次の再実行で取り直す
+            degraded = st.session_state["fetch_degraded"]
+            loaded = {"key": list_key, "mails": mails, "errors": errors, "degraded": degraded,
+                      "retry_version": get_retrier().version}
+            # 空の結果（取得失敗を含む）は保持せず、次の再実行で取り直す
+            if mails:
+                st.session_state["mail_list"] = loaded
+        mails = loaded["mails"]
+        for job, e in loaded["errors"].items():
+            st.error(f"{job.user}（{job.category}）の取得に失敗しました: {e}")
+        if loaded["degraded"]:
+            @st.fragment(run_every=5)
+            def recovery_watcher(seen_version):
+                # バックグラウンドの再試行・回復確認で結果が得られたら画面全体を描き直す
+                if get_retrier().version != seen_version:
+                    st.rerun()
+
+            recovery_watcher(loaded["retry_version"])
+
     if not mails:
         st.write("まだメールが届いていないか、取得に失敗しました。")
+    elif test_mode or len(accounts) > 1:
+        mail_panel(mails, credentials)
     else:
-        # 件名一覧を表示して選択
-        subjects = [f"{i+1}. {remove_unreadable(m['subject'])}" for i, m in enumerate(mails)]
-        selected = st.selectbox("読み上げるメールを選んでください", subjects)
-        idx = subjects.index(selected)
-        mail = mails[idx]
-        subject = mail["subject"] or "(件名なし)"
-        from_ = mail["from"] or "(差出人不明)"
-        body = mail["body"]
-
-        from_masked = re.sub(r'<.*?>', '<***>', from_)
-
-        st.write(f"**差出人**: {from_masked}")
-        st.write(f"**件名**: {subject}")
-        st.write("**本文（先頭）**:")
-        st.write((body[:500] + "…") if len(body) > 500 else (body or "(本文なし)"))
-
-        to_read = f"差出人: {from_masked}。件名: {subject}。本文: {body}" if body else f"差出人: {from_masked}。件名: {subject}。"
-        to_read = remove_unreadable(to_read)
-        speak_component(to_read)
-
-        now = datetime.now()
-        st.caption(f"取得時刻: {now.strftime('%Y-%m-%d %H:%M:%S')}")
+        # 1 アカウントのときは、取得済みの一覧を先頭ページにして古いメールへページ送りできる
+        st.selectbox("1ページの件数", PAGE_SIZES, key="page_size")
+        browse_key = (loaded["key"], category)
+        browse = st.session_state.get("browse")
+        if browse is None or browse.key != browse_key:
+            browse = BrowseState.start(browse_key, mails)
+            st.session_state["browse"] = browse
+        mail_panel(mails, credentials, browse)
+
+    if not test_mode:
+        # IDLE で新着を待ち受け、届いたメールだけを取得して読み上げる
+        watch_new = st.checkbox("新着メールを自動で読み上げる")
+        session_id, session_alive = _current_session()
+        if watch_new:
+            @st.fragment(run_every=5)
+            def new_mail_panel():
+                # 5 秒ごとに確認するのはメモリ上のキューだけで、IMAP への通信は発生しない
+                watcher = get_watcher(imap_host(gmail_user), gmail_user, gmail_pass,
+                                      session_id, alive=session_alive)
+                st.session_state["idle_watcher"] = watcher
+                new_uids = watcher.drain(session_id)
+                if new_uids:
+                    try:
+                        new_mails = fetch_new_mails(Account(gmail_user, gmail_pass), category, new_uids)
+                    except Exception as e:
+                        # 取り出した UID は戻しておき、次の確認で取り直す
+                        watcher.requeue(session_id, new_uids)
+                        st.error(f"新着メールの取得に失敗しました: {e}")
+                        new_mails = []
+                    if new_mails:
+                        st.session_state["latest_new_mails"] = new_mails
+                        st.toast(f"新着メール {len(new_mails)} 件")
+                latest_mails = st.session_state.get("latest_new_mails")
+                if latest_mails:
+                    # 同時に届いた新着は新しい順に続けて読み上げる
+                    texts = []
+                    for latest in latest_mails:
+                        latest_from = re.sub(r'<.*?>', '<***>', latest["from"] or "(差出人不明)")
+                        latest_subject = latest["subject"] or "(件名なし)"
+                        st.write(f"**新着**: {latest_subject}（{latest_from}）")
+                        texts.append(read_text(latest_from, latest_subject,
+                                               latest["body"], latest["readable"]))
+                    latest_text = "\n".join(texts)
+                    if use_server_tts:
+                        speak_server_audio(latest_text, key="new")
+                    else:
+                        speak_component(latest_text, key="new")
+
+            new_mail_panel()
+        elif "idle_watcher" in st.session_state:
+            st.session_state.pop("idle_watcher").unsubscribe(session_id)
 else:
-    st.info("Gmailアドレスとアプリパスワードを入力してください。")
\ No newline at end of file
+    st.info("Gmailアドレスとアプリパスワードを入力してください。")
+
+# 開発者向け: 接続・LOGIN・SEARCH・FETCH・解析・読み上げ準備の所要時間
+if st.checkbox("処理時間の計測結果を表示（開発者向け）"):
+    registry = get_registry()
+    rows = registry.snapshot()
+    if rows:
+        st.dataframe([
+            {"段階": r["phase"], "ホスト": r["host"] or "-", "回数": r["count"],
+             "平均(ms)": round(r["avg"] * 1000, 1), "p50(ms)": round(r["p50"] * 1000, 1),
+             "p95(ms)": round(r["p95"] * 1000, 1), "最大(ms)": round(r["max"] * 1000, 1)}
+            for r in rows
+        ], use_container_width=True)
+    else:
+        st.write("まだ計測結果がありません。")
+    counters = registry.counters()
+    if counters:
+        # MAIL_IMAP_COMPRESS 使用時の通信量（wire: 回線上、plain: 展開後）
+        st.dataframe([
+            {"項目": c["name"], "ホスト": c["host"] or "-",
+             "向き": c["labels"].get("direction", "-"), "KB": round(c["value"] / 1024, 1)}
+            for c in counters
+        ], use_container_width=True)
+    with st.expander("Prometheus 形式"):
+        st.code(registry.render_prometheus(), language="text")
+    if st.button("計測結果をリセット"):
+        registry.reset()
+        st.rerun()
\ No newline at end of file